@@ -53,6 +53,23 @@ CREATE TABLE IF NOT EXISTS `db_sync_config` (
   KEY `idx_priority` (`priority`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='数据库同步配置表';
 
+-- 创建数据库监控历史表 (DatabaseMonitor 按时间段聚合后的采样)
+CREATE TABLE IF NOT EXISTS `db_monitor_history` (
+  `id` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  `bucket_start` datetime NOT NULL COMMENT '聚合时间段开始时间',
+  `bucket_seconds` int(11) NOT NULL COMMENT '聚合时间段长度(秒)',
+  `samples` int(11) NOT NULL DEFAULT '0' COMMENT '采样次数',
+  `connections_avg` decimal(10,2) DEFAULT NULL COMMENT '平均连接数',
+  `connections_max` int(11) DEFAULT NULL COMMENT '最大连接数',
+  `running_avg` decimal(10,2) DEFAULT NULL COMMENT '平均运行中线程数',
+  `qps_avg` decimal(12,3) DEFAULT NULL COMMENT '平均每秒查询数',
+  `qps_max` decimal(12,3) DEFAULT NULL COMMENT '最大每秒查询数',
+  `slow_queries_per_sec` decimal(12,4) DEFAULT NULL COMMENT '平均每秒慢查询数',
+  `created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_bucket` (`bucket_start`, `bucket_seconds`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='数据库监控历史表';
+
 -- 插入默认同步配置(需要根据实际表结构调整)
 INSERT INTO `db_sync_config` (`table_name`, `sync_enabled`, `sync_type`, `sync_direction`, `priority`) VALUES
 ('stores', 1, 'FULL', 'REMOTE_TO_LOCAL', 95),
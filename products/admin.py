@@ -1,33 +1,56 @@
 # products/admin.py
 
+import json
+
 from django import forms
+from django.conf import settings
 from django.contrib import admin, messages
 from django.db import models
-from django.shortcuts import redirect
+from django.shortcuts import get_object_or_404, redirect
 from django.template.loader import render_to_string
-from django.urls import path
+from django.urls import path, reverse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
+from django_q.tasks import async_task
+from tiktok_pm_project.task_queues import queue_options
 
 # 🌟 从新文件导入表单 🌟
-from .forms import ProductAdminForm
+from .forms import ProductAdminForm, ProductBulkActionForm
 
 # 导入模型
 from .models import ProductTagDefinition  # <--- 别忘了导入这个新模型
 from .models import (
+    AIAnalysisJob,
     AIContentItem,
+    AIGeneration,
+    BulkOperation,
     Product,
     ProductImage,
     ProductReview,
+    ProductRollup,
     ProductVariation,
     ProductVideo,
+    ScrapeJob,
+    ScrapeRequest,
+    RequestProfile,
     Store,
+    TaskRun,
 )
-from .services.product_media_downloader import download_all_product_images
+from .services.ai_content import group_items_by_type, latest_content_items
+from .services.bulk_actions import submit_bulk_action
+from .services.product_rollups import analytics_summary
+from .services.scrape_metrics import scrape_latency_stats
+from .services.task_metrics import TASK_METRIC_WINDOWS, task_metrics
 from .utils import format_json_to_html
 
 # 导入视图和服务
-from .views import export_product_json_view, n8n_analyze_view, product_fetch_view
+from .views import (
+    export_product_json_view,
+    media_zip_response,
+    n8n_analyze_status_view,
+    n8n_analyze_view,
+    product_fetch_view,
+)
 
 
 # ----------------------------------------------------------------------
@@ -406,6 +429,18 @@ class ProductAdmin(admin.ModelAdmin):
 
     metrics_display.short_description = "Shop Performance Metrics"
 
+    def raw_payload_display(self, obj):
+        # 原始记录只在详情页按需加载
+        raw = obj.get_raw_json()
+        if raw is None:
+            return "-"
+        return format_html(
+            "<pre style='max-height: 400px; overflow: auto;'>{}</pre>",
+            json.dumps(raw, ensure_ascii=False, indent=2, default=str),
+        )
+
+    raw_payload_display.short_description = "Raw JSON (含 input)"
+
     # === 配置列表页 ===
     list_display = (
         "product_thumbnail",
@@ -431,6 +466,22 @@ class ProductAdmin(admin.ModelAdmin):
 
     list_per_page = 15
 
+    def get_queryset(self, request):
+        # 旧数据的 raw_json / input 较大，列表和详情页都不读取 (原始记录按需加载)
+        return super().get_queryset(request).defer("raw_json", "input")
+
+    # === 批量操作 (集合式 UPDATE / 后台任务，不逐个调用 save()) ===
+    action_form = ProductBulkActionForm
+    actions = [
+        "add_tag_to_selected",
+        "remove_tag_from_selected",
+        "mark_available",
+        "mark_unavailable",
+        "download_images_for_selected",
+        "export_media_zip",
+        "analyze_selected",
+    ]
+
     # ============================================================
     # 🌟 配置：更新 Fieldsets 布局
     # ============================================================
@@ -516,8 +567,7 @@ class ProductAdmin(admin.ModelAdmin):
             {
                 "classes": ("collapse",),
                 "fields": (
-                    "input",
-                    "raw_json",
+                    "raw_payload_display",
                     "tags",
                     "colors",
                     "sizes",
@@ -526,7 +576,7 @@ class ProductAdmin(admin.ModelAdmin):
                 ),
             },
         ),
-        ("AI 智能工作台", {"fields": ("ai_content_dashboard",)}),
+        ("AI 智能工作台", {"fields": ("ai_analysis_status", "ai_content_dashboard")}),
     )
 
     inlines = [ProductVariationInline, ProductImageInline, ProductVideoInline, ProductReviewInline]
@@ -546,6 +596,8 @@ class ProductAdmin(admin.ModelAdmin):
         "sizes_display",
         "specifications_display",
         "metrics_display",
+        "raw_payload_display",
+        "ai_analysis_status",
         "ai_content_dashboard",
     )
 
@@ -574,6 +626,11 @@ class ProductAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(n8n_analyze_view),
                 name=f"{base_name}_n8n_analyze",
             ),
+            path(
+                "<int:product_id>/n8n-analyze/status/",
+                self.admin_site.admin_view(n8n_analyze_status_view),
+                name=f"{base_name}_n8n_analyze_status",
+            ),
             path(
                 "product_fetch/",
                 self.admin_site.admin_view(product_fetch_view),
@@ -583,20 +640,119 @@ class ProductAdmin(admin.ModelAdmin):
         return custom_urls + urls
 
     def download_images(self, request, product_id):
-        product = Product.objects.get(pk=product_id)
-        target_dir, summary = download_all_product_images(product)
+        product = get_object_or_404(Product, pk=product_id)
+        # 图片较多时下载耗时较长，交给 django-q 后台执行，不阻塞 admin 请求
+        async_task("products.tasks.download_product_images_task", product.pk, **queue_options("media"))
         messages.success(
             request,
-            f"下载完成：商品图片 {summary['product_images']} 张，SKU 图片 {summary['variation_images']} 张，详情图片 {summary['desc_images']} 张。",
+            f"已提交后台下载任务：产品 {product.source_id} 的图片将保存到 {settings.PRODUCT_MEDIA_DOWNLOAD_ROOT}，"
+            "重复执行会跳过已下载的文件并续传未完成的文件。",
+        )
+        return redirect(request.META.get("HTTP_REFERER") or "..")
+
+    # ============================================================
+    # 🌟 批量操作 Actions
+    # ============================================================
+    def _submit_bulk(self, request, queryset, action, params=None):
+        product_ids = list(queryset.values_list("pk", flat=True))
+        operation, affected = submit_bulk_action(
+            action, product_ids, params, created_by=request.user.get_username()
+        )
+        if operation:
+            messages.info(
+                request,
+                f"已提交后台批量任务 #{operation.pk}（{operation.total} 个产品），可在 Bulk Operations 中查看进度。",
+            )
+        else:
+            messages.success(request, f"批量操作完成：共 {len(product_ids)} 个产品，影响 {affected} 个。")
+
+    def _selected_tag(self, request):
+        tag = request.POST.get("tag")
+        if not tag:
+            messages.warning(request, "请先在操作栏中选择一个 Tag。")
+        return tag
+
+    @admin.action(description="为所选产品添加 Tag")
+    def add_tag_to_selected(self, request, queryset):
+        tag = self._selected_tag(request)
+        if tag:
+            self._submit_bulk(request, queryset, "add_tags", {"tags": [tag]})
+
+    @admin.action(description="从所选产品移除 Tag")
+    def remove_tag_from_selected(self, request, queryset):
+        tag = self._selected_tag(request)
+        if tag:
+            self._submit_bulk(request, queryset, "remove_tags", {"tags": [tag]})
+
+    @admin.action(description="设置所选产品为上架 (available)")
+    def mark_available(self, request, queryset):
+        self._submit_bulk(request, queryset, "set_available", {"available": True})
+
+    @admin.action(description="设置所选产品为下架 (unavailable)")
+    def mark_unavailable(self, request, queryset):
+        self._submit_bulk(request, queryset, "set_available", {"available": False})
+
+    @admin.action(description="后台下载所选产品的图片")
+    def download_images_for_selected(self, request, queryset):
+        self._submit_bulk(request, queryset, "download_media")
+
+    @admin.action(description="打包下载所选产品的图片 (ZIP)")
+    def export_media_zip(self, request, queryset):
+        limit = getattr(settings, "MEDIA_EXPORT_MAX_PRODUCTS", 500)
+        if queryset.count() > limit:
+            messages.error(request, f"一次最多导出 {limit} 个产品的图片")
+            return None
+        return media_zip_response(queryset.order_by("id"))
+
+    @admin.action(description="后台发送所选产品给 AI (n8n) 分析")
+    def analyze_selected(self, request, queryset):
+        self._submit_bulk(
+            request, queryset, "ai_analyze", {"requested_by": request.user.get_username()}
+        )
+
+    def ai_analysis_status(self, obj):
+        """显示最近一次 AI 分析任务的状态；任务未结束时轮询状态接口，结束后自动刷新页面"""
+        if not obj or not obj.pk:
+            return "-"
+
+        job = obj.ai_jobs.order_by("-id").first()
+        if not job:
+            return "暂无 AI 分析任务"
+
+        html = format_html(
+            '<span class="status-tag">#{} {}</span> <span style="color:#999;">{}</span> {}',
+            job.pk,
+            job.get_status_display(),
+            job.created_at.strftime("%Y-%m-%d %H:%M:%S") if job.created_at else "",
+            job.error,
         )
-        return redirect(request.META.get("HTTP_REFERER"))
+
+        if job.is_open:
+            status_url = reverse("admin:products_product_n8n_analyze_status", args=[obj.pk])
+            html += format_html(
+                """
+                <script>
+                    (function poll() {{
+                        setTimeout(function () {{
+                            fetch("{}").then(function (r) {{ return r.json(); }}).then(function (data) {{
+                                if (data.is_open) {{ poll(); }} else {{ window.location.reload(); }}
+                            }});
+                        }}, 5000);
+                    }})();
+                </script>
+                """,
+                status_url,
+            )
+        return html
+
+    ai_analysis_status.short_description = "AI 分析任务"
 
     def ai_content_dashboard(self, obj):
         """
         渲染 AI 内容聚合面板
         """
-        # 1. 获取该产品所有的 AI Item
-        items = obj.ai_items.all().order_by("option_index")
+        # 1. 只取每个类型/模型最新一次生成的内容 (历史版本保留在表中，不在面板展示)
+        items = latest_content_items([obj.pk]).order_by("content_type", "option_index")
 
         # 2. 按类型分组
         # 定义我们需要展示的顺序和标题
@@ -607,12 +763,7 @@ class ProductAdmin(admin.ModelAdmin):
             ("img_prompt", "🎨 图片提示词"),
             ("vid_prompt", "🎥 视频提示词"),
         ]
-
-        grouped_data = []
-        for type_key, type_name in groups_config:
-            # 筛选出属于该类型的 items
-            group_items = [i for i in items if i.content_type == type_key]
-            grouped_data.append((type_key, type_name, group_items))
+        grouped_data = group_items_by_type(items, groups_config)
 
         # 3. 渲染模板
         context = {"grouped_items": grouped_data}
@@ -646,8 +797,247 @@ class ProductImageAdmin(admin.ModelAdmin):
 
 @admin.register(AIContentItem)
 class AIContentItemAdmin(admin.ModelAdmin):
-    list_display = ("id", "content_zh", "content_en", "created_at")
+    list_display = ("id", "content_zh", "content_en", "is_latest", "created_at")
+    list_filter = ("is_latest", "content_type")
+    raw_id_fields = ("product", "generation")
+
+
+@admin.register(AIGeneration)
+class AIGenerationAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "product",
+        "ai_model",
+        "prompt_version",
+        "item_count",
+        "duration_ms",
+        "completed_at",
+    )
+    list_filter = ("ai_model", "prompt_version")
+    search_fields = ("product__source_id",)
+    raw_id_fields = ("product", "job")
+
+
+@admin.register(AIAnalysisJob)
+class AIAnalysisJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "product",
+        "status",
+        "requested_by",
+        "created_at",
+        "submitted_at",
+        "completed_at",
+    )
+    list_filter = ("status",)
+    search_fields = ("product__source_id",)
     raw_id_fields = ("product",)
+    readonly_fields = ("updated_fields", "error", "created_at", "submitted_at", "completed_at")
+
+
+@admin.register(BulkOperation)
+class BulkOperationAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "action",
+        "status",
+        "progress_display",
+        "total",
+        "affected",
+        "created_by",
+        "created_at",
+        "finished_at",
+    )
+    list_filter = ("action", "status")
+    exclude = ("product_ids",)
+    readonly_fields = (
+        "action",
+        "params",
+        "total",
+        "processed",
+        "affected",
+        "status",
+        "error",
+        "created_by",
+        "created_at",
+        "finished_at",
+    )
+
+    def progress_display(self, obj):
+        return f"{obj.processed}/{obj.total} ({obj.progress_percent}%)"
+
+    progress_display.short_description = "Progress"
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ScrapeJob)
+class ScrapeJobAdmin(admin.ModelAdmin):
+    """采集任务队列；列表页顶部显示各采集模式的耗时统计"""
+
+    change_list_template = "admin/products/scrapejob/change_list.html"
+    list_display = (
+        "id",
+        "snapshot_id",
+        "collection_mode",
+        "status",
+        "remote_status",
+        "inputs_count",
+        "record_count",
+        "imported_count",
+        "triggered_at",
+        "time_to_import_display",
+        "next_poll_at",
+    )
+    list_filter = ("status", "collection_mode")
+    search_fields = ("snapshot_id",)
+    readonly_fields = [field.name for field in ScrapeJob._meta.fields]
+
+    def inputs_count(self, obj):
+        return len(obj.inputs or [])
+
+    inputs_count.short_description = "Inputs"
+
+    def time_to_import_display(self, obj):
+        duration = obj.time_to_import
+        return f"{duration.total_seconds():.0f}s" if duration else "-"
+
+    time_to_import_display.short_description = "Time to import"
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["latency_days"] = 7
+        extra_context["latency_stats"] = scrape_latency_stats(days=7)
+        extra_context["active_jobs"] = ScrapeJob.objects.filter(
+            status__in=ScrapeJob.ACTIVE_STATUSES
+        ).count()
+        return super().changelist_view(request, extra_context=extra_context)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ProductRollup)
+class ProductRollupAdmin(admin.ModelAdmin):
+    """按分类 / 店铺 / 天的产品汇总；列表页顶部显示最近一天的汇总仪表盘 (带缓存)"""
+
+    change_list_template = "admin/products/productrollup/change_list.html"
+    list_display = (
+        "day",
+        "dimension",
+        "label",
+        "product_count",
+        "sold_total",
+        "in_stock_ratio",
+        "price_median",
+        "price_p95",
+    )
+    list_filter = ("dimension", "day")
+    search_fields = ("label", "key")
+    readonly_fields = [field.name for field in ProductRollup._meta.fields]
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["analytics"] = [
+            analytics_summary("category", limit=20),
+            analytics_summary("store", limit=20),
+        ]
+        return super().changelist_view(request, extra_context=extra_context)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(TaskRun)
+class TaskRunAdmin(admin.ModelAdmin):
+    """django-q 任务执行记录；列表页顶部显示按任务函数汇总的指标和队列积压 (带缓存)"""
+
+    change_list_template = "admin/products/taskrun/change_list.html"
+    list_display = ("stopped_at", "func", "queue", "success", "duration", "lag")
+    list_filter = ("success", "queue", "stopped_at")
+    search_fields = ("func", "task_id")
+    readonly_fields = [field.name for field in TaskRun._meta.fields]
+
+    def changelist_view(self, request, extra_context=None):
+        window = request.GET.get("window", "1h")
+        if window not in TASK_METRIC_WINDOWS:
+            window = "1h"
+        # window 不是模型字段，交给 ChangeList 前去掉，避免被当作过滤条件
+        request.GET = request.GET.copy()
+        request.GET.pop("window", None)
+        extra_context = extra_context or {}
+        extra_context["task_metrics"] = task_metrics(window)
+        extra_context["task_metric_windows"] = list(TASK_METRIC_WINDOWS)
+        return super().changelist_view(request, extra_context=extra_context)
+
+    def has_add_permission(self, request):
+        return False
+
+
+class OverBudgetFilter(admin.SimpleListFilter):
+    title = "Budget"
+    parameter_name = "over_budget"
+
+    def lookups(self, request, model_admin):
+        return [("yes", "超出预算"), ("no", "预算内")]
+
+    def queryset(self, request, queryset):
+        if self.value() == "yes":
+            return queryset.exclude(over_budget=[])
+        if self.value() == "no":
+            return queryset.filter(over_budget=[])
+        return queryset
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """请求性能采样 (RequestProfilingMiddleware)：按耗时 / 查询数排序找出慢请求和重复查询"""
+
+    list_display = (
+        "created_at",
+        "method",
+        "view",
+        "path",
+        "status_code",
+        "duration_ms",
+        "query_count",
+        "query_ms",
+        "duplicate_queries",
+        "response_bytes",
+        "over_budget",
+    )
+    list_filter = (OverBudgetFilter, "method", "status_code", "created_at")
+    search_fields = ("view", "path")
+    ordering = ("-id",)
+    readonly_fields = [field.name for field in RequestProfile._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ScrapeRequest)
+class ScrapeRequestAdmin(admin.ModelAdmin):
+    """operator 提交的采集输入：可查看被跳过的原因和合并到的采集任务"""
+
+    list_display = (
+        "id",
+        "collection_mode",
+        "input",
+        "status",
+        "skip_reason",
+        "requested_by",
+        "job",
+        "created_at",
+        "submitted_at",
+    )
+    list_filter = ("status", "collection_mode", "skip_reason")
+    search_fields = ("input", "requested_by")
+    list_select_related = ("job",)
+    readonly_fields = [field.name for field in ScrapeRequest._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
 
 
 @admin.register(Store)
@@ -682,6 +1072,9 @@ class StoreAdmin(admin.ModelAdmin):
         "rating",
         "num_sold",
         "followers",
+        "tracked_products",
+        "avg_price",
+        "tracked_sold",
     ]
     # 🌟 核心修改：指定哪些字段作为详情页的链接 🌟
     # 这里我们指定 store_id 和 name 都可以点击
@@ -695,8 +1088,8 @@ class StoreAdmin(admin.ModelAdmin):
     # 🌟 核心修改：配置详情页显示 🌟
     # =========================================================
 
-    # 1. 声明 badge_preview 为只读字段
-    readonly_fields = ("badge_preview",)
+    # 1. 声明 badge_preview 和本系统统计为只读字段
+    readonly_fields = ("badge_preview", "tracked_products", "avg_price", "tracked_sold", "metrics_updated_at")
 
     # 2. 定义详情页的字段顺序 (将 badge_preview 放在最前面或合适的位置)
     fields = (
@@ -709,6 +1102,10 @@ class StoreAdmin(admin.ModelAdmin):
         "num_of_items",
         "num_sold",
         "followers",
+        "tracked_products",
+        "avg_price",
+        "tracked_sold",
+        "metrics_updated_at",
     )
 
 
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ProductsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "products"
+
+    def ready(self):
+        # 注册 django-q 信号 (任务执行指标)
+        from . import signals  # noqa: F401
+
+        # /metrics 请求时采集队列积压
+        from tiktok_pm_project import metrics
+
+        from .services.task_metrics import collect_queue_depths
+
+        metrics.register_collector(collect_queue_depths)
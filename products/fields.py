@@ -0,0 +1,53 @@
+# products/fields.py
+
+import base64
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+# 压缩内容的前缀标记，读取时据此判断是否需要解压
+COMPRESSED_PREFIX = "~zlib~"
+
+
+def compress_text(value):
+    """
+    超过 AI_CONTENT_COMPRESS_MIN_BYTES 的文本压缩为 "~zlib~<base64>"。
+    阈值 <= 0 表示关闭压缩；压缩后没有变小的内容保持原样。
+    """
+    if not isinstance(value, str) or value.startswith(COMPRESSED_PREFIX):
+        return value
+
+    min_bytes = getattr(settings, "AI_CONTENT_COMPRESS_MIN_BYTES", 0)
+    raw = value.encode("utf-8")
+    if min_bytes <= 0 or len(raw) < min_bytes:
+        return value
+
+    packed = COMPRESSED_PREFIX + base64.b64encode(zlib.compress(raw, 6)).decode("ascii")
+    return packed if len(packed) < len(raw) else value
+
+
+def decompress_text(value):
+    if isinstance(value, str) and value.startswith(COMPRESSED_PREFIX):
+        return zlib.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX) :])).decode("utf-8")
+    return value
+
+
+class CompressedTextField(models.TextField):
+    """
+    TEXT 列，写入时按阈值透明压缩，读取时透明解压。
+    旧的明文数据可以直接读取，无需迁移数据。
+
+    只在写入 (save / bulk_create / update) 时压缩，查询参数保持明文：
+    未压缩的短内容可以正常用 exact / contains 等条件查询，
+    已压缩的行在数据库中是 "~zlib~<base64>"，这些条件匹配不到，不要依赖它们搜索长文本。
+    """
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_text(value)
+
+    def to_python(self, value):
+        return decompress_text(super().to_python(value))
+
+    def get_db_prep_save(self, value, connection):
+        return compress_text(super().get_db_prep_save(value, connection))
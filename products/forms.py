@@ -3,6 +3,7 @@
 import json
 
 from django import forms
+from django.contrib.admin.helpers import ActionForm
 
 from .models import Product, ProductTagDefinition
 
@@ -46,3 +47,15 @@ class ProductAdminForm(forms.ModelForm):
         if commit:
             instance.save()
         return instance
+
+
+class ProductBulkActionForm(ActionForm):
+    """Admin 列表页批量操作栏：在 Action 下拉框旁增加标签选择"""
+
+    tag = forms.ChoiceField(required=False, label="Tag")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["tag"].choices = [("", "---------")] + [
+            (t.code, t.name) for t in ProductTagDefinition.objects.all()
+        ]
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from products.models import Product
+from products.services.product_export import (
+    EXPORT_CHUNK_SIZE,
+    EXPORT_FORMATS,
+    iter_ndjson,
+    write_ndjson,
+    write_parquet,
+)
+
+
+class Command(BaseCommand):
+    help = "批量导出产品数据为 NDJSON 或 Parquet (流式读取，内存占用与产品数量无关)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson", help="导出格式")
+        parser.add_argument("-o", "--output", help="输出文件路径；NDJSON 未指定时输出到标准输出")
+        parser.add_argument("--ids", help="逗号分隔的产品主键")
+        parser.add_argument("--category", help="按分类过滤")
+        parser.add_argument("--available", action="store_true", help="只导出上架产品")
+        parser.add_argument(
+            "--updated-since", help="只导出此时间之后更新的产品 (YYYY-MM-DD 或 ISO 时间)"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="每批读取的产品数量"
+        )
+
+    def handle(self, *args, **options):
+        queryset = Product.objects.all()
+        if options["ids"]:
+            queryset = queryset.filter(pk__in=[i for i in options["ids"].split(",") if i.strip()])
+        if options["category"]:
+            queryset = queryset.filter(category=options["category"])
+        if options["available"]:
+            queryset = queryset.filter(available=True)
+        if options["updated_since"]:
+            try:
+                since = datetime.fromisoformat(options["updated_since"])
+            except ValueError as e:
+                raise CommandError(f"无效的时间: {options['updated_since']}") from e
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(updated_at__gte=since)
+
+        output = options["output"]
+        chunk_size = options["chunk_size"]
+
+        if options["format"] == "parquet":
+            if not output:
+                raise CommandError("Parquet 导出必须指定 --output")
+            try:
+                count = write_parquet(queryset, output, chunk_size)
+            except RuntimeError as e:
+                raise CommandError(str(e)) from e
+        elif output:
+            count = write_ndjson(queryset, output, chunk_size)
+        else:
+            for chunk in iter_ndjson(queryset, chunk_size):
+                self.stdout.write(chunk.decode("utf-8"), ending="")
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"已导出 {count} 个产品到 {output}"))
@@ -6,20 +6,19 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 
 from products.services.product_importer import import_products_from_list
+from products.services.snapshot_archive import write_segment
 
 
 class Command(BaseCommand):
     # 命令行中使用的名称：python manage.py import_json_data
-    help = "Imports product data from JSON files located in the MEDIA_ROOT/temp_json directory and moves them to MEDIA_ROOT/json upon success."
+    help = "Imports product data from JSON files located in the MEDIA_ROOT/temp_json directory and stores them in the snapshot archive upon success."
 
     def handle(self, *args, **options):
-        # 定义源目录和目标目录
+        # 定义源目录
         source_subdir = "temp_json"
-        target_subdir = "json"
 
         # 确保路径拼接正确
         json_dir = Path(settings.MEDIA_ROOT) / source_subdir
-        target_dir = Path(settings.MEDIA_ROOT) / target_subdir
 
         # 1. 检查源目录是否存在
         if not json_dir.exists():
@@ -33,11 +32,7 @@ class Command(BaseCommand):
             )
             return
 
-        # 2. 确保目标目录存在，如果不存在则创建
-        target_dir.mkdir(parents=True, exist_ok=True)
-
         self.stdout.write(self.style.NOTICE(f"Scanning directory: {json_dir}"))
-        self.stdout.write(self.style.NOTICE(f"Target directory for completed files: {target_dir}"))
 
         success_count = 0
         failure_count = 0
@@ -68,18 +63,15 @@ class Command(BaseCommand):
                 import_products_from_list(data)
 
                 # ----------------------------------------------------
-                # 文件移动逻辑
+                # 归档逻辑：写入压缩的快照归档 (文件名作为 snapshot_id)，成功后删除源文件
                 # ----------------------------------------------------
-                target_file_path = target_dir / filename
-
-                # 如果目标目录已有同名文件，先删除目标文件（覆盖逻辑），防止 Windows 下报错
-                if target_file_path.exists():
-                    os.remove(target_file_path)
-
-                os.rename(file_path, target_file_path)
+                segment = write_segment(Path(filename).stem[:64], data)
+                os.remove(file_path)
 
                 self.stdout.write(
-                    self.style.SUCCESS(f"✔ Successfully imported and moved {filename}")
+                    self.style.SUCCESS(
+                        f"✔ Successfully imported and archived {filename} → {segment.name}"
+                    )
                 )
                 success_count += 1
 
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from products.services.raw_payloads import (
+    BACKFILL_CHUNK_SIZE,
+    backfill_raw_payloads,
+    purge_orphan_payloads,
+)
+
+
+class Command(BaseCommand):
+    help = "把 products.raw_json / input 中的原始数据分批移到压缩去重的 product_raw_payloads 表"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="每批处理的产品数量"
+        )
+        parser.add_argument("--limit", type=int, help="最多处理的产品数量 (默认全部)")
+        parser.add_argument(
+            "--purge-orphans", action="store_true", help="完成后删除不再被任何产品引用的原始记录"
+        )
+
+    def handle(self, *args, **options):
+        count = backfill_raw_payloads(chunk_size=options["chunk_size"], limit=options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"已迁移 {count} 个产品的原始数据"))
+
+        if options["purge_orphans"]:
+            deleted = purge_orphan_payloads()
+            self.stdout.write(self.style.SUCCESS(f"已删除 {deleted} 条未引用的原始记录"))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from products.scheduler import (
+    disable_product_schedules,
+    get_product_schedules_status,
+    setup_product_schedules,
+)
+
+
+class Command(BaseCommand):
+    help = "管理产品模块的周期性任务 (AI 任务维护等)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action",
+            type=str,
+            choices=["enable", "disable", "status"],
+            help="操作类型: enable(启用), disable(禁用), status(查看状态)",
+        )
+
+    def handle(self, *args, **options):
+        action = options["action"]
+
+        if action == "enable":
+            setup_product_schedules()
+            self.stdout.write(self.style.SUCCESS("产品定时任务已启用"))
+        elif action == "disable":
+            deleted_count = disable_product_schedules()
+            self.stdout.write(self.style.SUCCESS(f"已删除 {deleted_count} 个产品定时任务"))
+
+        for item in get_product_schedules_status():
+            state = "enabled" if item["enabled"] else "disabled"
+            self.stdout.write(
+                f"  - {item['name']} [{state}] 每{item['minutes']}分钟 -> {item['func']} @ {item['queue']}"
+                f" (next_run: {item['next_run']})"
+            )
@@ -0,0 +1,47 @@
+# products/middleware.py
+
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .services.request_profiling import QueryRecorder, record_request
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfilingMiddleware:
+    """
+    请求性能采样 (REQUEST_PROFILING_ENABLED 开启时生效，否则不加载)：
+    记录每个请求的耗时、查询数 / 查询耗时、重复查询和响应大小，
+    超出 REQUEST_PROFILE_BUDGETS 时记录警告；采样保存在 request_profiles 表，可在 Admin 查看。
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_PROFILING_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, "resolver_match", None)
+        try:
+            record_request(
+                view=match.view_name if match else "<unresolved>",
+                method=request.method,
+                path=request.path,
+                status_code=response.status_code,
+                duration_ms=duration_ms,
+                recorder=recorder,
+                response_bytes=None if response.streaming else len(response.content),
+            )
+        except Exception as e:
+            logger.warning(f"保存请求性能采样失败: {e}")
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:43
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_aicontentitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('add_tags', '添加标签'), ('remove_tags', '移除标签'), ('set_available', '设置上架状态'), ('download_media', '下载图片'), ('ai_analyze', 'AI 分析')], max_length=32)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('product_ids', models.JSONField(blank=True, default=list)),
+                ('total', models.IntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('affected', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', '等待执行'), ('running', '执行中'), ('success', '已完成'), ('failed', '失败')], db_index=True, default='pending', max_length=20)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_by', models.CharField(blank=True, default='', max_length=150)),
+                ('created_at', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Bulk Operation',
+                'verbose_name_plural': 'Bulk Operations',
+                'db_table': 'bulk_operations',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='aicontentitem',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_items', to='products.product'),
+        ),
+    ]
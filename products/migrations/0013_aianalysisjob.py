@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:46
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_bulkoperation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIAnalysisJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', '排队中'), ('submitted', '已提交 n8n'), ('processing', '等待回调'), ('completed', '已完成'), ('failed', '失败')], default='queued', max_length=20)),
+                ('requested_by', models.CharField(blank=True, default='', max_length=150)),
+                ('updated_fields', models.JSONField(blank=True, default=list)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), null=True)),
+                ('submitted_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_jobs', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'AI Analysis Job',
+                'verbose_name_plural': 'AI Analysis Jobs',
+                'db_table': 'ai_analysis_jobs',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='ai_analysis_status_d07a25_idx'), models.Index(fields=['product', 'status'], name='ai_analysis_product_ae796a_idx')],
+            },
+        ),
+    ]
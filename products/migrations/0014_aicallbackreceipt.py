@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:48
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_aianalysisjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AICallbackReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=128, unique=True)),
+                ('item_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), db_index=True, null=True)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'db_table': 'ai_callback_receipts',
+            },
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:50
+
+import django.db.models.deletion
+import products.fields
+import uuid
+from django.db import migrations, models
+
+
+def mark_latest(apps, schema_editor):
+    """已有数据：每个 (product, content_type, ai_model) 只保留最近一批内容为最新"""
+    AIContentItem = apps.get_model("products", "AIContentItem")
+    newest = {}
+    for pk, key_product, key_type, key_model, created_at in AIContentItem.objects.values_list(
+        "pk", "product_id", "content_type", "ai_model", "created_at"
+    ):
+        key = (key_product, key_type, key_model)
+        if key not in newest or created_at > newest[key]:
+            newest[key] = created_at
+
+    for (product_id, content_type, ai_model), created_at in newest.items():
+        AIContentItem.objects.filter(
+            product_id=product_id,
+            content_type=content_type,
+            ai_model=ai_model,
+            created_at__lt=created_at,
+        ).update(is_latest=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0014_aicallbackreceipt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aicontentitem',
+            name='is_latest',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_latest, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='aicontentitem',
+            name='content_en',
+            field=products.fields.CompressedTextField(blank=True, verbose_name='英文内容'),
+        ),
+        migrations.AlterField(
+            model_name='aicontentitem',
+            name='content_zh',
+            field=products.fields.CompressedTextField(blank=True, verbose_name='中文内容'),
+        ),
+        migrations.CreateModel(
+            name='AIGeneration',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('ai_model', models.CharField(max_length=50, verbose_name='生成模型')),
+                ('prompt_version', models.CharField(blank=True, default='', max_length=50)),
+                ('item_count', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_ms', models.IntegerField(blank=True, null=True)),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generations', to='products.aianalysisjob')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ai_generations', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'AI Generation',
+                'verbose_name_plural': 'AI Generations',
+                'db_table': 'ai_generations',
+                'ordering': ['-completed_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='aicontentitem',
+            name='generation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='products.aigeneration'),
+        ),
+        migrations.AddIndex(
+            model_name='aicontentitem',
+            index=models.Index(fields=['product', 'is_latest', 'content_type'], name='ai_content__product_d8748b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aigeneration',
+            index=models.Index(fields=['product', 'ai_model', 'completed_at'], name='ai_generati_product_c36e0d_idx'),
+        ),
+    ]
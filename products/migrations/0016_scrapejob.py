@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:59
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_aigeneration'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_id', models.CharField(max_length=64, unique=True)),
+                ('collection_mode', models.CharField(blank=True, default='', max_length=20)),
+                ('status', models.CharField(choices=[('running', '采集中'), ('ready', '已就绪，下载中'), ('completed', '已下载'), ('failed', '失败'), ('expired', '超时')], default='running', max_length=20)),
+                ('remote_status', models.CharField(blank=True, default='', max_length=20)),
+                ('remote_records', models.IntegerField(blank=True, null=True)),
+                ('poll_count', models.IntegerField(default=0)),
+                ('idle_polls', models.IntegerField(default=0)),
+                ('next_poll_at', models.DateTimeField(blank=True, null=True)),
+                ('last_polled_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), null=True)),
+            ],
+            options={
+                'verbose_name': 'Scrape Job',
+                'verbose_name_plural': 'Scrape Jobs',
+                'db_table': 'scrape_jobs',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['status', 'next_poll_at'], name='scrape_jobs_status_c8ea50_idx')],
+            },
+        ),
+    ]
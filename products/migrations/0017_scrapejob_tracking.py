@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:01
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """已有记录：提交时间取 created_at；旧的 completed 状态 (已下载并提交导入) 视为已导入"""
+    ScrapeJob = apps.get_model("products", "ScrapeJob")
+    ScrapeJob.objects.filter(triggered_at__isnull=True).update(triggered_at=models.F("created_at"))
+    ScrapeJob.objects.filter(status="completed").update(status="imported")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_scrapejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scrapejob',
+            name='downloaded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='imported_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='imported_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='inputs',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='ready_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='record_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scrapejob',
+            name='triggered_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='scrapejob',
+            name='snapshot_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='scrapejob',
+            name='status',
+            field=models.CharField(choices=[('running', '采集中'), ('ready', '已就绪，下载中'), ('downloaded', '已下载，导入中'), ('imported', '已导入'), ('failed', '失败'), ('expired', '超时')], default='running', max_length=20),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:04
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0017_scrapejob_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection_mode', models.CharField(max_length=20)),
+                ('input', models.CharField(max_length=1000)),
+                ('requested_by', models.CharField(blank=True, default='', max_length=150)),
+                ('status', models.CharField(choices=[('pending', '等待提交'), ('submitted', '已提交'), ('skipped', '已跳过'), ('failed', '提交失败')], default='pending', max_length=20)),
+                ('skip_reason', models.CharField(blank=True, default='', max_length=20)),
+                ('created_at', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), null=True)),
+                ('submitted_at', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='requests', to='products.scrapejob')),
+            ],
+            options={
+                'verbose_name': 'Scrape Request',
+                'verbose_name_plural': 'Scrape Requests',
+                'db_table': 'scrape_requests',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['status', 'collection_mode'], name='scrape_requ_status_09a153_idx')],
+            },
+        ),
+    ]
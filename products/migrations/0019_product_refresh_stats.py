@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:06
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    """已有产品：最近采集时间取导入时的 updated_at / created_at"""
+    Product = apps.get_model("products", "Product")
+    Product.objects.filter(last_scraped_at__isnull=True).update(
+        last_scraped_at=Coalesce("updated_at", "created_at")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_scraperequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='last_scraped_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_volatility',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sold_velocity',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
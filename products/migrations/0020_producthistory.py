@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_product_refresh_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ts', models.DateTimeField()),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('sold', models.IntegerField(blank=True, null=True)),
+                ('stock', models.IntegerField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='products.product')),
+            ],
+            options={
+                'verbose_name': 'Product History',
+                'verbose_name_plural': 'Product History',
+                'db_table': 'product_history',
+                'indexes': [models.Index(fields=['product', 'ts'], name='product_his_product_73d47c_idx'), models.Index(fields=['ts'], name='product_his_ts_537879_idx')],
+            },
+        ),
+    ]
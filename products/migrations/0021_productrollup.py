@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_producthistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('category', '分类'), ('store', '店铺')], max_length=20)),
+                ('key', models.CharField(blank=True, default='', max_length=255)),
+                ('label', models.CharField(blank=True, default='', max_length=255)),
+                ('day', models.DateField()),
+                ('product_count', models.IntegerField(default=0)),
+                ('sold_total', models.BigIntegerField(default=0)),
+                ('in_stock_count', models.IntegerField(default=0)),
+                ('price_min', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('price_p25', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('price_median', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('price_p75', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('price_p95', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('price_max', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Product Rollup',
+                'verbose_name_plural': 'Product Rollups',
+                'db_table': 'product_rollups',
+                'ordering': ['-day', 'dimension', '-sold_total'],
+                'indexes': [models.Index(fields=['dimension', 'day'], name='product_rol_dimensi_c57c3b_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key', 'day'), name='uniq_rollup_dimension_key_day')],
+            },
+        ),
+    ]
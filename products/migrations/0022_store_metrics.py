@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:12
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Sum
+from django.utils import timezone
+
+
+def backfill(apps, schema_editor):
+    """已有店铺：按当前产品数据计算统计"""
+    Store = apps.get_model("products", "Store")
+    Product = apps.get_model("products", "Product")
+    now = timezone.now()
+    rows = (
+        Product.objects.filter(store__isnull=False)
+        .values("store_id")
+        .annotate(count=Count("pk"), avg_price=Avg("final_price"), sold=Sum("sold"))
+    )
+    for row in rows.iterator():
+        Store.objects.filter(pk=row["store_id"]).update(
+            tracked_products=row["count"],
+            avg_price=round(row["avg_price"], 2) if row["avg_price"] is not None else None,
+            tracked_sold=row["sold"] or 0,
+            metrics_updated_at=now,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_productrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='avg_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='metrics_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='tracked_products',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='tracked_sold',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
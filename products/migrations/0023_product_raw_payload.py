@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:14
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0022_store_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRawPayload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('codec', models.CharField(default='zlib', max_length=10)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), null=True)),
+            ],
+            options={
+                'verbose_name': 'Product Raw Payload',
+                'verbose_name_plural': 'Product Raw Payloads',
+                'db_table': 'product_raw_payloads',
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='raw_payload',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.productrawpayload'),
+        ),
+    ]
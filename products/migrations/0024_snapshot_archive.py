@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:16
+
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0023_product_raw_payload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('snapshot_id', models.CharField(db_index=True, max_length=64)),
+                ('record_count', models.IntegerField(default=0)),
+                ('compressed_bytes', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(blank=True, db_default=django.db.models.functions.datetime.Now(), null=True)),
+            ],
+            options={
+                'verbose_name': 'Snapshot Segment',
+                'verbose_name_plural': 'Snapshot Segments',
+                'db_table': 'snapshot_segments',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_id', models.CharField(max_length=64)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.IntegerField()),
+                ('line', models.IntegerField()),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='records', to='products.snapshotsegment')),
+            ],
+            options={
+                'db_table': 'snapshot_records',
+                'indexes': [models.Index(fields=['source_id', 'id'], name='snapshot_re_source__8b9c34_idx')],
+            },
+        ),
+    ]
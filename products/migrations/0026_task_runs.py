@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0025_rate_limit_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=32)),
+                ('func', models.CharField(max_length=256)),
+                ('queue', models.CharField(max_length=100)),
+                ('enqueued_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('stopped_at', models.DateTimeField()),
+                ('success', models.BooleanField()),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('lag', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Task Run',
+                'verbose_name_plural': 'Task Runs',
+                'db_table': 'task_runs',
+                'indexes': [models.Index(fields=['stopped_at'], name='task_runs_stopped_7270b5_idx'), models.Index(fields=['func', 'stopped_at'], name='task_runs_func_0143f3_idx')],
+            },
+        ),
+    ]
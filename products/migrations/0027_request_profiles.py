@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0026_task_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('view', models.CharField(db_index=True, max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('query_ms', models.FloatField(default=0)),
+                ('duplicate_queries', models.PositiveIntegerField(default=0)),
+                ('top_repeated_sql', models.TextField(blank=True, default='')),
+                ('top_repeated_count', models.PositiveIntegerField(default=0)),
+                ('response_bytes', models.PositiveIntegerField(blank=True, null=True)),
+                ('over_budget', models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                'verbose_name': 'Request Profile',
+                'verbose_name_plural': 'Request Profiles',
+                'db_table': 'request_profiles',
+            },
+        ),
+    ]
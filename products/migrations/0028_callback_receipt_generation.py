@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0027_request_profiles"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aicallbackreceipt",
+            name="generation_uuid",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0028_callback_receipt_generation"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="scraperequest",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "等待提交"),
+                    ("claimed", "提交中"),
+                    ("submitted", "已提交"),
+                    ("skipped", "已跳过"),
+                    ("failed", "提交失败"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,10 +1,13 @@
 # Create your models here.
+import json
 import uuid
+import zlib
 
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models.functions import Now
 
+from .fields import CompressedTextField
 from .utils import json_to_html, save_html_file
 
 # ----------------------------------------------------------------------
@@ -23,6 +26,12 @@ class Store(models.Model):
     followers = models.IntegerField(null=True, blank=True)
     badge = models.CharField(max_length=500, null=True, blank=True)
 
+    # 根据本系统已采集的产品计算 (导入后按受影响的店铺增量更新)
+    tracked_products = models.IntegerField(default=0, db_index=True)
+    avg_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    tracked_sold = models.BigIntegerField(default=0, db_index=True)
+    metrics_updated_at = models.DateTimeField(blank=True, null=True)
+
     class Meta:
         db_table = "stores"
 
@@ -116,9 +125,14 @@ class Product(models.Model):
     shop_performance_metrics = models.JSONField(blank=True, null=True)
 
     # 导入时间戳和原始数据
+    # input / raw_json 为旧数据；新导入的原始数据压缩存放在 product_raw_payloads 表，
+    # 通过 get_raw_json() / get_input() 按需读取
     timestamp = models.DateTimeField(blank=True, null=True)
     input = models.JSONField(blank=True, null=True)
     raw_json = models.JSONField(blank=True, null=True)
+    raw_payload = models.ForeignKey(
+        "ProductRawPayload", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
 
     # Django 自动管理的时间戳
     # created_at = models.DateTimeField(auto_now_add=True, null=True)
@@ -139,6 +153,13 @@ class Product(models.Model):
     # 新增tags, 使用 JSONField 存储标签列表，例如 ["candidate", "hot"]
     tags = models.JSONField(default=list, blank=True, null=True)
 
+    # 定期刷新使用的统计 (每次导入时由 product_importer 更新)
+    last_scraped_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    # 两次采集之间的日均销量增长
+    sold_velocity = models.FloatField(default=0)
+    # 价格相对变化幅度的指数平滑值 (0.1 表示约 10%)
+    price_volatility = models.FloatField(default=0)
+
     class Meta:
         # 定义模型的复数名称，让Admin后台显示更友好
         verbose_name = "TikTok Product"
@@ -159,6 +180,20 @@ class Product(models.Model):
         if self.discount_percent is not None and self.discount_percent < 0:
             raise ValidationError({"discount_percent": "折扣百分比不能为负数"})
 
+    def get_raw_json(self):
+        """Bright Data 原始记录：旧数据直接读取列，新数据从压缩表加载 (每次调用一次查询)"""
+        if self.raw_json is not None:
+            return self.raw_json
+        if self.raw_payload_id:
+            return ProductRawPayload.objects.get(pk=self.raw_payload_id).load()
+        return None
+
+    def get_input(self):
+        if self.input is not None:
+            return self.input
+        raw = self.get_raw_json()
+        return raw.get("input") if isinstance(raw, dict) else None
+
     # ------------------------------------------------------------
     # 新增属性：获取第一张图片的 Original URL (用于列表页展示)
     # ------------------------------------------------------------
@@ -401,6 +436,46 @@ class ProductTagDefinition(models.Model):
         db_table = "product_tags"
 
 
+# ----------------------------------------------------------------------
+# Table: ai_generations
+# ----------------------------------------------------------------------
+class AIGeneration(models.Model):
+    """
+    一次 AI 生成 (一次 n8n 回调对一个产品的输出)，记录模型、提示词版本和耗时。
+    使用 UUID 主键，便于在 bulk_create 之前就确定关联关系。
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="ai_generations")
+    job = models.ForeignKey(
+        "AIAnalysisJob",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="generations",
+    )
+
+    ai_model = models.CharField(max_length=50, verbose_name="生成模型")
+    prompt_version = models.CharField(max_length=50, blank=True, default="")
+    item_count = models.IntegerField(default=0)
+
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+    duration_ms = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "AI Generation"
+        verbose_name_plural = "AI Generations"
+        db_table = "ai_generations"
+        ordering = ["-completed_at"]
+        indexes = [
+            models.Index(fields=["product", "ai_model", "completed_at"]),
+        ]
+
+    def __str__(self):
+        return f"[{self.ai_model}] {self.product_id} @ {self.completed_at}"
+
+
 # ----------------------------------------------------------------------
 # Table: ai content item
 # ----------------------------------------------------------------------
@@ -415,18 +490,25 @@ class AIContentItem(models.Model):
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="ai_items")
+    generation = models.ForeignKey(
+        AIGeneration, null=True, blank=True, on_delete=models.CASCADE, related_name="items"
+    )
 
     # 新增：AI 模型类型字段
     # 示例值: 'gemini-2.0-flash', 'gpt-4o', 'claude-3-5-sonnet'
     ai_model = models.CharField(max_length=50, verbose_name="生成模型", db_index=True)
 
     content_type = models.CharField(max_length=20, choices=TYPE_CHOICES, db_index=True)
-    content_zh = models.TextField(verbose_name="中文内容", blank=True)
-    content_en = models.TextField(verbose_name="英文内容", blank=True)
+    # 大段内容按 AI_CONTENT_COMPRESS_MIN_BYTES 阈值透明压缩
+    content_zh = CompressedTextField(verbose_name="中文内容", blank=True)
+    content_en = CompressedTextField(verbose_name="英文内容", blank=True)
 
     option_index = models.IntegerField(default=1)
     status = models.CharField(max_length=20, default="draft", db_index=True)
 
+    # 物化指针：每个 (product, content_type, ai_model) 只有最新一次生成的内容为 True
+    is_latest = models.BooleanField(default=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -434,8 +516,533 @@ class AIContentItem(models.Model):
         # 增加复合索引，提高查询特定产品下特定模型生成的脚本的速度
         indexes = [
             models.Index(fields=["product", "ai_model", "content_type"]),
+            # 最新内容查询: WHERE product_id = ? AND is_latest
+            models.Index(fields=["product", "is_latest", "content_type"]),
         ]
         db_table = "ai_content_items"
 
     def __str__(self):
         return f"[{self.ai_model}] {self.get_content_type_display()} - {self.option_index}"
+
+
+# ----------------------------------------------------------------------
+# Table: bulk_operations
+# ----------------------------------------------------------------------
+class BulkOperation(models.Model):
+    """
+    记录一次后台批量操作（批量打标签、上下架、触发 AI/图片任务）。
+    选中产品较多时由 django-q 分块执行，processed 字段用于进度展示。
+    """
+
+    ACTION_CHOICES = [
+        ("add_tags", "添加标签"),
+        ("remove_tags", "移除标签"),
+        ("set_available", "设置上架状态"),
+        ("download_media", "下载图片"),
+        ("ai_analyze", "AI 分析"),
+    ]
+
+    STATUS_CHOICES = [
+        ("pending", "等待执行"),
+        ("running", "执行中"),
+        ("success", "已完成"),
+        ("failed", "失败"),
+    ]
+
+    action = models.CharField(max_length=32, choices=ACTION_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    # 选中的产品主键列表 (保存在表中，避免作为任务参数塞进 django-q broker)
+    product_ids = models.JSONField(default=list, blank=True)
+
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    affected = models.IntegerField(default=0)
+
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default="pending", db_index=True
+    )
+    error = models.TextField(blank=True, default="")
+    created_by = models.CharField(max_length=150, blank=True, default="")
+
+    created_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_default=Now(),
+    )
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Bulk Operation"
+        verbose_name_plural = "Bulk Operations"
+        db_table = "bulk_operations"
+        ordering = ["-id"]
+
+    def __str__(self):
+        return f"#{self.pk} {self.get_action_display()} ({self.processed}/{self.total})"
+
+    @property
+    def progress_percent(self):
+        if not self.total:
+            return 100 if self.status == "success" else 0
+        return int(self.processed * 100 / self.total)
+
+
+# ----------------------------------------------------------------------
+# Table: ai_analysis_jobs
+# ----------------------------------------------------------------------
+class AIAnalysisJob(models.Model):
+    """
+    一次 n8n AI 分析请求。
+    提交后由 django-q 发送给 n8n，n8n 回调 update_product_api 时关闭任务。
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "排队中"),
+        ("submitted", "已提交 n8n"),
+        ("processing", "等待回调"),
+        ("completed", "已完成"),
+        ("failed", "失败"),
+    ]
+
+    # 尚未结束的状态
+    OPEN_STATUSES = ("queued", "submitted", "processing")
+    # 占用 n8n 并发名额的状态
+    IN_FLIGHT_STATUSES = ("submitted", "processing")
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="ai_jobs")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued")
+    requested_by = models.CharField(max_length=150, blank=True, default="")
+    updated_fields = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_default=Now(),
+    )
+    submitted_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "AI Analysis Job"
+        verbose_name_plural = "AI Analysis Jobs"
+        db_table = "ai_analysis_jobs"
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "id"]),
+            models.Index(fields=["product", "status"]),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.product_id} ({self.status})"
+
+    @property
+    def is_open(self):
+        return self.status in self.OPEN_STATUSES
+
+
+# ----------------------------------------------------------------------
+# Table: ai_callback_receipts
+# ----------------------------------------------------------------------
+class AICallbackReceipt(models.Model):
+    """
+    已处理的 n8n 回调幂等键。n8n 重试同一回调时直接返回，不重复写入 AI 内容。
+    """
+
+    key = models.CharField(max_length=128, unique=True)
+    product = models.ForeignKey(
+        Product, null=True, blank=True, on_delete=models.CASCADE, related_name="+"
+    )
+    item_count = models.IntegerField(default=0)
+    # 写入该幂等键的 AIGeneration 主键。幂等键先于生成记录写入，不建外键；
+    # 并发请求用相同的键写入时，读回该值判断由哪个请求写入内容
+    generation_uuid = models.UUIDField(null=True, blank=True)
+    created_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_default=Now(),
+        db_index=True,
+    )
+
+    class Meta:
+        db_table = "ai_callback_receipts"
+
+    def __str__(self):
+        return self.key
+
+
+# ----------------------------------------------------------------------
+# Table: scrape_jobs
+# ----------------------------------------------------------------------
+class ScrapeJob(models.Model):
+    """
+    一次 Bright Data 采集：提交的输入、snapshot、下载和导入的完整记录。
+    在途的 snapshot 由同一个轮询协调任务按 next_poll_at 检查，不再为每个 snapshot 创建 Schedule。
+    """
+
+    STATUS_CHOICES = [
+        ("running", "采集中"),
+        ("ready", "已就绪，下载中"),
+        ("downloaded", "已下载，导入中"),
+        ("imported", "已导入"),
+        ("failed", "失败"),
+        ("expired", "超时"),
+    ]
+
+    # 需要轮询的状态
+    OPEN_STATUSES = ("running",)
+    # 尚未结束的状态 (admin 队列)
+    ACTIVE_STATUSES = ("running", "ready", "downloaded")
+
+    # trigger 失败时没有 snapshot_id
+    snapshot_id = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    collection_mode = models.CharField(max_length=20, blank=True, default="")
+    inputs = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="running")
+
+    # Bright Data progress 接口最近一次返回的状态和记录数
+    remote_status = models.CharField(max_length=20, blank=True, default="")
+    remote_records = models.IntegerField(blank=True, null=True)
+
+    poll_count = models.IntegerField(default=0)
+    # 连续没有进展的轮询次数，用于计算退避间隔
+    idle_polls = models.IntegerField(default=0)
+    next_poll_at = models.DateTimeField(blank=True, null=True)
+    last_polled_at = models.DateTimeField(blank=True, null=True)
+
+    # 下载的记录数 / 导入成功的产品数
+    record_count = models.IntegerField(blank=True, null=True)
+    imported_count = models.IntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_default=Now(),
+    )
+    triggered_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    ready_at = models.DateTimeField(blank=True, null=True)
+    downloaded_at = models.DateTimeField(blank=True, null=True)
+    imported_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Scrape Job"
+        verbose_name_plural = "Scrape Jobs"
+        db_table = "scrape_jobs"
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "next_poll_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.snapshot_id or '-'} ({self.status})"
+
+    @property
+    def time_to_import(self):
+        """从提交到导入完成的耗时"""
+        if self.triggered_at and self.imported_at:
+            return self.imported_at - self.triggered_at
+        return None
+
+
+# ----------------------------------------------------------------------
+# Table: scrape_requests
+# ----------------------------------------------------------------------
+class ScrapeRequest(models.Model):
+    """
+    operator 提交的单个采集输入 (URL / 关键词，已规范化)。
+    待提交的输入由定时任务按采集模式合并成一次 trigger 调用。
+    """
+
+    STATUS_CHOICES = [
+        ("pending", "等待提交"),
+        ("claimed", "提交中"),
+        ("submitted", "已提交"),
+        ("skipped", "已跳过"),
+        ("failed", "提交失败"),
+    ]
+
+    collection_mode = models.CharField(max_length=20)
+    input = models.CharField(max_length=1000)
+    requested_by = models.CharField(max_length=150, blank=True, default="")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    # 跳过原因：duplicate / queued / in_flight / recent / fresh
+    skip_reason = models.CharField(max_length=20, blank=True, default="")
+    job = models.ForeignKey(
+        ScrapeJob, null=True, blank=True, on_delete=models.SET_NULL, related_name="requests"
+    )
+
+    created_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_default=Now(),
+    )
+    # 被 flush 认领 (claimed) 的时间；超过租约仍未关联 job 的请求会退回 pending
+    submitted_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Scrape Request"
+        verbose_name_plural = "Scrape Requests"
+        db_table = "scrape_requests"
+        ordering = ["-id"]
+        indexes = [
+            models.Index(fields=["status", "collection_mode"]),
+        ]
+
+    def __str__(self):
+        return f"[{self.collection_mode}] {self.input} ({self.status})"
+
+
+# ----------------------------------------------------------------------
+# Table: product_history
+# ----------------------------------------------------------------------
+class ProductHistory(models.Model):
+    """
+    产品价格/销量/库存的历史记录 (只追加)。
+    导入时只有数值与上一条记录不同才写入；旧数据由定时任务按天降采样并按保留期删除。
+    """
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="history")
+    ts = models.DateTimeField()
+    price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    sold = models.IntegerField(blank=True, null=True)
+    # 所有变体库存之和
+    stock = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Product History"
+        verbose_name_plural = "Product History"
+        db_table = "product_history"
+        indexes = [
+            models.Index(fields=["product", "ts"]),
+            models.Index(fields=["ts"]),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.ts:%Y-%m-%d %H:%M}: {self.price} / {self.sold} / {self.stock}"
+
+
+# ----------------------------------------------------------------------
+# Table: product_rollups
+# ----------------------------------------------------------------------
+class ProductRollup(models.Model):
+    """
+    按分类 / 店铺 / 天预聚合的产品统计。
+    导入后按受影响的分类和店铺增量更新，每天定时全量重算一次。
+    """
+
+    DIMENSION_CHOICES = [
+        ("category", "分类"),
+        ("store", "店铺"),
+    ]
+
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    # 分类名 / 店铺主键，空字符串表示未分类 / 无店铺
+    key = models.CharField(max_length=255, blank=True, default="")
+    label = models.CharField(max_length=255, blank=True, default="")
+    day = models.DateField()
+
+    product_count = models.IntegerField(default=0)
+    sold_total = models.BigIntegerField(default=0)
+    in_stock_count = models.IntegerField(default=0)
+
+    price_min = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    price_p25 = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    price_median = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    price_p75 = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    price_p95 = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    price_max = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+
+    updated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Product Rollup"
+        verbose_name_plural = "Product Rollups"
+        db_table = "product_rollups"
+        ordering = ["-day", "dimension", "-sold_total"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dimension", "key", "day"], name="uniq_rollup_dimension_key_day"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["dimension", "day"]),
+        ]
+
+    def __str__(self):
+        return f"[{self.dimension}] {self.label or self.key or '-'} @ {self.day}"
+
+    @property
+    def in_stock_ratio(self):
+        if not self.product_count:
+            return None
+        return round(self.in_stock_count / self.product_count, 4)
+
+
+# ----------------------------------------------------------------------
+# Table: product_raw_payloads
+# ----------------------------------------------------------------------
+class ProductRawPayload(models.Model):
+    """
+    产品的原始采集记录 (zlib 压缩的 JSON)，按内容 SHA-256 去重。
+    不放在 products 表中，列表查询和同步不会读取这些大字段。
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    codec = models.CharField(max_length=10, default="zlib")
+    data = models.BinaryField()
+    # 压缩前的字节数
+    size = models.IntegerField(default=0)
+    created_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_default=Now(),
+    )
+
+    class Meta:
+        verbose_name = "Product Raw Payload"
+        verbose_name_plural = "Product Raw Payloads"
+        db_table = "product_raw_payloads"
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+    def load(self):
+        return json.loads(zlib.decompress(bytes(self.data)).decode("utf-8"))
+
+
+# ----------------------------------------------------------------------
+# Table: snapshot_segments / snapshot_records
+# ----------------------------------------------------------------------
+class SnapshotSegment(models.Model):
+    """
+    快照归档文件：一个 snapshot 对应一个 gzip 压缩的 NDJSON 文件 (SNAPSHOT_ARCHIVE_ROOT 下的相对路径)。
+    文件由多个独立的 gzip 块组成，可以按偏移量直接读取单个块。
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    snapshot_id = models.CharField(max_length=64, db_index=True)
+    record_count = models.IntegerField(default=0)
+    compressed_bytes = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        db_default=Now(),
+    )
+
+    class Meta:
+        verbose_name = "Snapshot Segment"
+        verbose_name_plural = "Snapshot Segments"
+        db_table = "snapshot_segments"
+        ordering = ["-id"]
+
+    def __str__(self):
+        return f"{self.name} ({self.record_count} records)"
+
+
+class SnapshotRecord(models.Model):
+    """归档索引：source_id → (归档文件, gzip 块偏移量, 块长度, 块内行号)"""
+
+    segment = models.ForeignKey(SnapshotSegment, on_delete=models.CASCADE, related_name="records")
+    source_id = models.CharField(max_length=64)
+    offset = models.BigIntegerField()
+    length = models.IntegerField()
+    line = models.IntegerField()
+
+    class Meta:
+        db_table = "snapshot_records"
+        indexes = [
+            models.Index(fields=["source_id", "id"]),
+        ]
+
+    def __str__(self):
+        return f"{self.source_id} @ {self.segment_id}:{self.offset}+{self.line}"
+
+
+# ----------------------------------------------------------------------
+# Table: rate_limit_buckets
+# ----------------------------------------------------------------------
+class RateLimitBucket(models.Model):
+    """
+    外部服务的令牌桶 (每个服务 + 主机一行)，所有 web / qcluster 进程共用。
+    取令牌时锁定该行，按经过的时间补充令牌。
+    """
+
+    key = models.CharField(max_length=255, unique=True)
+    tokens = models.FloatField(default=0)
+    # 上次补充令牌的时间 (unix 时间戳，秒)
+    refilled_at = models.FloatField(default=0)
+
+    class Meta:
+        db_table = "rate_limit_buckets"
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.2f}"
+
+
+# ----------------------------------------------------------------------
+# Table: task_runs
+# ----------------------------------------------------------------------
+class TaskRun(models.Model):
+    """
+    django-q 任务的执行记录 (由 pre_execute / post_execute 信号写入)，用于任务指标仪表盘。
+    django-q 的 Task.started 是入队时间，这里另外记录开始执行的时间，区分排队等待和执行耗时。
+    """
+
+    task_id = models.CharField(max_length=32)
+    func = models.CharField(max_length=256)
+    queue = models.CharField(max_length=100)
+    enqueued_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    stopped_at = models.DateTimeField()
+    success = models.BooleanField()
+    # 执行耗时 / 入队到开始执行的等待时间 (秒)
+    duration = models.FloatField(null=True, blank=True)
+    lag = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Task Run"
+        verbose_name_plural = "Task Runs"
+        db_table = "task_runs"
+        indexes = [
+            models.Index(fields=["stopped_at"]),
+            models.Index(fields=["func", "stopped_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.func} @ {self.stopped_at:%Y-%m-%d %H:%M:%S} ({'ok' if self.success else 'failed'})"
+
+
+# ----------------------------------------------------------------------
+# Table: request_profiles
+# ----------------------------------------------------------------------
+class RequestProfile(models.Model):
+    """
+    请求性能采样 (RequestProfilingMiddleware，REQUEST_PROFILING_ENABLED 开启时写入)。
+    按 REQUEST_PROFILE_SAMPLE_RATE 抽样保存，超出视图预算的请求总是保存；
+    表只保留最近 REQUEST_PROFILE_MAX_ROWS 条。
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    view = models.CharField(max_length=255, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    status_code = models.PositiveSmallIntegerField()
+    # 请求总耗时 / 数据库查询总耗时 (毫秒)
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    # 完全相同 (SQL 和参数) 的重复查询数；重复最多的 SQL 模板及次数 (N+1 查询)
+    duplicate_queries = models.PositiveIntegerField(default=0)
+    top_repeated_sql = models.TextField(blank=True, default="")
+    top_repeated_count = models.PositiveIntegerField(default=0)
+    response_bytes = models.PositiveIntegerField(null=True, blank=True)
+    over_budget = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        verbose_name = "Request Profile"
+        verbose_name_plural = "Request Profiles"
+        db_table = "request_profiles"
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f}ms, {self.query_count} queries)"
@@ -0,0 +1,116 @@
+import logging
+
+from django_q.models import Schedule
+from django_q.tasks import schedule
+
+from tiktok_pm_project.task_queues import queue_cluster
+
+logger = logging.getLogger(__name__)
+
+# 产品模块的周期性任务：(任务名称, 函数路径, 间隔分钟, 任务队列)
+PRODUCT_SCHEDULES = [
+    ("ai_analysis_job_maintenance", "products.services.ai_jobs.expire_stale_jobs", 5, "ai"),
+    (
+        "ai_callback_receipt_purge",
+        "products.services.ai_content.purge_callback_receipts",
+        1440,
+        "ai",
+    ),
+    (
+        "bright_data_poll_coordinator",
+        "products.services.bright_data_poller.poll_due_snapshots",
+        1,
+        "poll",
+    ),
+    ("scrape_request_flush", "products.services.scrape_requests.flush_scrape_requests", 1, "poll"),
+    (
+        "product_refresh_scheduler",
+        "products.services.refresh_scheduler.schedule_refresh",
+        60,
+        "poll",
+    ),
+    (
+        "product_history_compaction",
+        "products.services.product_history.compact_history",
+        1440,
+        "import",
+    ),
+    ("product_rollup_rebuild", "products.services.product_rollups.rebuild_rollups", 1440, "import"),
+    (
+        "store_metrics_rebuild",
+        "products.services.store_metrics.refresh_store_metrics",
+        1440,
+        "import",
+    ),
+    ("task_storage_cleanup", "products.services.task_payloads.cleanup_task_storage", 60, "import"),
+    ("metrics_compaction", "tiktok_pm_project.metrics.compact_metrics", 60, "import"),
+]
+
+
+def _create_schedule(name, func, minutes, queue):
+    # cluster 为空时由默认 qcluster 的调度器执行
+    schedule(
+        func,
+        name=name,
+        schedule_type=Schedule.MINUTES,
+        minutes=minutes,
+        repeats=-1,
+        cluster=queue_cluster(queue),
+    )
+
+
+def setup_product_schedules():
+    """
+    创建或更新产品模块的周期性任务 (幂等，可重复执行)
+    """
+    for name, func, minutes, queue in PRODUCT_SCHEDULES:
+        existing = Schedule.objects.filter(name=name).first()
+        if existing:
+            existing.func = func
+            existing.schedule_type = Schedule.MINUTES
+            existing.minutes = minutes
+            existing.repeats = -1
+            existing.cluster = queue_cluster(queue)
+            existing.save()
+            logger.info(f"更新定时任务 {name}: 每{minutes}分钟")
+        else:
+            _create_schedule(name, func, minutes, queue)
+            logger.info(f"创建定时任务 {name}: 每{minutes}分钟")
+    return True
+
+
+def ensure_product_schedule(name):
+    """只在缺失时创建指定的周期性任务 (不修改已有配置)"""
+    for schedule_name, func, minutes, queue in PRODUCT_SCHEDULES:
+        if schedule_name == name and not Schedule.objects.filter(name=name).exists():
+            _create_schedule(name, func, minutes, queue)
+            logger.info(f"创建定时任务 {name}: 每{minutes}分钟")
+            return True
+    return False
+
+
+def disable_product_schedules():
+    """删除产品模块的周期性任务"""
+    names = [name for name, *_ in PRODUCT_SCHEDULES]
+    deleted_count = Schedule.objects.filter(name__in=names).delete()[0]
+    logger.info(f"已删除 {deleted_count} 个产品定时任务")
+    return deleted_count
+
+
+def get_product_schedules_status():
+    """返回每个周期性任务的状态"""
+    status = []
+    for name, func, minutes, queue in PRODUCT_SCHEDULES:
+        schedule_obj = Schedule.objects.filter(name=name).first()
+        status.append(
+            {
+                "name": name,
+                "func": func,
+                "enabled": bool(schedule_obj),
+                "minutes": schedule_obj.minutes if schedule_obj else minutes,
+                "queue": (schedule_obj.cluster if schedule_obj else queue_cluster(queue))
+                or "default",
+                "next_run": schedule_obj.next_run if schedule_obj else None,
+            }
+        )
+    return status
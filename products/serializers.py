@@ -2,7 +2,7 @@
 
 from rest_framework import serializers
 
-from .models import Product, ProductImage, ProductVariation, ProductVideo
+from .models import BulkOperation, Product, ProductImage, ProductVariation, ProductVideo
 
 # --- 辅助序列化器 (用于嵌套展示) ---
 
@@ -44,3 +44,29 @@ class ProductSerializer(serializers.ModelSerializer):
 
         # 确保 created_at, updated_at, source_id, seller_id 等关键字段可读
         read_only_fields = ["id", "created_at", "updated_at"]
+
+
+# --- 批量操作序列化器 (用于 /products/bulk/ API) ---
+
+
+class ProductBulkActionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    action = serializers.ChoiceField(choices=BulkOperation.ACTION_CHOICES)
+    tags = serializers.ListField(child=serializers.CharField(max_length=50), required=False)
+    available = serializers.BooleanField(required=False)
+
+    def validate(self, attrs):
+        if attrs["action"] in ("add_tags", "remove_tags") and not attrs.get("tags"):
+            raise serializers.ValidationError({"tags": "该操作需要提供 tags。"})
+        if attrs["action"] == "set_available" and "available" not in attrs:
+            raise serializers.ValidationError({"available": "该操作需要提供 available。"})
+        return attrs
+
+
+class BulkOperationSerializer(serializers.ModelSerializer):
+    progress_percent = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = BulkOperation
+        # product_ids 可能非常大，不在响应中返回
+        exclude = ["product_ids"]
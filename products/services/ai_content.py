@@ -0,0 +1,292 @@
+# products/services/ai_content.py
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from products.models import (
+    AIAnalysisJob,
+    AICallbackReceipt,
+    AIContentItem,
+    AIGeneration,
+    Product,
+)
+from products.services.ai_jobs import close_jobs_for_callback
+
+logger = logging.getLogger(__name__)
+
+# n8n 输出字段 -> AIContentItem.content_type (需与 n8n 节点的输出 JSON 匹配)
+CONTENT_FIELD_MAP = [
+    ("desc", "desc_zh", "desc_en"),
+    ("script", "script_zh", "script_en"),
+    ("voice", "voice_zh", "voice_en"),
+    ("img_prompt", "img_p_zh", "img_p_en"),
+    ("vid_prompt", "vid_p_zh", "vid_p_en"),
+]
+
+
+class InvalidCallback(ValueError):
+    """回调请求体格式错误 (如批量条目不是 JSON 对象)"""
+
+
+def _as_list(value):
+    """兼容 String 和 List：非空字符串转换成单元素列表"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str) and value.strip():
+        return [value]
+    return []
+
+
+def _extract_output(entry):
+    """从 n8n 返回的 JSON 结构中提取 output 数据 ([{"output": {...}}] / {"output": {...}} / 扁平结构)"""
+    if isinstance(entry, list) and entry and isinstance(entry[0], dict):
+        return entry[0].get("output") or {}
+    if isinstance(entry, dict) and isinstance(entry.get("output"), dict):
+        return entry["output"]
+    return entry if isinstance(entry, dict) else {}
+
+
+def build_content_items(product, model_name, output, generation=None):
+    """把一次回调的输出转换为未保存的 AIContentItem 列表"""
+    items = []
+    for type_key, zh_field, en_field in CONTENT_FIELD_MAP:
+        zh_list = _as_list(output.get(zh_field))
+        en_list = _as_list(output.get(en_field))
+
+        for i in range(max(len(zh_list), len(en_list))):
+            items.append(
+                AIContentItem(
+                    product=product,
+                    generation=generation,
+                    ai_model=model_name,
+                    content_type=type_key,
+                    option_index=i + 1,
+                    # 安全获取索引，越界则填空字符串
+                    content_zh=zh_list[i] if i < len(zh_list) else "",
+                    content_en=en_list[i] if i < len(en_list) else "",
+                )
+            )
+    return items
+
+
+def resolve_products(product_ids):
+    """
+    一次查询按 source_id 或主键解析产品，返回 {product_id(str): Product}。
+    source_id 匹配优先于主键匹配。
+    """
+    str_ids = {str(p_id) for p_id in product_ids if p_id not in (None, "")}
+    if not str_ids:
+        return {}
+
+    query = Q(source_id__in=str_ids)
+    numeric_ids = [int(p_id) for p_id in str_ids if p_id.isdigit()]
+    if numeric_ids:
+        query |= Q(pk__in=numeric_ids)
+
+    by_source, by_pk = {}, {}
+    for product in Product.objects.filter(query):
+        by_source[product.source_id] = product
+        by_pk[str(product.pk)] = product
+
+    return {
+        p_id: by_source.get(p_id) or by_pk.get(p_id)
+        for p_id in str_ids
+        if p_id in by_source or p_id in by_pk
+    }
+
+
+def ingest_ai_callbacks(entries):
+    """
+    批量写入 n8n 回调的 AI 内容。
+
+    entries 中每一项包含 product_id、model_name、prompt_version (可选)、
+    idempotency_key (可选)、job_id (可选) 以及 output 字段。
+
+    每条回调生成一个 AIGeneration；新内容一次 bulk_create，同一
+    (product, content_type, ai_model) 的旧内容保留为历史版本 (is_latest=False)。
+
+    幂等键先写入 (ignore_conflicts)，再读回每个键归属的 AIGeneration：
+    并发请求已写入的键只把对应条目标记为 duplicate，不影响同一请求中的其他条目。
+
+    返回与 entries 顺序一致的结果列表：
+    {"product_id", "status": success|duplicate|not_found|invalid, "items"}
+    条目不是 JSON 对象时抛出 InvalidCallback。
+    """
+    if any(not isinstance(entry, dict) for entry in entries):
+        raise InvalidCallback("回调条目必须是 JSON 对象")
+
+    products = resolve_products(entry.get("product_id") for entry in entries)
+
+    keys = [entry.get("idempotency_key") for entry in entries if entry.get("idempotency_key")]
+    seen_keys = set(AICallbackReceipt.objects.filter(key__in=keys).values_list("key", flat=True))
+
+    job_ids = [entry.get("job_id") for entry in entries if str(entry.get("job_id", "")).isdigit()]
+    job_started = dict(
+        AIAnalysisJob.objects.filter(pk__in=job_ids).values_list("pk", "submitted_at")
+    )
+
+    now = timezone.now()
+    results = []
+    # (result, generation, new_items, idempotency_key, job_id)
+    pending = []
+
+    for entry in entries:
+        p_id = entry.get("product_id")
+        key = entry.get("idempotency_key")
+        result = {"product_id": p_id, "status": "success", "items": 0}
+        results.append(result)
+
+        if not p_id:
+            result["status"] = "invalid"
+            continue
+        if key and key in seen_keys:
+            result["status"] = "duplicate"
+            continue
+
+        product = products.get(str(p_id))
+        if not product:
+            result["status"] = "not_found"
+            continue
+
+        model_used = entry.get("model_name", "unknown-model")
+        job_id = int(entry["job_id"]) if str(entry.get("job_id", "")).isdigit() else None
+        started_at = job_started.get(job_id)
+
+        generation = AIGeneration(
+            product=product,
+            job_id=job_id if job_id in job_started else None,
+            ai_model=model_used,
+            prompt_version=str(entry.get("prompt_version") or ""),
+            started_at=started_at,
+            completed_at=now,
+            duration_ms=int((now - started_at).total_seconds() * 1000) if started_at else None,
+        )
+        new_items = build_content_items(product, model_used, _extract_output(entry), generation)
+        generation.item_count = len(new_items)
+        pending.append((result, generation, new_items, key, entry.get("job_id")))
+        if key:
+            seen_keys.add(key)
+
+    accepted = []
+    with transaction.atomic():
+        receipts = [
+            AICallbackReceipt(
+                key=key,
+                product=generation.product,
+                item_count=len(new_items),
+                generation_uuid=generation.pk,
+            )
+            for _, generation, new_items, key, _ in pending
+            if key
+        ]
+        owners = {}
+        if receipts:
+            AICallbackReceipt.objects.bulk_create(receipts, ignore_conflicts=True)
+            owners = dict(
+                AICallbackReceipt.objects.select_for_update()
+                .filter(key__in=[receipt.key for receipt in receipts])
+                .values_list("key", "generation_uuid")
+            )
+
+        for result, generation, new_items, key, job_id in pending:
+            if key and owners.get(key) != generation.pk:
+                # 另一请求已用相同的幂等键写入
+                result["status"] = "duplicate"
+                continue
+            result["items"] = len(new_items)
+            result["model"] = generation.ai_model
+            result["generation_id"] = str(generation.pk)
+            accepted.append((generation, new_items, job_id))
+
+        items = [item for _, new_items, _ in accepted for item in new_items]
+        _supersede_latest(items)
+        _keep_last_generation_latest(items)
+        AIGeneration.objects.bulk_create([generation for generation, _, _ in accepted])
+        AIContentItem.objects.bulk_create(items)
+
+    # 关闭对应的 AI 分析任务，释放 n8n 并发名额
+    for generation, _, job_id in accepted:
+        close_jobs_for_callback(generation.product, job_id)
+
+    logger.info(
+        f"AI 回调写入完成：{len(entries)} 条回调，{len(accepted)} 次生成，{len(items)} 条内容"
+    )
+    return results
+
+
+def _supersede_latest(items):
+    """把即将写入的 (product, content_type, ai_model) 组合的旧内容标记为历史版本"""
+    combos = {(item.product_id, item.content_type, item.ai_model) for item in items}
+    if not combos:
+        return 0
+
+    query = Q()
+    for product_id, content_type, ai_model in combos:
+        query |= Q(product_id=product_id, content_type=content_type, ai_model=ai_model)
+    return AIContentItem.objects.filter(query, is_latest=True).update(is_latest=False)
+
+
+def _keep_last_generation_latest(items):
+    """
+    同一批回调中同一 (product, content_type, ai_model) 有多次生成时 (如没有幂等键的重试)，
+    只有最后一次生成的内容保持 is_latest，之前的作为历史版本写入
+    """
+    last_generation = {}
+    for item in items:
+        last_generation[(item.product_id, item.content_type, item.ai_model)] = item.generation_id
+    for item in items:
+        key = (item.product_id, item.content_type, item.ai_model)
+        item.is_latest = item.generation_id == last_generation[key]
+
+
+# Admin 面板和 API 实际渲染的字段
+LATEST_ITEM_FIELDS = (
+    "id",
+    "product_id",
+    "generation_id",
+    "ai_model",
+    "content_type",
+    "option_index",
+    "status",
+    "content_zh",
+    "content_en",
+    "created_at",
+)
+
+
+def latest_content_items(product_ids, content_type=None, ai_model=None):
+    """
+    每个 (product, content_type, ai_model) 最新一次生成的内容。
+    走 (product, is_latest, content_type) 索引，只读取渲染需要的字段。
+    """
+    items = AIContentItem.objects.filter(product_id__in=product_ids, is_latest=True)
+    if content_type:
+        items = items.filter(content_type=content_type)
+    if ai_model:
+        items = items.filter(ai_model=ai_model)
+    return items.only(*LATEST_ITEM_FIELDS).order_by(
+        "product_id", "content_type", "ai_model", "option_index"
+    )
+
+
+def group_items_by_type(items, groups=AIContentItem.TYPE_CHOICES):
+    """一次遍历把内容按 content_type 分组，返回 [(type_key, type_name, items)]"""
+    grouped = {type_key: [] for type_key, _ in groups}
+    for item in items:
+        if item.content_type in grouped:
+            grouped[item.content_type].append(item)
+    return [(type_key, type_name, grouped[type_key]) for type_key, type_name in groups]
+
+
+def purge_callback_receipts():
+    """定时任务：删除超过保留期的幂等键记录"""
+    days = getattr(settings, "AI_CALLBACK_RECEIPT_RETENTION_DAYS", 7)
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted_count = AICallbackReceipt.objects.filter(created_at__lt=cutoff).delete()[0]
+    logger.info(f"清理过期回调幂等键 {deleted_count} 条")
+    return deleted_count
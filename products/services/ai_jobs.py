@@ -0,0 +1,141 @@
+# products/services/ai_jobs.py
+
+import logging
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from products.models import AIAnalysisJob, Product
+from products.services.n8n_analyzer import N8nAnalyzeError, analyze_product
+from tiktok_pm_project.task_queues import queue_options
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_analysis(product_ids, requested_by=""):
+    """
+    为产品创建排队中的 AI 分析任务 (已有未结束任务的产品会被跳过)，
+    然后按并发上限分发。返回新建的任务数量。
+    """
+    product_ids = list(Product.objects.filter(pk__in=product_ids).values_list("pk", flat=True))
+    busy = set(
+        AIAnalysisJob.objects.filter(
+            product_id__in=product_ids, status__in=AIAnalysisJob.OPEN_STATUSES
+        ).values_list("product_id", flat=True)
+    )
+
+    jobs = [
+        AIAnalysisJob(product_id=pk, requested_by=requested_by)
+        for pk in product_ids
+        if pk not in busy
+    ]
+    AIAnalysisJob.objects.bulk_create(jobs)
+    logger.info(f"新建 AI 分析任务 {len(jobs)} 个，跳过进行中的 {len(busy)} 个")
+
+    dispatch_pending_jobs()
+    return len(jobs)
+
+
+def dispatch_pending_jobs():
+    """
+    在 N8N_MAX_CONCURRENT_JOBS 的并发上限内，把排队中的任务交给 django-q 执行。
+    先锁定候选行再统计在途数量，多个 worker 同时分发时会在锁上串行化。
+    """
+    limit = getattr(settings, "N8N_MAX_CONCURRENT_JOBS", 3)
+
+    with transaction.atomic():
+        candidates = list(
+            AIAnalysisJob.objects.select_for_update()
+            .filter(status="queued")
+            .order_by("id")
+            .values_list("pk", flat=True)[:limit]
+        )
+        if not candidates:
+            return 0
+
+        in_flight = AIAnalysisJob.objects.filter(
+            status__in=AIAnalysisJob.IN_FLIGHT_STATUSES
+        ).count()
+        job_ids = candidates[: max(limit - in_flight, 0)]
+        AIAnalysisJob.objects.filter(pk__in=job_ids).update(
+            status="submitted", submitted_at=timezone.now()
+        )
+
+    for job_id in job_ids:
+        async_task("products.services.ai_jobs.run_analysis_job", job_id, **queue_options("ai"))
+    return len(job_ids)
+
+
+def run_analysis_job(job_id):
+    """
+    django-q 任务：把产品发送给 n8n。
+    n8n 同步返回了文案则直接完成，否则进入“等待回调”状态。
+    """
+    job = AIAnalysisJob.objects.select_related("product").filter(pk=job_id).first()
+    if job is None:
+        # 入队后产品被删除，任务记录随之级联删除
+        logger.warning(f"AI 分析任务 #{job_id} 不存在 (产品可能已被删除)")
+        return False
+
+    try:
+        updated_fields = analyze_product(job.product, extra={"job_id": job.pk})
+    except (requests.exceptions.RequestException, N8nAnalyzeError) as e:
+        logger.error(f"AI 分析任务 #{job_id} 调用 n8n 失败: {e}")
+        _close_job(job_id, "failed", error=str(e))
+        return False
+
+    if updated_fields:
+        _close_job(job_id, "completed", updated_fields=updated_fields)
+    else:
+        # 回调可能已经先到达并关闭了任务，只更新仍处于 submitted 的记录
+        AIAnalysisJob.objects.filter(pk=job_id, status="submitted").update(status="processing")
+    return True
+
+
+def close_jobs_for_callback(product, job_id=None):
+    """
+    update_product_api 收到 n8n 回调时调用：关闭对应的任务并释放并发名额。
+    回调未携带 job_id 时，关闭该产品所有在途任务。
+    """
+    jobs = AIAnalysisJob.objects.filter(product=product)
+    if job_id:
+        jobs = jobs.filter(pk=job_id, status__in=AIAnalysisJob.OPEN_STATUSES)
+    else:
+        jobs = jobs.filter(status__in=AIAnalysisJob.IN_FLIGHT_STATUSES)
+
+    closed = jobs.update(status="completed", completed_at=timezone.now())
+    if closed:
+        dispatch_pending_jobs()
+    return closed
+
+
+def expire_stale_jobs():
+    """
+    定时任务：超过 N8N_JOB_TIMEOUT_MINUTES 仍未收到回调的任务标记为失败，
+    然后继续分发排队中的任务。
+    """
+    timeout = getattr(settings, "N8N_JOB_TIMEOUT_MINUTES", 30)
+    cutoff = timezone.now() - timedelta(minutes=timeout)
+
+    expired = AIAnalysisJob.objects.filter(
+        status__in=AIAnalysisJob.IN_FLIGHT_STATUSES, submitted_at__lt=cutoff
+    ).update(status="failed", error="超时未收到 n8n 回调", completed_at=timezone.now())
+    if expired:
+        logger.warning(f"{expired} 个 AI 分析任务超时")
+
+    dispatch_pending_jobs()
+    return expired
+
+
+def _close_job(job_id, status, error="", updated_fields=None):
+    AIAnalysisJob.objects.filter(pk=job_id, status__in=AIAnalysisJob.OPEN_STATUSES).update(
+        status=status,
+        error=error,
+        updated_fields=updated_fields or [],
+        completed_at=timezone.now(),
+    )
+    dispatch_pending_jobs()
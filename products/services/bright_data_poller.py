@@ -0,0 +1,306 @@
+# products/services/bright_data_poller.py
+
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min, Q
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from products.models import ScrapeJob
+from products.services import http_client
+from products.services.product_importer import import_products_from_list
+from products.services.snapshot_archive import write_segment
+from products.services.task_payloads import load_payload, release_payload, store_payload
+from products.scheduler import ensure_product_schedule
+from tiktok_pm_project.task_queues import queue_options
+
+logger = logging.getLogger(__name__)
+
+# Bright Data 仍在采集中的状态
+REMOTE_PENDING_STATUSES = ("starting", "pending", "running", "collecting")
+
+# 每次领取的 snapshot 数量上限
+POLL_BATCH_SIZE = 100
+
+# 下载 snapshot 的超时 (连接, 读取) 秒：大 snapshot 生成响应较慢
+DOWNLOAD_TIMEOUT = (10, 180)
+
+
+def _headers():
+    return {"Authorization": f"Bearer {settings.BRIGHT_DATA_API_KEY}"}
+
+
+def poll_delay(idle_polls):
+    """
+    下一次轮询的间隔 (秒)：有进展时回到最小间隔，
+    连续没有进展时按 2 的指数退避，不超过最大间隔。
+    """
+    min_seconds = getattr(settings, "BRIGHT_DATA_POLL_MIN_SECONDS", 10)
+    max_seconds = getattr(settings, "BRIGHT_DATA_POLL_MAX_SECONDS", 300)
+    return min(max_seconds, min_seconds * (2 ** min(idle_polls, 16)))
+
+
+# ==========================================
+# 1. 登记 snapshot
+# ==========================================
+
+
+def register_snapshot(snapshot_id, collection_mode="", inputs=None):
+    """trigger 成功后登记 snapshot，由轮询协调任务接管"""
+    now = timezone.now()
+    job, created = ScrapeJob.objects.get_or_create(
+        snapshot_id=snapshot_id,
+        defaults={
+            "collection_mode": collection_mode or "",
+            "inputs": list(inputs or []),
+            "triggered_at": now,
+            "next_poll_at": now + timedelta(seconds=poll_delay(0)),
+        },
+    )
+    # 协调任务是一条固定的周期 Schedule，只在缺失时创建
+    ensure_product_schedule("bright_data_poll_coordinator")
+    if created:
+        logger.info(f"登记 snapshot {snapshot_id} ({collection_mode})，等待轮询")
+    return job
+
+
+def record_failed_trigger(collection_mode, inputs, error):
+    """trigger 失败 (没有 snapshot_id) 时同样留下记录，便于在 admin 中排查"""
+    return ScrapeJob.objects.create(
+        collection_mode=collection_mode or "",
+        inputs=list(inputs or []),
+        status="failed",
+        error=str(error)[:2000],
+        triggered_at=timezone.now(),
+    )
+
+
+# ==========================================
+# 2. 轮询协调任务
+# ==========================================
+
+
+def _claim_due_jobs():
+    """
+    锁定到期的 snapshot 并把 next_poll_at 推后一个租约时间，
+    多个协调任务同时运行时不会重复检查同一个 snapshot。
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, "BRIGHT_DATA_POLL_TICK_SECONDS", 50) + 60)
+
+    with transaction.atomic():
+        job_ids = list(
+            ScrapeJob.objects.select_for_update()
+            .filter(status__in=ScrapeJob.OPEN_STATUSES, next_poll_at__lte=now)
+            .order_by("next_poll_at")
+            .values_list("pk", flat=True)[:POLL_BATCH_SIZE]
+        )
+        ScrapeJob.objects.filter(pk__in=job_ids).update(next_poll_at=now + lease)
+    return list(ScrapeJob.objects.filter(pk__in=job_ids).order_by("pk"))
+
+
+def requeue_stale_jobs():
+    """
+    已就绪 / 已下载超过 BRIGHT_DATA_DOWNLOAD_LEASE_MINUTES 仍未导入的 snapshot
+    (download_snapshot / import_snapshot 任务在 worker 中超时或被杀死)，回到 running 状态重新检查，
+    远端仍为 ready 时会再次下载。返回重新排队的数量。
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=getattr(settings, "BRIGHT_DATA_DOWNLOAD_LEASE_MINUTES", 60))
+    requeued = ScrapeJob.objects.filter(
+        Q(status="ready", ready_at__lt=cutoff) | Q(status="downloaded", downloaded_at__lt=cutoff)
+    ).update(status="running", next_poll_at=now, error="下载或导入超时，重新检查")
+    if requeued:
+        logger.warning(f"{requeued} 个 snapshot 下载或导入超时，重新轮询")
+    return requeued
+
+
+def poll_due_snapshots():
+    """
+    定时任务 (每分钟)：在 BRIGHT_DATA_POLL_TICK_SECONDS 时间窗口内，
+    检查所有到期的 snapshot；窗口内还有 snapshot 到期时等待后继续检查。
+    返回本次检查的 snapshot 数量。
+
+    Bright Data 的进度接口 (/datasets/v3/progress/<snapshot_id>) 每次只能查询一个 snapshot，
+    没有按多个 id 批量查询的接口 (snapshot 列表接口不返回退避所依据的 records 进度)，
+    因此每轮按批领取到期的 snapshot 后逐个请求，所有请求复用 http_client 的 bright_data 连接池。
+    """
+    tick_seconds = getattr(settings, "BRIGHT_DATA_POLL_TICK_SECONDS", 50)
+    deadline = time.monotonic() + tick_seconds
+    checked = 0
+    requeue_stale_jobs()
+
+    while True:
+        for job in _claim_due_jobs():
+            check_snapshot(job)
+            checked += 1
+
+        next_due = ScrapeJob.objects.filter(status__in=ScrapeJob.OPEN_STATUSES).aggregate(
+            next_due=Min("next_poll_at")
+        )["next_due"]
+        if not next_due:
+            break
+        wait = max((next_due - timezone.now()).total_seconds(), 0)
+        if time.monotonic() + wait >= deadline:
+            break
+        time.sleep(wait)
+
+    if checked:
+        logger.info(f"本轮检查 snapshot {checked} 个")
+    return checked
+
+
+def check_snapshot(job):
+    """
+    检查一个 snapshot 的进度：
+    - ready：交给 download_snapshot 后台下载
+    - failed：标记失败
+    - 仍在采集：按进展计算下一次轮询时间
+    - 超过 BRIGHT_DATA_SNAPSHOT_MAX_AGE_MINUTES：标记超时，不再轮询
+    """
+    now = timezone.now()
+    max_age = timedelta(minutes=getattr(settings, "BRIGHT_DATA_SNAPSHOT_MAX_AGE_MINUTES", 180))
+    jobs = ScrapeJob.objects.filter(pk=job.pk)
+
+    if job.created_at and job.created_at < now - max_age:
+        logger.warning(f"snapshot {job.snapshot_id} 超过最大等待时间，停止轮询")
+        jobs.update(status="expired", error="超过最大等待时间", last_polled_at=now)
+        return "expired"
+
+    try:
+        response = http_client.get(
+            "bright_data", f"{settings.BRIGHT_DATA_STATUS_URL}{job.snapshot_id}", headers=_headers()
+        )
+        response.raise_for_status()
+        data = response.json()
+    except Exception as e:
+        logger.error(f"轮询 snapshot {job.snapshot_id} 异常: {e}")
+        jobs.update(
+            poll_count=F("poll_count") + 1,
+            idle_polls=job.idle_polls + 1,
+            last_polled_at=now,
+            next_poll_at=now + timedelta(seconds=poll_delay(job.idle_polls + 1)),
+            error=str(e),
+        )
+        return "error"
+
+    remote_status = data.get("status") or ""
+    records = data.get("records")
+    logger.debug(f"snapshot {job.snapshot_id} 状态 = {remote_status}, records = {records}")
+
+    common = {
+        "poll_count": F("poll_count") + 1,
+        "remote_status": remote_status,
+        "remote_records": records,
+        "last_polled_at": now,
+    }
+
+    if remote_status == "ready":
+        jobs.update(status="ready", ready_at=now, error="", **common)
+        async_task(
+            "products.services.bright_data_poller.download_snapshot",
+            job.snapshot_id,
+            **queue_options("import"),
+        )
+        return "ready"
+
+    if remote_status in REMOTE_PENDING_STATUSES:
+        progressed = remote_status != job.remote_status or (
+            records is not None and records != job.remote_records
+        )
+        idle_polls = 0 if progressed else job.idle_polls + 1
+        jobs.update(
+            idle_polls=idle_polls,
+            next_poll_at=now + timedelta(seconds=poll_delay(idle_polls)),
+            **common,
+        )
+        return "running"
+
+    logger.error(f"Bright Data 返回失败状态: {remote_status}")
+    jobs.update(status="failed", error=str(data)[:2000], **common)
+    return "failed"
+
+
+# ==========================================
+# 3. 下载和导入 (django-q 任务)
+# ==========================================
+
+
+def download_snapshot(snapshot_id):
+    """
+    下载已就绪的 snapshot，数据写入任务参数文件 (task_payloads)，
+    只把引用 key 交给 import_snapshot，大数据不进入 django-q 的 broker 和任务历史。
+    下载失败时回到 running 状态，由协调任务重新检查后再次下载。
+    """
+    jobs = ScrapeJob.objects.filter(snapshot_id=snapshot_id)
+    download_url = f"{settings.BRIGHT_DATA_DOWNLOAD_BASE_URL}{snapshot_id}?format=json"
+
+    try:
+        response = http_client.get(
+            "bright_data", download_url, headers=_headers(), timeout=DOWNLOAD_TIMEOUT
+        )
+        response.raise_for_status()
+        downloaded_data = response.json()
+    except Exception as e:
+        logger.error(f"下载 snapshot {snapshot_id} 失败: {e}")
+        jobs.update(
+            status="running",
+            error=str(e),
+            next_poll_at=timezone.now() + timedelta(seconds=poll_delay(0)),
+        )
+        return False
+
+    logger.info(f"下载成功 {len(downloaded_data)} records")
+    jobs.update(
+        status="downloaded",
+        downloaded_at=timezone.now(),
+        record_count=len(downloaded_data),
+        error="",
+    )
+
+    payload_key = store_payload(downloaded_data, prefix=f"snapshot_{snapshot_id}")
+    async_task(
+        "products.services.bright_data_poller.import_snapshot",
+        snapshot_id,
+        payload_key,
+        **queue_options("import"),
+    )
+    return True
+
+
+def import_snapshot(snapshot_id, payload):
+    """
+    归档并导入 snapshot 数据，记录导入完成时间和成功数量。
+    payload 为 store_payload 返回的 key (导入成功后删除文件)；
+    也接受数据列表 (升级前已进入队列的任务)。
+    """
+    jobs = ScrapeJob.objects.filter(snapshot_id=snapshot_id)
+    payload_key = payload if isinstance(payload, str) else None
+    try:
+        products_list = load_payload(payload_key) if payload_key else payload
+    except FileNotFoundError:
+        logger.error(f"snapshot {snapshot_id} 的数据文件不存在: {payload_key}")
+        jobs.update(status="failed", error=f"数据文件不存在: {payload_key}")
+        return False
+
+    try:
+        write_segment(snapshot_id, products_list)
+    except Exception as e:
+        # 归档失败不影响导入
+        logger.error(f"归档 snapshot {snapshot_id} 失败: {e}", exc_info=True)
+
+    try:
+        imported = import_products_from_list(products_list)
+    except Exception as e:
+        logger.error(f"导入 snapshot {snapshot_id} 失败: {e}", exc_info=True)
+        jobs.update(status="failed", error=str(e))
+        return False
+
+    jobs.update(status="imported", imported_at=timezone.now(), imported_count=imported)
+    if payload_key:
+        release_payload(payload_key)
+    return imported
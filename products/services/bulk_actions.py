@@ -0,0 +1,173 @@
+# products/services/bulk_actions.py
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.utils import timezone
+from django_q.tasks import async_task
+
+from products.models import BulkOperation, Product
+from products.services.ai_jobs import enqueue_analysis
+from tiktok_pm_project.task_queues import queue_options
+
+logger = logging.getLogger(__name__)
+
+# 每条 UPDATE 语句覆盖的产品数量
+BULK_CHUNK_SIZE = 500
+
+
+def _chunked(ids, size=BULK_CHUNK_SIZE):
+    for i in range(0, len(ids), size):
+        yield ids[i : i + size]
+
+
+# ==========================================
+# 1. 单个 chunk 的处理函数 (全部为集合式 UPDATE，不调用 Product.save())
+# ==========================================
+
+
+def _update_tags(chunk_ids, transform):
+    """
+    读取一个 chunk 的 tags，按“变更后的标签组合”分组，
+    同一组合的产品共用一条 UPDATE 语句。
+    """
+    with transaction.atomic():
+        rows = (
+            Product.objects.select_for_update().filter(pk__in=chunk_ids).values_list("pk", "tags")
+        )
+
+        groups = {}
+        for pk, tags in rows:
+            current = tags if isinstance(tags, list) else []
+            new_tags = transform(current)
+            if new_tags != current:
+                groups.setdefault(tuple(new_tags), []).append(pk)
+
+        updated = 0
+        for new_tags, pks in groups.items():
+            updated += Product.objects.filter(pk__in=pks).update(
+                tags=list(new_tags), updated_at=Now()
+            )
+    return updated
+
+
+def _add_tags(chunk_ids, params):
+    tags = params.get("tags") or []
+    return _update_tags(chunk_ids, lambda current: current + [t for t in tags if t not in current])
+
+
+def _remove_tags(chunk_ids, params):
+    tags = set(params.get("tags") or [])
+    return _update_tags(chunk_ids, lambda current: [t for t in current if t not in tags])
+
+
+def _set_available(chunk_ids, params):
+    return Product.objects.filter(pk__in=chunk_ids).update(
+        available=bool(params.get("available")), updated_at=Now()
+    )
+
+
+def _download_media(chunk_ids, params):
+    for pk in chunk_ids:
+        async_task("products.tasks.download_product_images_task", pk, **queue_options("media"))
+    return len(chunk_ids)
+
+
+def _ai_analyze(chunk_ids, params):
+    # 只创建排队记录，实际发送由 ai_jobs 按 n8n 并发上限分发
+    return enqueue_analysis(chunk_ids, requested_by=params.get("requested_by", ""))
+
+
+BULK_ACTIONS = {
+    "add_tags": _add_tags,
+    "remove_tags": _remove_tags,
+    "set_available": _set_available,
+    "download_media": _download_media,
+    "ai_analyze": _ai_analyze,
+}
+
+
+# ==========================================
+# 2. 对外入口
+# ==========================================
+
+
+def run_bulk_action(action, product_ids, params=None, on_chunk=None):
+    """
+    同步执行批量操作，按 BULK_CHUNK_SIZE 分块。
+    on_chunk(processed, affected) 在每个 chunk 完成后回调，用于进度上报。
+    返回受影响的产品数量。
+    """
+    handler = BULK_ACTIONS[action]
+    params = params or {}
+
+    affected = 0
+    for chunk in _chunked(list(product_ids)):
+        chunk_affected = handler(chunk, params)
+        affected += chunk_affected
+        if on_chunk:
+            on_chunk(len(chunk), chunk_affected)
+    return affected
+
+
+def submit_bulk_action(action, product_ids, params=None, created_by=""):
+    """
+    提交批量操作：
+    - 产品数量不超过 BULK_ACTION_SYNC_LIMIT 时直接执行，返回 (None, affected)
+    - 否则创建 BulkOperation 并交给 django-q 后台执行，返回 (operation, 0)
+    """
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"未知的批量操作: {action}")
+
+    product_ids = list(product_ids)
+    sync_limit = getattr(settings, "BULK_ACTION_SYNC_LIMIT", 1000)
+
+    if len(product_ids) <= sync_limit:
+        affected = run_bulk_action(action, product_ids, params)
+        logger.info(f"批量操作 {action} 完成：{len(product_ids)} 个产品，影响 {affected} 个")
+        return None, affected
+
+    operation = BulkOperation.objects.create(
+        action=action,
+        params=params or {},
+        product_ids=product_ids,
+        total=len(product_ids),
+        created_by=created_by or "",
+    )
+    async_task(
+        "products.services.bulk_actions.execute_bulk_operation",
+        operation.pk,
+        **queue_options("import"),
+    )
+    logger.info(f"批量操作 #{operation.pk} ({action}) 已转入后台：{len(product_ids)} 个产品")
+    return operation, 0
+
+
+def execute_bulk_operation(operation_id):
+    """
+    django-q 任务：执行 BulkOperation，并在每个 chunk 之后更新进度。
+    """
+    operation = BulkOperation.objects.get(pk=operation_id)
+    BulkOperation.objects.filter(pk=operation_id).update(status="running")
+
+    def on_chunk(processed, affected):
+        BulkOperation.objects.filter(pk=operation_id).update(
+            processed=F("processed") + processed, affected=F("affected") + affected
+        )
+
+    try:
+        run_bulk_action(operation.action, operation.product_ids, operation.params, on_chunk)
+    except Exception as e:
+        logger.error(f"批量操作 #{operation_id} 失败: {e}", exc_info=True)
+        BulkOperation.objects.filter(pk=operation_id).update(
+            status="failed", error=str(e), finished_at=timezone.now()
+        )
+        return False
+
+    BulkOperation.objects.filter(pk=operation_id).update(
+        status="success", finished_at=timezone.now()
+    )
+    return True
@@ -0,0 +1,274 @@
+# products/services/http_client.py
+
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from products.services import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# 各外部服务的默认配置，可用 settings.HTTP_CLIENT_SERVICES 按服务覆盖：
+# - timeout：(连接超时, 读取超时) 秒，调用时传入 timeout 优先
+# - retries：连接失败 / RETRY_STATUSES 时的重试次数，只重试 retry_methods 中的方法
+#   (Bright Data trigger、Zipline 上传、n8n 分析重复提交会产生副作用，POST 默认不重试)
+# - pool：每个进程保持的连接数
+SERVICE_DEFAULTS = {
+    "bright_data": {"timeout": (10, 60), "retries": 3, "retry_methods": ("GET",), "pool": 10},
+    "zipline": {"timeout": (10, 60), "retries": 2, "retry_methods": ("GET",), "pool": 4},
+    "n8n": {"timeout": (10, 30), "retries": 0, "retry_methods": (), "pool": 4},
+    "tiktok_cdn": {"timeout": (10, 30), "retries": 2, "retry_methods": ("GET",), "pool": 16},
+}
+
+# 视为服务端失败的状态码：触发重试，并计入熔断
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# 延迟直方图的桶 (秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """服务处于熔断状态，请求没有发出 (继承 RequestException，调用方按网络错误处理)"""
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后熔断 reset_seconds 秒；
+    到期后放行一个试探请求，成功则恢复，失败则继续熔断。failure_threshold 为 0 时不熔断。
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                # 试探请求：其余请求在下一个窗口内继续被拒绝
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failure_threshold and self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"连续失败 {self.failures} 次，熔断 {self.reset_seconds} 秒")
+                self.opened_at = time.monotonic()
+
+
+class ServiceMetrics:
+    """单个服务在当前进程内的请求统计：按状态码分类的请求数、错误数和延迟直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.statuses = {}
+        self.errors = {}
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.throttled_seconds = 0.0
+
+    def observe(self, seconds, status=None, error=None):
+        index = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS)
+        )
+        with self._lock:
+            self.requests += 1
+            self.latency_sum += seconds
+            self.latency_buckets[index] += 1
+            if status is not None:
+                key = f"{status // 100}xx"
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def count_error(self, error):
+        with self._lock:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def throttled(self, seconds):
+        with self._lock:
+            self.throttled_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.latency_buckets):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {
+                "requests": self.requests,
+                "statuses": dict(self.statuses),
+                "errors": dict(self.errors),
+                "latency_sum": round(self.latency_sum, 6),
+                "latency_buckets": buckets,
+                "throttled_seconds": round(self.throttled_seconds, 6),
+            }
+
+
+def _error_kind(exc):
+    if isinstance(exc, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return "connection"
+    return type(exc).__name__
+
+
+class ServiceClient:
+    """一个外部服务的连接池 Session、熔断器和统计"""
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.breaker = CircuitBreaker(config["failure_threshold"], config["reset_seconds"])
+        self.metrics = ServiceMetrics()
+
+        if config["retries"] and config["retry_methods"]:
+            retry = Retry(
+                total=config["retries"],
+                backoff_factor=config["backoff"],
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset(m.upper() for m in config["retry_methods"]),
+                raise_on_status=False,
+                respect_retry_after_header=True,
+            )
+        else:
+            # 空的 allowed_methods 在 urllib3 中表示重试所有方法，这里直接关闭重试
+            retry = Retry(0, read=False)
+        adapter = HTTPAdapter(
+            pool_connections=config["pool"], pool_maxsize=config["pool"], max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, rate_limit_wait=None, **kwargs):
+        """
+        发出请求。先检查熔断，再从跨进程令牌桶 (按服务 + 主机) 取令牌：
+        rate_limit_wait 为最长等待秒数 (默认 HTTP_RATE_LIMIT_MAX_WAIT，0 表示不等待)，
+        超时抛出 RateLimitTimeout。
+        """
+        kwargs.setdefault("timeout", self.config["timeout"])
+        if not self.breaker.allow():
+            self.metrics.count_error("circuit_open")
+            raise CircuitOpenError(f"{self.name} 熔断中，暂停请求: {url}")
+
+        try:
+            waited = rate_limiter.acquire(
+                self.name, urlparse(url).hostname or "", timeout=rate_limit_wait
+            )
+        except rate_limiter.RateLimitTimeout:
+            self.metrics.count_error("rate_limited")
+            raise
+        if waited:
+            self.metrics.throttled(waited)
+
+        started = time.monotonic()
+        try:
+            response = getattr(self.session, method.lower())(url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.metrics.observe(time.monotonic() - started, error=_error_kind(e))
+            self.breaker.record(False)
+            raise
+
+        # 流式请求只统计到收到响应头为止
+        self.metrics.observe(time.monotonic() - started, status=response.status_code)
+        self.breaker.record(response.status_code not in RETRY_STATUSES)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+# ==========================================
+# 进程内共享的客户端
+# ==========================================
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+def service_config(service):
+    if service not in SERVICE_DEFAULTS:
+        raise ValueError(f"未知的外部服务: {service}")
+    return {
+        "backoff": getattr(settings, "HTTP_CLIENT_BACKOFF", 0.5),
+        "failure_threshold": getattr(settings, "HTTP_CIRCUIT_FAILURE_THRESHOLD", 5),
+        "reset_seconds": getattr(settings, "HTTP_CIRCUIT_RESET_SECONDS", 30),
+        **SERVICE_DEFAULTS[service],
+        **getattr(settings, "HTTP_CLIENT_SERVICES", {}).get(service, {}),
+    }
+
+
+def get_client(service):
+    """
+    返回服务的共享客户端 (每个进程每个服务一个)。
+    django-q worker 是 fork 出来的进程，pid 变化时重新创建，不与父进程共用连接。
+    """
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(service)
+        if client is None:
+            client = _clients[service] = ServiceClient(service, service_config(service))
+        return client
+
+
+def reset_clients():
+    """关闭所有连接并清空统计和进程内预留的限速令牌 (配置变更后或测试中使用)"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+    rate_limiter.reset_reserved()
+
+
+def request(service, method, url, **kwargs):
+    return get_client(service).request(method, url, **kwargs)
+
+
+def get(service, url, **kwargs):
+    return request(service, "GET", url, **kwargs)
+
+
+def post(service, url, **kwargs):
+    return request(service, "POST", url, **kwargs)
+
+
+def service_stats():
+    """当前进程各服务的请求统计和熔断状态"""
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {
+        client.name: {**client.metrics.snapshot(), "circuit": client.breaker.state}
+        for client in clients
+    }
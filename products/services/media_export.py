@@ -0,0 +1,120 @@
+# products/services/media_export.py
+
+import logging
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Prefetch, QuerySet
+
+from products.models import ProductImage, ProductVariation
+from products.services.product_media_downloader import (
+    DOWNLOAD_CHUNK_SIZE,
+    collect_product_image_urls,
+    download_file,
+    media_cache_path,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _ZipStream:
+    """
+    只追加的写入缓冲区，供 ZipFile 写入。
+    没有 tell()/seek()，ZipFile 会按不可回退的流写入 (数据描述符模式)，
+    每写完一块就由 drain() 取走，内存中只保留当前块。
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_media_entries(products):
+    """按产品顺序生成 (压缩包内路径, url, 本地缓存路径)；图片与 SKU 按批预取，不逐个产品查询"""
+    if isinstance(products, QuerySet):
+        products = products.prefetch_related(
+            Prefetch(
+                "product_images",
+                queryset=ProductImage.objects.only("id", "product_id", "original_url"),
+            ),
+            Prefetch(
+                "product_variations",
+                queryset=ProductVariation.objects.only("id", "product_id", "image_original_url"),
+            ),
+        ).iterator(chunk_size=100)
+    for product in products:
+        product_id = str(product.source_id)
+        urls, _ = collect_product_image_urls(product)
+        for index, url in enumerate(urls, start=1):
+            path = media_cache_path(product_id, index, url)
+            yield f"{product_id}/{path.name}", url, path
+
+
+def _ensure_local(url, path):
+    """本地已有缓存直接使用，否则下载到缓存目录 (下次导出/下载可复用)"""
+    try:
+        download_file(url, str(path.parent), path.name)
+    finally:
+        # 限速令牌桶会在预取线程中打开数据库连接，线程不会自行关闭
+        connection.close()
+    return path
+
+
+def _write_entry(zf, stream, arcname, path):
+    with open(path, "rb") as src, zf.open(arcname, "w") as dest:
+        while chunk := src.read(DOWNLOAD_CHUNK_SIZE):
+            dest.write(chunk)
+            yield stream.drain()
+    yield stream.drain()
+
+
+def stream_media_zip(products):
+    """
+    逐块生成包含所选产品全部图片 (产品图、SKU 图、详情图) 的 ZIP 数据。
+
+    - 多线程预取后面的图片，主线程按顺序写入压缩包，预取窗口有上限
+    - 图片本身已压缩，使用 ZIP_STORED 不再二次压缩
+    - 下载失败的 URL 记录在压缩包的 _errors.txt 中，不中断整个导出
+    """
+    workers = max(1, getattr(settings, "MEDIA_DOWNLOAD_WORKERS", 4))
+    stream = _ZipStream()
+    errors = []
+
+    def write_next(zf, pending):
+        arcname, url, future = pending.popleft()
+        try:
+            path = future.result()
+        except Exception as e:
+            logger.warning(f"导出图片失败 URL: {url}, 错误: {e}")
+            errors.append(f"{arcname}\t{url}\t{e}")
+            return
+        yield from _write_entry(zf, stream, arcname, path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as zf:
+            pending = deque()
+            for arcname, url, path in iter_media_entries(products):
+                pending.append((arcname, url, executor.submit(_ensure_local, url, path)))
+                if len(pending) >= workers * 2:
+                    yield from write_next(zf, pending)
+            while pending:
+                yield from write_next(zf, pending)
+
+            if errors:
+                zf.writestr("_errors.txt", "\n".join(errors) + "\n")
+        # close() 写入中央目录
+        yield stream.drain()
@@ -0,0 +1,61 @@
+# products/services/n8n_analyzer.py
+
+import logging
+
+from django.conf import settings
+
+from products.services import http_client
+from products.services.product_payload import build_product_payload
+
+logger = logging.getLogger(__name__)
+
+
+class N8nAnalyzeError(Exception):
+    """n8n Webhook 返回非 200 状态码"""
+
+
+def analyze_product(product, extra=None):
+    """
+    1. 生成产品 JSON
+    2. 发送给 n8n Webhook
+    3. 接收 n8n 返回的优化文案
+    4. 更新 Product 的 description_1 和 description_2
+
+    extra 会合并进发送的 JSON (例如 job_id，n8n 回调时原样带回)。
+    返回已更新的字段名称列表；网络错误抛出 requests.RequestException，
+    非 200 响应或产品已被删除时抛出 N8nAnalyzeError。
+    """
+    product_data = build_product_payload(product)
+    if product_data is None:
+        raise N8nAnalyzeError(f"产品 {product.pk} 已被删除")
+    if extra:
+        product_data.update(extra)
+
+    n8n_webhook_url = getattr(settings, "N8N_WEBHOOK_OPTIMIZE_PRODUCT_URL", None)
+    logger.info(f"n8n_webhook_url: {n8n_webhook_url}")
+
+    # 超时见 http_client 的 n8n 配置，防止 n8n 处理太久导致 worker 卡死
+    response = http_client.post("n8n", n8n_webhook_url, json=product_data)
+
+    if response.status_code != 200:
+        raise N8nAnalyzeError(f"HTTP {response.status_code} - {response.text}")
+
+    result = response.json()
+
+    # 🌟 预期 n8n 返回格式: {"desc_1": "...", "desc_2": "..."}
+    new_desc_1 = result.get("desc_1")
+    new_desc_2 = result.get("desc_2")
+
+    updated_fields = []
+    if new_desc_1:
+        product.description_1 = new_desc_1
+        updated_fields.append("Description 1")
+
+    if new_desc_2:
+        product.description_2 = new_desc_2
+        updated_fields.append("Description 2")
+
+    if updated_fields:
+        product.save()
+
+    return updated_fields
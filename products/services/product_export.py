@@ -0,0 +1,92 @@
+# products/services/product_export.py
+
+import json
+import logging
+
+from products.services.product_payload import PAYLOAD_CHUNK_SIZE, build_product_payloads
+
+logger = logging.getLogger(__name__)
+
+# 每批读取的产品数量 (内存占用与总数无关)
+EXPORT_CHUNK_SIZE = PAYLOAD_CHUNK_SIZE
+
+EXPORT_FORMATS = ("ndjson", "parquet")
+
+
+def iter_product_payloads(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """逐个生成产品 payload，每 chunk_size 个产品一批预加载"""
+    return build_product_payloads(queryset, chunk_size=chunk_size)
+
+
+def iter_ndjson(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """生成 NDJSON 字节串：每行一个产品，按批 yield 以减少响应分块数量"""
+    lines = []
+    for payload in iter_product_payloads(queryset, chunk_size):
+        lines.append(json.dumps(payload, ensure_ascii=False, default=str))
+        if len(lines) >= chunk_size:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def write_ndjson(queryset, path, chunk_size=EXPORT_CHUNK_SIZE):
+    """写入 NDJSON 文件，返回导出的产品数量"""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for payload in iter_product_payloads(queryset, chunk_size):
+            f.write(json.dumps(payload, ensure_ascii=False, default=str))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def write_parquet(queryset, path, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    按批写入 Parquet 文件 (需要安装 pyarrow)，返回导出的产品数量。
+    嵌套字段 (description_detail / specifications / variations) 以 JSON 字符串存储，
+    images 为字符串列表。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("导出 Parquet 需要安装 pyarrow：pip install pyarrow") from e
+
+    schema = pa.schema(
+        [
+            ("id", pa.string()),
+            ("title", pa.string()),
+            ("category", pa.string()),
+            ("url", pa.string()),
+            ("price", pa.string()),
+            ("store", pa.string()),
+            ("description", pa.string()),
+            ("description_detail", pa.string()),
+            ("specifications", pa.string()),
+            ("images", pa.list_(pa.string())),
+            ("variations", pa.string()),
+        ]
+    )
+    json_fields = ("description_detail", "specifications", "variations")
+
+    def to_batch(rows):
+        for row in rows:
+            for field in json_fields:
+                if row[field] is not None and not isinstance(row[field], str):
+                    row[field] = json.dumps(row[field], ensure_ascii=False, default=str)
+        return pa.RecordBatch.from_pylist(rows, schema=schema)
+
+    count = 0
+    rows = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for payload in iter_product_payloads(queryset, chunk_size):
+            rows.append(payload)
+            if len(rows) >= chunk_size:
+                writer.write_batch(to_batch(rows))
+                count += len(rows)
+                rows = []
+        if rows:
+            writer.write_batch(to_batch(rows))
+            count += len(rows)
+    return count
@@ -0,0 +1,164 @@
+# products/services/product_history.py
+
+import logging
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+
+from products.models import Product, ProductHistory
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FIELDS = ("price", "sold", "stock")
+
+# 读取上一条记录、删除过期记录时每批处理的数量
+HISTORY_BATCH_SIZE = 1000
+
+SERIES_INTERVALS = ("raw", "day")
+
+
+def _price(value):
+    if value is None or value == "":
+        return None
+    try:
+        return Decimal(str(value)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+# ==========================================
+# 1. 写入：只记录发生变化的值
+# ==========================================
+
+
+def latest_history(product_ids):
+    """每个产品最新一条历史记录：{product_id: (price, sold, stock)}"""
+    latest = {}
+    product_ids = list(product_ids)
+    for i in range(0, len(product_ids), HISTORY_BATCH_SIZE):
+        last_pk = Subquery(
+            ProductHistory.objects.filter(product=OuterRef("pk"))
+            .order_by("-ts", "-pk")
+            .values("pk")[:1]
+        )
+        history_ids = (
+            Product.objects.filter(pk__in=product_ids[i : i + HISTORY_BATCH_SIZE])
+            .annotate(last_history=last_pk)
+            .exclude(last_history=None)
+            .values_list("last_history", flat=True)
+        )
+        for product_id, *values in ProductHistory.objects.filter(
+            pk__in=list(history_ids)
+        ).values_list("product_id", *HISTORY_FIELDS):
+            latest[product_id] = tuple(values)
+    return latest
+
+
+def record_history(entries, ts=None):
+    """
+    批量写入历史记录。entries 为 [(product_id, price, sold, stock)]；
+    与该产品最新一条记录完全相同的值不写入。返回写入的记录数。
+    """
+    ts = ts or timezone.now()
+    current = {}
+    for product_id, price, sold, stock in entries:
+        current[product_id] = (_price(price), sold, stock)
+    if not current:
+        return 0
+
+    previous = latest_history(current)
+    rows = [
+        ProductHistory(product_id=product_id, ts=ts, price=price, sold=sold, stock=stock)
+        for product_id, (price, sold, stock) in current.items()
+        if previous.get(product_id) != (price, sold, stock)
+    ]
+    ProductHistory.objects.bulk_create(rows, batch_size=HISTORY_BATCH_SIZE)
+    return len(rows)
+
+
+# ==========================================
+# 2. 降采样和保留期 (定时任务)
+# ==========================================
+
+
+def compact_history():
+    """
+    定时任务 (每天)：
+    - 超过 PRODUCT_HISTORY_RAW_DAYS 天的记录每个产品每天只保留最后一条
+    - 超过 PRODUCT_HISTORY_RETENTION_DAYS 天的记录删除
+    返回 {"expired": 删除的过期记录数, "downsampled": 降采样删除的记录数}。
+    """
+    now = timezone.now()
+    raw_days = getattr(settings, "PRODUCT_HISTORY_RAW_DAYS", 30)
+    retention_days = getattr(settings, "PRODUCT_HISTORY_RETENTION_DAYS", 365)
+
+    expired = 0
+    if retention_days > 0:
+        old = ProductHistory.objects.filter(ts__lt=now - timedelta(days=retention_days))
+        while True:
+            batch = list(old.values_list("pk", flat=True)[:HISTORY_BATCH_SIZE])
+            if not batch:
+                break
+            expired += ProductHistory.objects.filter(pk__in=batch).delete()[0]
+
+    downsampled = 0
+    # 只处理完整的一天，按天逐段处理，每段只扫描 ts 索引上的一个范围
+    end = (now - timedelta(days=raw_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    oldest = (
+        ProductHistory.objects.filter(ts__lt=end)
+        .order_by("ts")
+        .values_list("ts", flat=True)
+        .first()
+    )
+    if oldest:
+        day = oldest.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < end:
+            rows = ProductHistory.objects.filter(ts__gte=day, ts__lt=day + timedelta(days=1))
+            # 只追加写入，主键最大的就是当天最后一条
+            keep = rows.values("product_id").annotate(last=Max("pk")).values("last")
+            downsampled += rows.exclude(pk__in=keep).delete()[0]
+            day += timedelta(days=1)
+
+    if expired or downsampled:
+        logger.info(f"产品历史：删除过期记录 {expired} 条，降采样删除 {downsampled} 条")
+    return {"expired": expired, "downsampled": downsampled}
+
+
+# ==========================================
+# 3. 查询：多个产品的时间序列
+# ==========================================
+
+
+def history_series(product_ids, since=None, until=None, interval="raw"):
+    """
+    返回多个产品的时间序列 (按列存储，便于直接绘图)：
+    {product_id: {"ts": [unix 秒], "price": [...], "sold": [...], "stock": [...]}}
+    interval="day" 时每个产品每天只保留最后一个点。单次查询按 (product, ts) 索引顺序读取。
+    """
+    queryset = ProductHistory.objects.filter(product_id__in=list(product_ids))
+    if since:
+        queryset = queryset.filter(ts__gte=since)
+    if until:
+        queryset = queryset.filter(ts__lt=until)
+
+    series = {}
+    last_day = {}
+    rows = queryset.order_by("product_id", "ts", "pk").values_list(
+        "product_id", "ts", *HISTORY_FIELDS
+    )
+    for product_id, ts, price, sold, stock in rows.iterator(chunk_size=5000):
+        data = series.setdefault(product_id, {"ts": [], "price": [], "sold": [], "stock": []})
+        point = (int(ts.timestamp()), float(price) if price is not None else None, sold, stock)
+
+        day = ts.date()
+        if interval == "day" and last_day.get(product_id) == day:
+            for key, value in zip(("ts", "price", "sold", "stock"), point):
+                data[key][-1] = value
+            continue
+        last_day[product_id] = day
+        for key, value in zip(("ts", "price", "sold", "stock"), point):
+            data[key].append(value)
+    return series
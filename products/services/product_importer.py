@@ -2,9 +2,9 @@ import logging
 import mimetypes
 from datetime import datetime
 
-import requests
 from django.conf import settings
-from django.db import transaction
+from django.db import connection, transaction
+from django.utils import timezone
 from django.utils.timezone import make_aware
 
 # 引入你的模型
@@ -16,10 +16,23 @@ from products.models import (
     ProductVideo,
     Store,
 )
+from products.services import http_client
+from products.services.product_history import record_history
+from products.services.product_media_downloader import MEDIA_TRANSFER_BYTES
+from products.services.product_rollups import refresh_rollups
+from products.services.raw_payloads import delete_replaced_payloads, store_raw_payloads
+from products.services.store_metrics import refresh_store_metrics
 from products.utils import json_to_html, save_html_file
+from tiktok_pm_project import metrics
 
 logger = logging.getLogger(__name__)
 
+IMPORTED_PRODUCTS = metrics.counter(
+    "tiktok_import_products_total",
+    "Products processed by the importer.",
+    ("result",),
+)
+
 
 # ==========================================
 # 1. 媒体处理工具 (保留原逻辑)
@@ -41,7 +54,7 @@ def download_media(url):
     if not url:
         return None, None
     try:
-        resp = requests.get(url, stream=True, timeout=30)
+        resp = http_client.get("tiktok_cdn", url, stream=True)
         if resp.status_code != 200:
             logger.warning(f"Download fail: {url} (Status: {resp.status_code})")
             return None, None
@@ -51,7 +64,9 @@ def download_media(url):
         if not filename:
             filename = "temp_file"
 
-        return resp.content, filename
+        content = resp.content
+        MEDIA_TRANSFER_BYTES.inc(len(content), service="tiktok_cdn", direction="download")
+        return content, filename
     except Exception as e:
         logger.error(f"Download error: {e}")
         return None, None
@@ -70,8 +85,9 @@ def upload_to_zipline(file_bytes, filename):
     headers = {"Authorization": api_key}
 
     try:
-        resp = requests.post(upload_url, headers=headers, files=files, timeout=60)
+        resp = http_client.post("zipline", upload_url, headers=headers, files=files)
         resp.raise_for_status()
+        MEDIA_TRANSFER_BYTES.inc(len(file_bytes), service="zipline", direction="upload")
         data = resp.json()
 
         # 尝试获取 URL
@@ -95,6 +111,26 @@ def process_media_url(original_url, download_flag):
     return zipline_url
 
 
+def _process_item_media(item, download_flag):
+    """
+    在产品事务之外处理一个产品的全部媒体 (产品图、视频、SKU 图、评论图)，
+    返回 {原始 URL: Zipline URL}；未开启下载时返回空 dict。
+    """
+    if not download_flag:
+        return {}
+    urls = [
+        *(item.get("images") or []),
+        *(item.get("videos") or []),
+        *(var.get("image") for var in item.get("variations") or []),
+        *(img for r in item.get("reviews") or [] for img in r.get("images") or []),
+    ]
+    media = {}
+    for url in urls:
+        if url and url not in media:
+            media[url] = process_media_url(url, True)
+    return media
+
+
 # ==========================================
 # 2. 数据清洗工具
 # ==========================================
@@ -144,24 +180,51 @@ def _parse_datetime(value):
 
 def import_products_from_list(products_list):
     """
-    主入口：接收字典列表，使用 ORM 写入数据库
+    主入口：接收字典列表，使用 ORM 写入数据库，返回导入成功的产品数量
     """
     logger.info(f"开始导入 {len(products_list)} 个产品 (ORM Mode)...")
+    imported = failed = 0
+    history_entries = []
+    categories, store_ids = set(), set()
+    replaced_payloads = set()
 
     download_flag = getattr(settings, "IMAGE_DOWNLOAD_FLAG", False)
 
+    # 同一批产品通常来自少数几个店铺：去重后一次写入
+    try:
+        stores = _upsert_stores(products_list)
+    except Exception as e:
+        logger.error(f"批量写入店铺失败: {e}", exc_info=True)
+        stores = {}
+
+    # 原始记录压缩后整批写入 product_raw_payloads (内容相同的只保存一份)
+    try:
+        payload_ids = store_raw_payloads(
+            {item["id"]: item for item in products_list if item.get("id")}
+        )
+    except Exception as e:
+        logger.error(f"批量写入原始记录失败: {e}", exc_info=True)
+        payload_ids = {}
+
+    # 上一次采集的销量/价格 (计算刷新统计)：整批一次读取，不逐个产品查询
+    previous_stats = _previous_stats(products_list)
+
     for item in products_list:
         source_id = item.get("id")
         if not source_id:
             continue
 
         try:
+            # 媒体下载/上传 (外部请求和限速等待) 在事务外完成，产品事务中不发起网络请求
+            media = _process_item_media(item, download_flag)
+
             # 开启事务原子性：确保一个产品的所有数据（图片、变体）要么全成功，要么全失败
             with transaction.atomic():
                 logger.info(f"Processing: {source_id}")
 
-                # --- 1. 处理 Store ---
-                store = _handle_store(item)
+                # --- 1. 处理 Store (整批已预先 upsert) ---
+                parsed_store = _store_defaults(item)
+                store = stores.get(parsed_store[0]) if parsed_store else None
 
                 # --- 2. 生成 HTML 描述文件 ---
                 desc_html_path = ""
@@ -171,7 +234,14 @@ def import_products_from_list(products_list):
                     desc_html_path = save_html_file(source_id, html_content)
 
                 # --- 3. 处理 Product 本体 ---
-                product = _handle_product(item, source_id, store, desc_html_path)
+                product = _handle_product(
+                    item,
+                    source_id,
+                    store,
+                    desc_html_path,
+                    payload_ids.get(source_id),
+                    previous_stats.get(source_id),
+                )
 
                 # --- 4. 处理关联表 (先删除旧的，再插入新的，保持同步) ---
 
@@ -181,7 +251,7 @@ def import_products_from_list(products_list):
                 for img_url in images:
                     if not img_url:
                         continue
-                    zipline_url = process_media_url(img_url, download_flag)
+                    zipline_url = media.get(img_url, "")
                     ProductImage.objects.create(
                         product=product,
                         image_type="main",
@@ -195,7 +265,7 @@ def import_products_from_list(products_list):
                 for vid_url in videos:
                     if not vid_url:
                         continue
-                    zipline_url = process_media_url(vid_url, download_flag)  # 视频也可以尝试上传
+                    zipline_url = media.get(vid_url, "")  # 视频也可以尝试上传
                     ProductVideo.objects.create(
                         product=product,
                         video_type="main",
@@ -208,7 +278,7 @@ def import_products_from_list(products_list):
                 variations = item.get("variations") or []
                 for var in variations:
                     var_img_url = var.get("image")
-                    var_zipline = process_media_url(var_img_url, download_flag)
+                    var_zipline = media.get(var_img_url, "")
 
                     ProductVariation.objects.create(
                         product=product,
@@ -233,7 +303,7 @@ def import_products_from_list(products_list):
                     r_zipline_urls = []
                     if download_flag:
                         for r_img in r_images:
-                            z_url = process_media_url(r_img, True)  # 强制下载评论图
+                            z_url = media.get(r_img)
                             if z_url:
                                 r_zipline_urls.append(z_url)
 
@@ -248,19 +318,58 @@ def import_products_from_list(products_list):
                     )
 
                 logger.info(f"Success: {source_id}")
+            imported += 1
+
+            stock = sum(_clean_int(v.get("stock")) for v in variations) if variations else None
+            history_entries.append((product.pk, product.final_price, product.sold, stock))
+            old_payload = (previous_stats.get(source_id) or {}).get("raw_payload_id")
+            if old_payload and old_payload != product.raw_payload_id:
+                replaced_payloads.add(old_payload)
+            # 同一批中重复出现的产品以本次写入的值为上一次采集
+            previous_stats[source_id] = {
+                field: getattr(product, field) for field in PREVIOUS_STATS_FIELDS
+            }
+            categories.add(product.category)
+            store_ids.add(product.store_id)
 
         except Exception as e:
             logger.error(f"Error importing {source_id}: {e}")
+            failed += 1
             # transaction.atomic 会自动回滚
 
+    IMPORTED_PRODUCTS.inc(imported, result="imported")
+    IMPORTED_PRODUCTS.inc(failed, result="failed")
+
+    # 价格/销量/库存历史：整批一次写入，只记录发生变化的值
+    try:
+        record_history(history_entries)
+    except Exception as e:
+        logger.error(f"写入产品历史失败: {e}", exc_info=True)
+
+    # 重新导入的产品指向新的原始记录后，删除不再被引用的旧记录
+    try:
+        delete_replaced_payloads(replaced_payloads)
+    except Exception as e:
+        logger.error(f"删除旧原始记录失败: {e}", exc_info=True)
+
+    # 增量更新受影响的分类/店铺汇总和店铺统计
+    if imported:
+        try:
+            refresh_rollups(categories=categories, store_ids=store_ids)
+            refresh_store_metrics(store_ids)
+        except Exception as e:
+            logger.error(f"更新产品汇总失败: {e}", exc_info=True)
+
+    return imported
+
 
 # ==========================================
 # 4. 内部 Helper (Models Mapping)
 # ==========================================
 
 
-def _handle_store(item):
-    """处理店铺信息"""
+def _store_defaults(item):
+    """从产品数据中提取店铺信息，返回 (store_id, defaults)；没有店铺链接时返回 None"""
     details = item.get("store_details") or {}
     url = details.get("url")
     if not url:
@@ -271,26 +380,54 @@ def _handle_store(item):
         store_id = url.strip("/").split("/")[-1]
     except (AttributeError, IndexError):
         return None
+    if not store_id:
+        return None
+
+    return store_id, {
+        "name": details.get("name"),
+        "url": url,
+        "rating": _clean_price(details.get("rating")),
+        "num_of_items": _clean_int(details.get("num_of_items")),
+        "num_sold": _clean_int(details.get("num_sold")),
+        "followers": _clean_int(details.get("followers")),
+        "badge": details.get("badge"),
+    }
+
 
-    store, _ = Store.objects.update_or_create(
-        store_id=store_id,
-        defaults={
-            "name": details.get("name"),
-            "url": url,
-            "rating": _clean_price(details.get("rating")),
-            "num_of_items": _clean_int(details.get("num_of_items")),
-            "num_sold": _clean_int(details.get("num_sold")),
-            "followers": _clean_int(details.get("followers")),
-            "badge": details.get("badge"),
-        },
+STORE_UPSERT_FIELDS = ["name", "url", "rating", "num_of_items", "num_sold", "followers", "badge"]
+
+
+def _upsert_stores(products_list):
+    """
+    整批产品的店铺按 store_id 去重 (同一店铺以最后出现的数据为准)，
+    一次批量 upsert 后一次读回，返回 {store_id: Store}。
+    """
+    stores = {}
+    for item in products_list:
+        parsed = _store_defaults(item)
+        if parsed:
+            store_id, defaults = parsed
+            stores[store_id] = Store(store_id=store_id, **defaults)
+    if not stores:
+        return {}
+
+    # MySQL/MariaDB 的 ON DUPLICATE KEY UPDATE 不指定冲突列，传入 unique_fields 会抛出 NotSupportedError
+    unique_fields = (
+        ["store_id"] if connection.features.supports_update_conflicts_with_target else None
     )
-    return store
+    Store.objects.bulk_create(
+        stores.values(),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=STORE_UPSERT_FIELDS,
+    )
+    return Store.objects.in_bulk(list(stores), field_name="store_id")
 
 
-def _handle_product(item, source_id, store, desc_html_path):
-    """处理产品本体映射"""
+def _handle_product(item, source_id, store, desc_html_path, raw_payload_id=None, previous=None):
+    """处理产品本体映射；previous 为 _previous_stats 读取的上一次采集的值 (新产品为 None)"""
     defaults = {
-        "store": store,
         "url": item.get("url"),
         "title": item.get("title"),
         "description": item.get("description"),
@@ -324,9 +461,70 @@ def _handle_product(item, source_id, store, desc_html_path):
         "promotion_items": item.get("promotion_items"),
         "shop_performance_metrics": item.get("Shop_performance_metrics"),
         "timestamp": _parse_datetime(item.get("timestamp")),
-        "input": item.get("input"),
-        "raw_json": item,
+        # 原始记录已写入 product_raw_payloads 时不再保存在产品行中
+        "input": None if raw_payload_id else item.get("input"),
+        "raw_json": None if raw_payload_id else item,
+        "raw_payload_id": raw_payload_id,
     }
+    # 店铺批量写入失败时 (数据中有店铺但 store 为 None)，保留产品原有的店铺关联，不覆盖为空
+    if store is not None or _store_defaults(item) is None:
+        defaults["store"] = store
+    defaults.update(_refresh_stats(previous, defaults["sold"], defaults["final_price"]))
 
     product, created = Product.objects.update_or_create(source_id=source_id, defaults=defaults)
     return product
+
+
+# 价格波动的平滑系数：越大越偏向最近一次变化
+VOLATILITY_ALPHA = 0.5
+
+# raw_payload_id 用于导入后删除被替换的旧原始记录
+PREVIOUS_STATS_FIELDS = (
+    "sold",
+    "final_price",
+    "last_scraped_at",
+    "updated_at",
+    "price_volatility",
+    "raw_payload_id",
+)
+PREVIOUS_STATS_CHUNK_SIZE = 1000
+
+
+def _previous_stats(products_list):
+    """整批产品上一次采集的销量、价格等，返回 {source_id: {字段: 值}}"""
+    source_ids = list({item["id"] for item in products_list if item.get("id")})
+    previous = {}
+    for start in range(0, len(source_ids), PREVIOUS_STATS_CHUNK_SIZE):
+        rows = Product.objects.filter(
+            source_id__in=source_ids[start : start + PREVIOUS_STATS_CHUNK_SIZE]
+        ).values("source_id", *PREVIOUS_STATS_FIELDS)
+        for row in rows:
+            previous[row.pop("source_id")] = row
+    return previous
+
+
+def _refresh_stats(previous, sold, price):
+    """
+    根据上一次采集的销量和价格 (previous，见 _previous_stats) 计算刷新调度使用的统计：
+    - sold_velocity：两次采集之间的日均销量增长
+    - price_volatility：价格相对变化幅度的指数平滑值
+    """
+    now = timezone.now()
+    stats = {"last_scraped_at": now, "updated_at": now}
+
+    if not previous:
+        return stats
+
+    last_scraped = previous["last_scraped_at"] or previous["updated_at"]
+    if last_scraped and previous["sold"] is not None and sold is not None:
+        # 至少按 1 小时计算，避免短时间内重复采集放大增长速度
+        days = max((now - last_scraped).total_seconds() / 86400, 1 / 24)
+        stats["sold_velocity"] = max(sold - previous["sold"], 0) / days
+
+    old_price = previous["final_price"]
+    if old_price and price is not None:
+        change = abs(float(price) - float(old_price)) / float(old_price)
+        stats["price_volatility"] = (
+            VOLATILITY_ALPHA * change + (1 - VOLATILITY_ALPHA) * previous["price_volatility"]
+        )
+    return stats
@@ -1,17 +1,39 @@
+import logging
 import os
 import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Set  # 导入类型提示
+from typing import Any, Dict, List, Tuple  # 导入类型提示
 from urllib.parse import urlparse
 
-import requests
 from django.conf import settings
+from django.db import connection
+
+from products.services import http_client
+from tiktok_pm_project import metrics
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TRANSFER_BYTES = metrics.counter(
+    "tiktok_media_transfer_bytes_total",
+    "Media bytes downloaded from or uploaded to external services.",
+    ("service", "direction"),
+)
 
 # 用于匹配图片扩展名的正则表达式
 IMG_EXT_RE = re.compile(r"\.(jpg|jpeg|png|webp|gif)", re.I)
 # Windows 非法字符
 ILLEGAL_CHARS = r'[<>:"/\\|?*]'
 
+# 流式写入的块大小
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 未完成的下载先写入 <文件名>.part，完成后原子重命名
+PARTIAL_SUFFIX = ".part"
+# 写入 .part 的下载持有 <文件名>.part.lock；超过该秒数的锁视为进程异常退出后遗留
+PARTIAL_LOCK_STALE_SECONDS = 15 * 60
+
 
 def _safe_filename(url: str) -> str:
     """从 URL 中提取安全的文件名部分，移除查询参数"""
@@ -21,42 +43,98 @@ def _safe_filename(url: str) -> str:
 
 
 # ----------------------------------------------------------------------
-# 辅助函数：核心下载逻辑 (已修复路径拼接)
+# 辅助函数：核心下载逻辑 (流式写入临时文件 + 原子重命名 + 断点续传)
 # ----------------------------------------------------------------------
-def _download(url: str, save_directory: str, filename: str):
+def _claim_partial(part_path: Path):
+    """独占 .part 文件 (创建 .lock)，成功返回锁文件路径；其他下载正在写入时返回 None"""
+    lock_path = part_path.with_name(part_path.name + ".lock")
+    for _ in range(2):
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return lock_path
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime < PARTIAL_LOCK_STALE_SECONDS:
+                    return None
+                lock_path.unlink()
+            except FileNotFoundError:
+                pass
+    return None
+
+
+def _fetch(url: str, part_path: Path, target_path: Path, resume: bool) -> str:
+    offset = part_path.stat().st_size if resume and part_path.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with http_client.get("tiktok_cdn", url, headers=headers, stream=True) as resp:
+        if offset and resp.status_code == 416:
+            # .part 已经是完整文件
+            os.replace(part_path, target_path)
+            return "downloaded"
+        resp.raise_for_status()
+
+        # 206 表示服务器接受续传；否则从头写入
+        mode = "ab" if offset and resp.status_code == 206 else "wb"
+        with open(part_path, mode) as f:
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    MEDIA_TRANSFER_BYTES.inc(len(chunk), service="tiktok_cdn", direction="download")
+
+    os.replace(part_path, target_path)
+    return "downloaded"
+
+
+def download_file(url: str, save_directory: str, filename: str) -> str:
     """
-    下载文件到指定的目录和文件名。
+    下载文件到指定的目录和文件名，返回 "downloaded" 或 "skipped"。
+
+    - 目标文件已存在：跳过
+    - 存在 .part 临时文件：用 Range 请求续传，服务器不支持时重新下载
+    - 同一文件同时被多处下载 (如 ZIP 导出与后台下载) 时，只有持有 .part.lock 的一方写入 .part，
+      其余写入各自的临时文件且不续传，不会交错写入同一个文件
+    - 下载完成后 os.replace 原子重命名，中途失败不会留下不完整的目标文件
+    - 所有下载线程共用 http_client 的 tiktok_cdn 连接池
     """
     if not url:
-        return
+        return "skipped"
 
-    # 构造完整的目标路径
     target_path = Path(save_directory) / filename
-    target_path_str = str(target_path)
-
-    os.makedirs(os.path.dirname(target_path_str), exist_ok=True)
-
-    if os.path.exists(target_path_str):
-        return  # 避免重复下载
-
-    resp = requests.get(url, timeout=30)
-    resp.raise_for_status()
-
-    with open(target_path_str, "wb") as f:
-        f.write(resp.content)
+    if target_path.exists():
+        return "skipped"  # 避免重复下载
+
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path = target_path.with_name(target_path.name + PARTIAL_SUFFIX)
+
+    lock_path = _claim_partial(part_path)
+    if lock_path is None:
+        part_path = target_path.with_name(
+            f"{target_path.name}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}"
+        )
+    try:
+        if target_path.exists():
+            return "skipped"  # 等待锁期间另一方已下载完成
+        return _fetch(url, part_path, target_path, resume=lock_path is not None)
+    finally:
+        if lock_path is not None:
+            lock_path.unlink(missing_ok=True)
+        else:
+            # 自己的临时文件不续传，失败时直接删除 (成功时已被重命名)
+            part_path.unlink(missing_ok=True)
 
 
 # ----------------------------------------------------------------------
 # 辅助函数：从嵌套结构中提取图片 URL
 # ----------------------------------------------------------------------
-def extract_images_from_desc_detail(desc_detail: Dict[str, Any]) -> Set[str]:
+def extract_images_from_desc_detail(desc_detail: Dict[str, Any]) -> List[str]:
     """
-    递归遍历 desc_detail (JSON/Dict) 结构，提取图片 URL。
+    递归遍历 desc_detail (JSON/Dict) 结构，按出现顺序提取去重后的图片 URL。
+    顺序固定，保证文件编号在多次下载之间保持一致。
     """
-    urls = set()
+    urls: Dict[str, None] = {}
 
     if not desc_detail:
-        return urls
+        return []
 
     def walk(obj):
         if isinstance(obj, dict):
@@ -68,86 +146,102 @@ def extract_images_from_desc_detail(desc_detail: Dict[str, Any]) -> Set[str]:
         elif isinstance(obj, str):
             # 检查字符串是否匹配图片扩展名
             if IMG_EXT_RE.search(obj):
-                urls.add(obj)
+                urls.setdefault(obj)
 
     walk(desc_detail)
-    return urls
+    return list(urls)
 
 
 # ----------------------------------------------------------------------
 # 核心函数：下载所有产品图片
 # ----------------------------------------------------------------------
-def download_all_product_images(product) -> (str, Dict[str, int]):
+def collect_product_image_urls(product) -> Tuple[List[str], Dict[str, int]]:
     """
-    下载一个产品的所有图片（产品图、SKU图、详情图），并使用 <product_id>_<index> 格式重命名。
+    按固定顺序收集产品图、SKU 图、详情图的 URL (去重)，返回 (urls, 各类数量)。
     """
-    # 确保 product_id 是字符串，用于路径和文件名
-    product_id = str(product.source_id)
-
-    # 1. 确定保存的基础目录
-    # base_save_dir = Path(settings.MEDIA_ROOT) / 'downloaded_media' / product_id
-    # base_save_dir.mkdir(parents=True, exist_ok=True)
-    base_download_root = settings.PRODUCT_MEDIA_DOWNLOAD_ROOT
-    base_save_dir = Path(base_download_root) / product_id
-
-    # 2. 初始化计数器和汇总数据
-    global_image_counter = 1
     summary = {"product_images": 0, "variation_images": 0, "desc_images": 0}
 
-    # 用于存放所有需要下载的 URL，按收集顺序排列
-    urls_to_download: List[str] = []
-
-    # --- 收集 URL ---
+    # 使用 .all() 而不是 values_list：批量导出时复用 prefetch_related 预取的结果
 
     # A. 收集产品图片 (ProductImage)
-    # 使用正确的反向关联名称 'product_images'
-    product_images = product.product_images.all().order_by("id")
-    product_urls = [img.original_url for img in product_images if img.original_url]
-    urls_to_download.extend(product_urls)
+    product_urls = [
+        image.original_url
+        for image in sorted(product.product_images.all(), key=lambda image: image.pk)
+        if image.original_url
+    ]
     summary["product_images"] = len(product_urls)
 
     # B. 收集 SKU 图片 (ProductVariation)
-    # 使用正确的反向关联名称 'product_variations'
-    variation_images = product.product_variations.all().order_by("id")
-    variation_urls = [v.image_original_url for v in variation_images if v.image_original_url]
-    urls_to_download.extend(variation_urls)
+    variation_urls = [
+        variation.image_original_url
+        for variation in sorted(
+            product.product_variations.all(), key=lambda variation: variation.pk
+        )
+        if variation.image_original_url
+    ]
     summary["variation_images"] = len(variation_urls)
 
     # C. 收集详情图 (Desc Detail Images)
-    desc_urls: Set[str] = set()
-    if product.desc_detail:
-        desc_urls = extract_images_from_desc_detail(product.desc_detail)
-        urls_to_download.extend(list(desc_urls))
-        summary["desc_images"] = len(desc_urls)
-
-    # 3. 去重并下载
+    desc_urls = extract_images_from_desc_detail(product.desc_detail) if product.desc_detail else []
+    summary["desc_images"] = len(desc_urls)
 
     # 移除重复的 URL，保持收集时的顺序
-    unique_urls = list(dict.fromkeys(urls_to_download))
+    unique_urls = list(dict.fromkeys(product_urls + variation_urls + desc_urls))
+    return unique_urls, summary
 
-    for url in unique_urls:
-        # 1. 构造新的标准化文件名 (保留原始扩展名或使用 .jpeg)
-        safe_name = _safe_filename(url)
-        ext = os.path.splitext(safe_name)[-1].lower()
 
-        # 如果扩展名无效或缺失，则使用 .jpeg
-        if not IMG_EXT_RE.search(ext):
-            ext = ".jpeg"
+def media_filename(product_id: str, index: int, url: str) -> str:
+    """<product_id>_<URL 序号><扩展名>：序号只取决于 URL 的顺序，与其他文件是否下载成功无关"""
+    ext = os.path.splitext(_safe_filename(url))[-1].lower()
+    # 如果扩展名无效或缺失，则使用 .jpeg
+    if not IMG_EXT_RE.search(ext):
+        ext = ".jpeg"
+    return f"{product_id}_{index}{ext}"
 
-        new_filename = f"{product_id}_{global_image_counter}{ext}"
-        current_save_dir = base_save_dir
 
-        try:
-            # 2. 调用下载辅助函数
-            _download(url, str(current_save_dir), new_filename)
+def media_cache_path(product_id: str, index: int, url: str) -> Path:
+    """图片在 PRODUCT_MEDIA_DOWNLOAD_ROOT 下的本地缓存路径"""
+    return (
+        Path(settings.PRODUCT_MEDIA_DOWNLOAD_ROOT)
+        / product_id
+        / media_filename(product_id, index, url)
+    )
 
-            # 3. 更新计数器
-            global_image_counter += 1
 
+def download_all_product_images(product) -> Tuple[str, Dict[str, int]]:
+    """
+    下载一个产品的所有图片（产品图、SKU图、详情图），并使用 <product_id>_<index> 格式重命名。
+
+    多线程并行下载 (MEDIA_DOWNLOAD_WORKERS)，已下载的文件会被跳过，
+    未完成的 .part 文件会续传，因此中断后可以直接重新执行。
+    """
+    # 确保 product_id 是字符串，用于路径和文件名
+    product_id = str(product.source_id)
+    base_save_dir = Path(settings.PRODUCT_MEDIA_DOWNLOAD_ROOT) / product_id
+
+    unique_urls, summary = collect_product_image_urls(product)
+    summary.update({"downloaded": 0, "skipped": 0, "failed": 0})
+    if not unique_urls:
+        return str(base_save_dir), summary
+
+    workers = max(1, min(getattr(settings, "MEDIA_DOWNLOAD_WORKERS", 4), len(unique_urls)))
+
+    def fetch(indexed_url):
+        index, url = indexed_url
+        try:
+            path = media_cache_path(product_id, index, url)
+            return download_file(url, str(path.parent), path.name)
         except Exception as e:
-            # 打印下载失败信息
-            print(f"下载失败 URL: {url}, 错误: {e}")
-            # 继续下一个 URL
+            # 记录下载失败信息，继续下一个 URL
+            logger.warning(f"下载失败 URL: {url}, 错误: {e}")
+            return "failed"
+        finally:
+            # 限速令牌桶会在下载线程中打开数据库连接，线程不会自行关闭
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for outcome in executor.map(fetch, enumerate(unique_urls, start=1)):
+            summary[outcome] += 1
 
     return str(base_save_dir), summary
 
@@ -0,0 +1,113 @@
+# products/services/product_payload.py
+
+from django.conf import settings
+from django.core.cache import cache
+
+# 构造 payload 需要的关联数据：store 走 JOIN，图片和变体各一次 IN 查询
+PAYLOAD_PREFETCH = ("product_images", "product_variations")
+
+# iterator() 每批读取的产品数量 (prefetch 按批执行，查询次数与产品总数无关)
+PAYLOAD_CHUNK_SIZE = 2000
+
+
+# ============================================================
+# 通用工具函数：提取产品数据
+# ============================================================
+def extract_product_data(product):
+    """
+    构造标准化的产品数据字典。
+    关联数据通过 .all() 读取，配合 payload_queryset() 的预加载不会产生额外查询。
+    """
+
+    # 获取图片列表
+    images = [img.original_url for img in product.product_images.all() if img.original_url]
+
+    variations = [
+        {
+            "sku": v.sku,
+            "sku_sales_props": v.sku_sales_props,
+            "stock": v.stock,
+            "price": str(v.final_price) if v.final_price is not None else None,
+            "currency": v.currency,
+            "image": v.image_original_url,
+        }
+        for v in product.product_variations.all()
+    ]
+
+    return {
+        "id": product.source_id,
+        "title": product.title,
+        "category": product.category,
+        "url": product.url,
+        "price": str(product.final_price),
+        "store": product.store.name if product.store else None,
+        "description": product.description,  # 原始描述
+        "description_detail": product.desc_detail,  # 详细描述
+        "specifications": product.specifications,  # 规格参数
+        "images": images,  # 图片 URL 列表
+        "variations": variations,  # SKU 变体
+    }
+
+
+def payload_queryset(queryset):
+    """按主键排序，并预加载 payload 需要的关联数据 (不读取原始记录大字段)"""
+    return (
+        queryset.select_related("store")
+        .prefetch_related(*PAYLOAD_PREFETCH)
+        .defer("raw_json", "input")
+        .order_by("pk")
+    )
+
+
+def _cache_key(pk, updated_at):
+    # updated_at 变化后自动使用新 key，旧缓存随过期时间淘汰
+    stamp = updated_at.timestamp() if updated_at else 0
+    return f"product_payload:{pk}:{stamp}"
+
+
+def build_product_payloads(queryset, chunk_size=PAYLOAD_CHUNK_SIZE):
+    """
+    按主键顺序逐个生成 queryset 中产品的 payload，每批固定 3 次查询。
+
+    PRODUCT_PAYLOAD_CACHE_TIMEOUT > 0 时按 (pk, updated_at) 缓存 payload：
+    每批先只读取 pk/updated_at，只有缓存未命中的产品才加载关联数据。
+    """
+    timeout = getattr(settings, "PRODUCT_PAYLOAD_CACHE_TIMEOUT", 0)
+    if timeout <= 0:
+        for product in payload_queryset(queryset).iterator(chunk_size=chunk_size):
+            yield extract_product_data(product)
+        return
+
+    rows = queryset.order_by("pk").values_list("pk", "updated_at").iterator(chunk_size=chunk_size)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield from _cached_batch(queryset, batch, timeout)
+            batch = []
+    if batch:
+        yield from _cached_batch(queryset, batch, timeout)
+
+
+def _cached_batch(queryset, rows, timeout):
+    keys = {pk: _cache_key(pk, updated_at) for pk, updated_at in rows}
+    cached = cache.get_many(keys.values())
+
+    missing = [pk for pk, key in keys.items() if key not in cached]
+    if missing:
+        fresh = {}
+        for product in payload_queryset(queryset.model.objects.filter(pk__in=missing)):
+            # 用实际读取到的 updated_at 生成 key，避免两次读取之间产品被修改
+            fresh[_cache_key(product.pk, product.updated_at)] = extract_product_data(product)
+            keys[product.pk] = _cache_key(product.pk, product.updated_at)
+        cache.set_many(fresh, timeout)
+        cached.update(fresh)
+
+    for pk, _ in rows:
+        if keys[pk] in cached:
+            yield cached[keys[pk]]
+
+
+def build_product_payload(product):
+    """单个产品的 payload (n8n 分析、单个 JSON 导出)，同样使用缓存"""
+    return next(build_product_payloads(type(product).objects.filter(pk=product.pk)), None)
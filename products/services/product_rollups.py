@@ -0,0 +1,248 @@
+# products/services/product_rollups.py
+
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from products.models import Product, ProductRollup, Store
+from products.services.scrape_metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_DIMENSIONS = ("category", "store")
+
+# 每个维度对应的产品字段
+DIMENSION_FIELDS = {"category": "category", "store": "store_id"}
+
+ROLLUP_UPDATE_FIELDS = [
+    "label",
+    "product_count",
+    "sold_total",
+    "in_stock_count",
+    "price_min",
+    "price_p25",
+    "price_median",
+    "price_p75",
+    "price_p95",
+    "price_max",
+    "updated_at",
+]
+
+
+# ==========================================
+# 1. 计算并写入汇总
+# ==========================================
+
+
+def _aggregate(rows):
+    """rows 为 [(key, sold, price, in_stock)]，按 key 汇总"""
+    groups = {}
+    for key, sold, price, in_stock in rows:
+        group = groups.setdefault(key, {"count": 0, "sold": 0, "in_stock": 0, "prices": []})
+        group["count"] += 1
+        group["sold"] += sold or 0
+        group["in_stock"] += 1 if in_stock else 0
+        if price is not None:
+            group["prices"].append(price)
+    return groups
+
+
+def _rollup_rows(dimension, groups, day, labels):
+    now = timezone.now()
+    rollups = []
+    for key, group in groups.items():
+        prices = sorted(group["prices"])
+        rollups.append(
+            ProductRollup(
+                dimension=dimension,
+                key=key,
+                label=labels.get(key, key),
+                day=day,
+                product_count=group["count"],
+                sold_total=group["sold"],
+                in_stock_count=group["in_stock"],
+                price_min=prices[0] if prices else None,
+                price_p25=percentile(prices, 25),
+                price_median=percentile(prices, 50),
+                price_p75=percentile(prices, 75),
+                price_p95=percentile(prices, 95),
+                price_max=prices[-1] if prices else None,
+                updated_at=now,
+            )
+        )
+    return rollups
+
+
+def _labels(dimension, keys):
+    if dimension == "category":
+        return {"": "(未分类)"}
+    stores = Store.objects.filter(pk__in=[int(k) for k in keys if k])
+    labels = {
+        str(pk): name or store_id
+        for pk, name, store_id in stores.values_list("pk", "name", "store_id")
+    }
+    labels[""] = "(无店铺)"
+    return labels
+
+
+def _save(rollups):
+    # MySQL/MariaDB 的 ON DUPLICATE KEY UPDATE 不指定冲突列，传入 unique_fields 会抛出 NotSupportedError
+    unique_fields = (
+        ["dimension", "key", "day"]
+        if connection.features.supports_update_conflicts_with_target
+        else None
+    )
+    ProductRollup.objects.bulk_create(
+        rollups,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=unique_fields,
+        update_fields=ROLLUP_UPDATE_FIELDS,
+    )
+
+
+def refresh_rollups(categories=(), store_ids=(), day=None):
+    """
+    增量更新：只重算受影响的分类和店铺当天的汇总 (每个维度一次按索引过滤的查询)。
+    导入时产品换了分类/店铺，旧分类的汇总由每天的全量重算修正。返回写入的汇总行数。
+    """
+    day = day or timezone.localdate()
+    if not ProductRollup.objects.filter(day=day).exists():
+        # 当天第一次更新：先全量生成，仪表盘按天读取时不会缺少未受影响的分类/店铺
+        return rebuild_rollups(day)
+
+    targets = {
+        "category": {c or "" for c in categories},
+        "store": {str(s) if s else "" for s in store_ids},
+    }
+
+    rollups = []
+    for dimension, keys in targets.items():
+        if not keys:
+            continue
+        field = DIMENSION_FIELDS[dimension]
+        values = [int(k) if dimension == "store" else k for k in keys if k]
+        condition = Q(**{f"{field}__in": values})
+        if "" in keys:
+            condition |= Q(**{f"{field}__isnull": True})
+            if dimension == "category":
+                condition |= Q(category="")
+
+        rows = (
+            (str(key) if key else "", sold, price, in_stock)
+            for key, sold, price, in_stock in Product.objects.filter(condition)
+            .values_list(field, "sold", "final_price", "In_stock")
+            .iterator(chunk_size=2000)
+        )
+        groups = _aggregate(rows)
+        # 该分类/店铺已没有产品时写入 0，避免保留过时的统计
+        for key in keys:
+            groups.setdefault(key, {"count": 0, "sold": 0, "in_stock": 0, "prices": []})
+        rollups += _rollup_rows(dimension, groups, day, _labels(dimension, groups))
+
+    if rollups:
+        _save(rollups)
+    return len(rollups)
+
+
+def rebuild_rollups(day=None):
+    """定时任务 (每天)：一次遍历全部产品，重算当天所有分类和店铺的汇总。返回写入的汇总行数。"""
+    day = day or timezone.localdate()
+    started = timezone.now()
+    category_rows, store_rows = [], []
+    for category, store_id, sold, price, in_stock in Product.objects.values_list(
+        "category", "store_id", "sold", "final_price", "In_stock"
+    ).iterator(chunk_size=2000):
+        category_rows.append((category or "", sold, price, in_stock))
+        store_rows.append((str(store_id) if store_id else "", sold, price, in_stock))
+
+    rollups = []
+    for dimension, rows in (("category", category_rows), ("store", store_rows)):
+        groups = _aggregate(rows)
+        rollups += _rollup_rows(dimension, groups, day, _labels(dimension, groups))
+
+    if rollups:
+        _save(rollups)
+    # 当天已经没有产品的分类/店铺
+    ProductRollup.objects.filter(day=day, updated_at__lt=started).delete()
+    logger.info(f"重算产品汇总 {day}：{len(rollups)} 行")
+    return len(rollups)
+
+
+# ==========================================
+# 2. 仪表盘数据 (缓存)
+# ==========================================
+
+
+def _serialize(rollup):
+    def num(value):
+        return float(value) if isinstance(value, Decimal) else value
+
+    return {
+        "key": rollup.key,
+        "label": rollup.label,
+        "product_count": rollup.product_count,
+        "sold_total": rollup.sold_total,
+        "in_stock_ratio": rollup.in_stock_ratio,
+        "price": {
+            "min": num(rollup.price_min),
+            "p25": num(rollup.price_p25),
+            "median": num(rollup.price_median),
+            "p75": num(rollup.price_p75),
+            "p95": num(rollup.price_p95),
+            "max": num(rollup.price_max),
+        },
+    }
+
+
+def analytics_summary(dimension="category", day=None, limit=50):
+    """
+    某个维度某一天 (默认最近一天) 的汇总，按销量降序，只读取汇总表。
+    结果缓存 PRODUCT_ANALYTICS_CACHE_SECONDS 秒，汇总表更新后自动失效。
+    """
+    if dimension not in ROLLUP_DIMENSIONS:
+        raise ValueError(f"未知的汇总维度: {dimension}")
+
+    rollups = ProductRollup.objects.filter(dimension=dimension)
+    if day is None:
+        day = rollups.order_by("-day").values_list("day", flat=True).first()
+
+    # 缓存 key 包含当天汇总行的最新 updated_at，汇总更新 (qcluster 中的导入、重算) 后 key 随之变化。
+    # 版本从数据库读取 (走 dimension, day 索引)：CACHES 是每个进程独立的 LocMemCache，
+    # 在缓存中递增版本号无法通知其他 worker 进程
+    version = (
+        rollups.filter(day=day).aggregate(version=Max("updated_at"))["version"] if day else None
+    )
+    cache_key = (
+        f"product_analytics:{dimension}:{day}:{version.timestamp() if version else 0}:{limit}"
+    )
+    timeout = getattr(settings, "PRODUCT_ANALYTICS_CACHE_SECONDS", 300)
+    if timeout > 0:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    rows = (
+        list(rollups.filter(day=day, product_count__gt=0).order_by("-sold_total", "key"))
+        if day
+        else []
+    )
+
+    summary = {
+        "dimension": dimension,
+        "day": day.isoformat() if day else None,
+        "totals": {
+            "groups": len(rows),
+            "product_count": sum(r.product_count for r in rows),
+            "sold_total": sum(r.sold_total for r in rows),
+        },
+        "rows": [_serialize(r) for r in rows[:limit]],
+    }
+    if timeout > 0:
+        cache.set(cache_key, summary, timeout)
+    return summary
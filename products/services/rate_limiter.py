@@ -0,0 +1,153 @@
+# products/services/rate_limiter.py
+
+import logging
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from products.models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+# 各外部服务每个主机的默认限速：rate 为每秒补充的令牌数，burst 为桶容量。
+# block 大于 1 时一次从令牌桶取 block 个令牌，在进程内逐个发放 (高频请求不必每次锁定同一行)；
+# 进程内预留的令牌最多让每个进程多发出 block 个请求。
+# 可用 settings.HTTP_RATE_LIMITS 按服务覆盖，rate 为 0 表示不限速
+RATE_LIMIT_DEFAULTS = {
+    "bright_data": {"rate": 2, "burst": 5},
+    "zipline": {"rate": 5, "burst": 10},
+    "n8n": {"rate": 1, "burst": 3},
+    "tiktok_cdn": {"rate": 20, "burst": 40, "block": 10},
+}
+
+# 阻塞等待时每次最多休眠的秒数 (等待期间其他进程可能先取走令牌，醒来后重新计算)
+MAX_SLEEP_SECONDS = 5
+
+
+class RateLimitTimeout(requests.exceptions.RequestException):
+    """等待令牌超过最长时间，请求没有发出 (继承 RequestException，调用方按网络错误处理)"""
+
+
+def rate_limit(service):
+    """服务的限速配置 {"rate", "burst", "block"}；未配置或 rate 为 0 时返回 None"""
+    config = {
+        **RATE_LIMIT_DEFAULTS.get(service, {}),
+        **getattr(settings, "HTTP_RATE_LIMITS", {}).get(service, {}),
+    }
+    if not config.get("rate"):
+        return None
+    burst = float(config.get("burst") or config["rate"])
+    return {
+        "rate": float(config["rate"]),
+        "burst": burst,
+        "block": max(1.0, min(float(config.get("block") or 1), burst)),
+    }
+
+
+def bucket_key(service, host=""):
+    return f"{service}:{host}" if host else service
+
+
+# 进程内预留的令牌 {桶: 剩余数量}；fork 出来的 worker 进程 pid 变化时清空，不沿用父进程的预留
+_reserved = {}
+_reserved_pid = None
+_reserved_lock = threading.Lock()
+
+
+def _take_reserved(key, tokens):
+    global _reserved_pid
+    with _reserved_lock:
+        if _reserved_pid != os.getpid():
+            _reserved.clear()
+            _reserved_pid = os.getpid()
+        if _reserved.get(key, 0) >= tokens:
+            _reserved[key] -= tokens
+            return True
+    return False
+
+
+def _reserve(key, tokens):
+    with _reserved_lock:
+        _reserved[key] = _reserved.get(key, 0) + tokens
+
+
+def reset_reserved():
+    """清空进程内预留的令牌 (测试中使用)"""
+    with _reserved_lock:
+        _reserved.clear()
+
+
+def _take(key, rate, burst, tokens):
+    """
+    在一个事务中锁定令牌桶、补充令牌并尝试取出 tokens 个。
+    返回 0 表示已取到，否则返回还需要等待的秒数。
+
+    durable：在调用方的事务中调用时抛出 RuntimeError，而不是变成 savepoint
+    (行锁会一直持有到外层事务提交，各进程排队在同一行上，多个桶加锁顺序不同时还可能死锁)。
+    """
+    now = time.time()
+    with transaction.atomic(durable=True):
+        RateLimitBucket.objects.bulk_create(
+            [RateLimitBucket(key=key, tokens=burst, refilled_at=now)], ignore_conflicts=True
+        )
+        bucket = RateLimitBucket.objects.select_for_update().get(key=key)
+        available = min(burst, bucket.tokens + max(now - bucket.refilled_at, 0) * rate)
+        wait = 0.0
+        if available >= tokens:
+            available -= tokens
+        else:
+            wait = (tokens - available) / rate
+        RateLimitBucket.objects.filter(pk=bucket.pk).update(tokens=available, refilled_at=now)
+    return wait
+
+
+def try_acquire(service, host="", tokens=1):
+    """
+    非阻塞：立即尝试取 tokens 个令牌，返回 (是否取到, 还需等待的秒数)。
+    服务未配置限速时总是取到；数据库异常时放行并记录警告，不阻塞外部请求。
+    不要在 transaction.atomic() 中发起外部请求：此时不读写令牌桶，放行并记录警告。
+    配置了 block 的服务先使用进程内预留的令牌，用完后再从令牌桶一次取 block 个。
+    """
+    limit = rate_limit(service)
+    if limit is None:
+        return True, 0.0
+    tokens = min(tokens, limit["burst"])
+    key = bucket_key(service, host)
+    if _take_reserved(key, tokens):
+        return True, 0.0
+    take = max(tokens, limit["block"])
+    try:
+        wait = _take(key, limit["rate"], limit["burst"], take)
+    except RuntimeError:
+        # durable 事务嵌套在调用方的事务中 (见 _take)，尚未执行任何查询
+        logger.warning(f"在数据库事务中请求 {bucket_key(service, host)}，本次不限速")
+        return True, 0.0
+    except DatabaseError as e:
+        # _take 的事务是最外层事务，异常时已完整回滚，连接可以继续使用
+        logger.warning(f"限速令牌桶 {bucket_key(service, host)} 读写失败，本次不限速: {e}")
+        return True, 0.0
+    if wait == 0 and take > tokens:
+        _reserve(key, take - tokens)
+    return wait == 0, wait
+
+
+def acquire(service, host="", tokens=1, timeout=None):
+    """
+    阻塞：等到取得 tokens 个令牌，返回等待的秒数。
+    timeout 为最长等待时间 (默认 HTTP_RATE_LIMIT_MAX_WAIT)，预计超过时抛出 RateLimitTimeout。
+    """
+    if timeout is None:
+        timeout = getattr(settings, "HTTP_RATE_LIMIT_MAX_WAIT", 60)
+    started = time.monotonic()
+    while True:
+        acquired, wait = try_acquire(service, host, tokens)
+        waited = time.monotonic() - started
+        if acquired:
+            return waited
+        if waited + wait > timeout:
+            raise RateLimitTimeout(f"{bucket_key(service, host)} 限速，等待令牌超过 {timeout} 秒")
+        time.sleep(min(wait, MAX_SLEEP_SECONDS))
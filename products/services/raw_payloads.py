@@ -0,0 +1,105 @@
+# products/services/raw_payloads.py
+
+import hashlib
+import json
+import logging
+import zlib
+
+from products.models import Product, ProductRawPayload
+
+logger = logging.getLogger(__name__)
+
+# 压缩级别：6 在压缩率和 CPU 之间折中
+COMPRESS_LEVEL = 6
+
+# 回填时每批处理的产品数量
+BACKFILL_CHUNK_SIZE = 500
+
+
+def pack_payload(data):
+    """返回 (sha256, 压缩后的字节, 压缩前字节数)；键排序后计算哈希，内容相同的记录得到相同哈希"""
+    raw = json.dumps(
+        data, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str
+    ).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest(), zlib.compress(raw, COMPRESS_LEVEL), len(raw)
+
+
+def store_raw_payloads(payloads):
+    """
+    批量保存原始记录，已存在的内容不重复写入。
+    payloads 为 {key: data}，返回 {key: ProductRawPayload 主键}。
+    """
+    packed = {key: pack_payload(data) for key, data in payloads.items() if data is not None}
+    if not packed:
+        return {}
+
+    rows = {}
+    for sha256, data, size in packed.values():
+        rows.setdefault(sha256, ProductRawPayload(sha256=sha256, data=data, size=size))
+    ProductRawPayload.objects.bulk_create(rows.values(), batch_size=200, ignore_conflicts=True)
+
+    ids = dict(ProductRawPayload.objects.filter(sha256__in=list(rows)).values_list("sha256", "pk"))
+    return {key: ids[sha256] for key, (sha256, _, _) in packed.items() if sha256 in ids}
+
+
+def backfill_raw_payloads(chunk_size=BACKFILL_CHUNK_SIZE, limit=None):
+    """
+    把 products.raw_json / input 中的旧数据移到 product_raw_payloads，并清空原列。
+    按主键分批处理，每批：读取一次、写入压缩记录、一次批量更新。返回处理的产品数量。
+    """
+    pending = Product.objects.filter(raw_json__isnull=False) | Product.objects.filter(
+        input__isnull=False
+    )
+    done = 0
+    last_pk = 0
+    while limit is None or done < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - done)
+        rows = list(
+            pending.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", "raw_json", "input", "raw_payload_id")[:size]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        payloads = {}
+        for pk, raw_json, input_data, _ in rows:
+            data = raw_json if raw_json is not None else {}
+            if input_data is not None and isinstance(data, dict) and "input" not in data:
+                # input 合并到原始记录中，get_input() 从中读取
+                data = {**data, "input": input_data}
+            payloads[pk] = data
+        payload_ids = store_raw_payloads(payloads)
+
+        Product.objects.bulk_update(
+            [
+                Product(
+                    pk=pk, raw_payload_id=payload_ids.get(pk, old_id), raw_json=None, input=None
+                )
+                for pk, _, _, old_id in rows
+            ],
+            ["raw_payload", "raw_json", "input"],
+        )
+        done += len(rows)
+        logger.info(f"原始数据回填：已处理 {done} 个产品")
+    return done
+
+
+def delete_replaced_payloads(payload_ids):
+    """
+    产品重新导入后，被替换的旧原始记录如果已没有产品引用则删除 (内容相同的记录可能被其他产品共用)。
+    返回删除数量。
+    """
+    if not payload_ids:
+        return 0
+    used = Product.objects.filter(raw_payload_id__in=payload_ids).values("raw_payload_id")
+    deleted, _ = ProductRawPayload.objects.filter(pk__in=payload_ids).exclude(pk__in=used).delete()
+    return deleted
+
+
+def purge_orphan_payloads():
+    """删除已没有产品引用的原始记录 (产品重新导入后旧记录不再被引用)。返回删除数量。"""
+    used = Product.objects.filter(raw_payload__isnull=False).values("raw_payload_id")
+    deleted, _ = ProductRawPayload.objects.exclude(pk__in=used).delete()
+    return deleted
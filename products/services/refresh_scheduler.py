@@ -0,0 +1,133 @@
+# products/services/refresh_scheduler.py
+
+import heapq
+import logging
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.models import Product, ScrapeRequest
+from products.services.scrape_requests import (
+    active_inputs,
+    normalize_input,
+    queued_requests,
+    submit_scrape_requests,
+)
+
+logger = logging.getLogger(__name__)
+
+# 定期刷新提交的采集请求使用的 requested_by，用于统计每日预算
+REFRESH_REQUESTER = "refresh_scheduler"
+
+# 定时任务间隔 (分钟)，与 PRODUCT_SCHEDULES 中的配置一致
+REFRESH_INTERVAL_MINUTES = 60
+
+# 刷新优先级各项权重
+AGE_WEIGHT = 1.0  # 每经过一个 PRODUCT_REFRESH_MIN_AGE_HOURS
+VELOCITY_WEIGHT = 1.0  # log(1 + 日均销量增长)
+VOLATILITY_WEIGHT = 10.0  # 价格波动 10% 约等于 1 分
+AGE_SCORE_CAP = 10.0  # 长期未刷新的产品不会无限压过其他因素
+
+SCORE_FIELDS = ("pk", "url", "tags", "sold_velocity", "price_volatility", "scraped_at")
+
+
+def tag_weights():
+    """PRODUCT_REFRESH_TAG_WEIGHTS：{"candidate": 3.0, ...}"""
+    return getattr(settings, "PRODUCT_REFRESH_TAG_WEIGHTS", {"candidate": 3.0})
+
+
+def refresh_score(row, now, min_age_hours, weights):
+    """
+    产品的刷新优先级：距上次采集的时间、销量增长速度、价格波动和标签加权之和。
+    row 为 SCORE_FIELDS 对应的字典。
+    """
+    score = 0.0
+    if row["scraped_at"]:
+        age_hours = (now - row["scraped_at"]).total_seconds() / 3600
+        score += AGE_WEIGHT * min(age_hours / max(min_age_hours, 1), AGE_SCORE_CAP)
+    else:
+        score += AGE_WEIGHT * AGE_SCORE_CAP
+    score += VELOCITY_WEIGHT * math.log1p(max(row["sold_velocity"] or 0, 0))
+    score += VOLATILITY_WEIGHT * (row["price_volatility"] or 0)
+    score += sum(weights.get(tag, 0) for tag in row["tags"] or [])
+    return score
+
+
+def refreshed_today(now=None):
+    """今天 (本地时区) 已提交的刷新输入数量，被跳过的不计入预算"""
+    now = now or timezone.now()
+    start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (
+        ScrapeRequest.objects.filter(requested_by=REFRESH_REQUESTER, created_at__gte=start)
+        .exclude(status="skipped")
+        .count()
+    )
+
+
+def run_quota(daily_budget, used, interval_minutes=REFRESH_INTERVAL_MINUTES):
+    """本次运行可提交的数量：每日预算按运行次数平均分配，不超过剩余预算"""
+    remaining = max(daily_budget - used, 0)
+    per_run = math.ceil(daily_budget * interval_minutes / 1440)
+    return min(per_run, remaining)
+
+
+def pick_refresh_candidates(limit, now=None):
+    """
+    选出最需要刷新的 limit 个产品 (返回 [(score, pk, url)]，按分数从高到低)。
+    只读取计算分数需要的列，用大小为 limit 的堆选择，内存与产品总数无关。
+    已在队列中或正在采集中的产品不会被重复选中。
+    """
+    if limit <= 0:
+        return []
+    now = now or timezone.now()
+    min_age_hours = getattr(settings, "PRODUCT_REFRESH_MIN_AGE_HOURS", 24)
+    weights = tag_weights()
+
+    busy = active_inputs("url") | set(
+        queued_requests().filter(collection_mode="url").values_list("input", flat=True)
+    )
+
+    rows = (
+        Product.objects.filter(available=True)
+        .exclude(Q(url__isnull=True) | Q(url=""))
+        .annotate(scraped_at=Coalesce("last_scraped_at", "updated_at", "created_at"))
+        .filter(Q(scraped_at__isnull=True) | Q(scraped_at__lt=now - timedelta(hours=min_age_hours)))
+        .values(*SCORE_FIELDS)
+        .iterator(chunk_size=2000)
+    )
+    scored = (
+        (refresh_score(row, now, min_age_hours, weights), row["pk"], row["url"])
+        for row in rows
+        if normalize_input(row["url"], "url") not in busy
+    )
+    return heapq.nlargest(limit, scored)
+
+
+def schedule_refresh():
+    """
+    定时任务 (每小时)：在 PRODUCT_REFRESH_DAILY_BUDGET 的每日预算内，
+    把优先级最高的产品提交到采集队列，由 scrape_request_flush 合并后
+    通过 trigger_bright_data_task 触发。返回本次入队的数量。
+    """
+    daily_budget = getattr(settings, "PRODUCT_REFRESH_DAILY_BUDGET", 0)
+    if daily_budget <= 0:
+        return 0
+
+    now = timezone.now()
+    quota = run_quota(daily_budget, refreshed_today(now))
+    candidates = pick_refresh_candidates(quota, now)
+    if not candidates:
+        return 0
+
+    # 是否需要刷新由优先级决定，跳过新鲜度检查
+    queued, skipped = submit_scrape_requests(
+        [url for _, _, url in candidates], "url", requested_by=REFRESH_REQUESTER, force=True
+    )
+    logger.info(
+        f"定期刷新：入队 {queued} 个产品 (本次配额 {quota}，每日预算 {daily_budget})，跳过 {skipped}"
+    )
+    return queued
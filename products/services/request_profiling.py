@@ -0,0 +1,104 @@
+# products/services/request_profiling.py
+
+import logging
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from products.models import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+# 预算字段 -> RequestProfile 字段
+BUDGET_FIELDS = {
+    "ms": "duration_ms",
+    "queries": "query_count",
+    "query_ms": "query_ms",
+    "duplicates": "duplicate_queries",
+}
+
+# 每写入多少条检查一次是否超过 REQUEST_PROFILE_MAX_ROWS
+TRIM_EVERY = 100
+
+
+class QueryRecorder:
+    """connection.execute_wrapper：记录请求中每条查询的 SQL、参数和耗时"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, repr(params), time.perf_counter() - started))
+
+    def summary(self):
+        """查询数、总耗时 (毫秒)、完全相同的重复查询数，以及重复最多的 SQL 模板和次数"""
+        identical = Counter((sql, params) for sql, params, _ in self.queries)
+        templates = Counter(sql for sql, _, _ in self.queries)
+        top_sql, top_count = templates.most_common(1)[0] if templates else ("", 0)
+        return {
+            "query_count": len(self.queries),
+            "query_ms": round(sum(seconds for _, _, seconds in self.queries) * 1000, 3),
+            "duplicate_queries": sum(count - 1 for count in identical.values()),
+            "top_repeated_sql": top_sql if top_count > 1 else "",
+            "top_repeated_count": top_count if top_count > 1 else 0,
+        }
+
+
+def view_budget(view):
+    """视图的预算：REQUEST_PROFILE_BUDGETS["*"] 为默认值，按视图名称 (URL 名称) 覆盖"""
+    budgets = getattr(settings, "REQUEST_PROFILE_BUDGETS", {})
+    return {**budgets.get("*", {}), **budgets.get(view, {})}
+
+
+def exceeded_budget(view, profile):
+    """返回超出预算的项目，如 ["ms", "queries"]"""
+    return [
+        key
+        for key, limit in view_budget(view).items()
+        if key in BUDGET_FIELDS and limit is not None and profile[BUDGET_FIELDS[key]] > limit
+    ]
+
+
+def record_request(view, method, path, status_code, duration_ms, recorder, response_bytes=None):
+    """
+    检查预算 (超出时记录警告)，按 REQUEST_PROFILE_SAMPLE_RATE 抽样保存；超出预算的请求总是保存。
+    返回保存的 RequestProfile，未保存时返回 None。
+    """
+    profile = {
+        "view": view[:255],
+        "method": method[:10],
+        "path": path[:500],
+        "status_code": status_code,
+        "duration_ms": round(duration_ms, 3),
+        "response_bytes": response_bytes,
+        **recorder.summary(),
+    }
+    over_budget = exceeded_budget(view, profile)
+    if over_budget:
+        logger.warning(
+            f"请求超出预算 {', '.join(over_budget)}: {method} {path} (视图 {view}) "
+            f"耗时 {profile['duration_ms']:.0f}ms，查询 {profile['query_count']} 次 / {profile['query_ms']:.0f}ms，"
+            f"重复查询 {profile['duplicate_queries']} 次"
+        )
+    elif random.random() >= getattr(settings, "REQUEST_PROFILE_SAMPLE_RATE", 0.1):
+        return None
+
+    saved = RequestProfile.objects.create(over_budget=over_budget, **profile)
+    if saved.pk % TRIM_EVERY == 0:
+        trim_profiles(saved.pk)
+    return saved
+
+
+def trim_profiles(latest_pk=None):
+    """只保留最近 REQUEST_PROFILE_MAX_ROWS 条采样 (按主键)，返回删除数量"""
+    max_rows = getattr(settings, "REQUEST_PROFILE_MAX_ROWS", 5000)
+    if latest_pk is None:
+        latest_pk = RequestProfile.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+    deleted, _ = RequestProfile.objects.filter(pk__lte=latest_pk - max_rows).delete()
+    return deleted
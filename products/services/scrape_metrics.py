@@ -0,0 +1,78 @@
+# products/services/scrape_metrics.py
+
+import math
+import statistics
+from datetime import timedelta
+
+from django.utils import timezone
+
+from products.models import ScrapeJob
+
+# (指标名称, 起始时间字段, 结束时间字段)
+LATENCY_STAGES = [
+    ("to_ready", "triggered_at", "ready_at"),
+    ("to_download", "ready_at", "downloaded_at"),
+    ("to_import", "downloaded_at", "imported_at"),
+    ("total", "triggered_at", "imported_at"),
+]
+
+
+def percentile(values, pct):
+    """最近秩法百分位数 (values 必须已排序)"""
+    if not values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {"median": None, "p95": None}
+    return {"median": round(statistics.median(values), 1), "p95": round(percentile(values, 95), 1)}
+
+
+def scrape_latency_stats(days=7):
+    """
+    按采集模式汇总最近 days 天的采集任务：数量、成功/失败数，
+    以及各阶段耗时 (秒) 的中位数和 p95。只读取一次时间戳列。
+    """
+    since = timezone.now() - timedelta(days=days)
+    fields = {field for _, start, end in LATENCY_STAGES for field in (start, end)}
+    rows = ScrapeJob.objects.filter(triggered_at__gte=since).values(
+        "collection_mode", "status", *sorted(fields)
+    )
+
+    modes = {}
+    for row in rows:
+        mode = modes.setdefault(
+            row["collection_mode"] or "-",
+            {
+                "jobs": 0,
+                "imported": 0,
+                "failed": 0,
+                "samples": {name: [] for name, _, _ in LATENCY_STAGES},
+            },
+        )
+        mode["jobs"] += 1
+        if row["status"] == "imported":
+            mode["imported"] += 1
+        elif row["status"] in ("failed", "expired"):
+            mode["failed"] += 1
+
+        for name, start, end in LATENCY_STAGES:
+            if row[start] and row[end]:
+                mode["samples"][name].append((row[end] - row[start]).total_seconds())
+
+    stats = []
+    for mode_name in sorted(modes):
+        mode = modes[mode_name]
+        samples = mode.pop("samples")
+        stats.append(
+            {
+                "collection_mode": mode_name,
+                **mode,
+                **{name: _summary(values) for name, values in samples.items()},
+            }
+        )
+    return stats
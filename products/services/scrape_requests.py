@@ -0,0 +1,242 @@
+# products/services/scrape_requests.py
+
+import logging
+import re
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from products.models import Product, ScrapeJob, ScrapeRequest
+from products.scheduler import ensure_product_schedule
+from products.tasks import trigger_bright_data_task
+
+logger = logging.getLogger(__name__)
+
+# TikTok 商品链接中的商品 ID (与 Product.source_id 一致)
+PRODUCT_ID_RE = re.compile(r"/(\d{10,})(?:/|$)")
+
+# 分类链接中保留的查询参数以外，这些前缀的参数只用于追踪
+TRACKING_PARAM_PREFIXES = ("utm_", "_", "share_", "sec_", "source", "enter_from")
+
+SKIP_REASONS = {
+    "duplicate": "本次提交中重复",
+    "queued": "已在等待提交的队列中",
+    "in_flight": "正在采集中",
+    "recent": "最近已采集",
+    "fresh": "产品数据仍在有效期内",
+}
+
+
+# ==========================================
+# 1. 输入规范化
+# ==========================================
+
+
+def normalize_input(value, collection_mode):
+    """
+    规范化采集输入，使同一目标的不同写法可以去重：
+    - 关键词：小写并合并空白
+    - URL：统一 https、小写域名、去掉片段和末尾斜杠；
+      商品/店铺链接去掉全部查询参数，分类链接只去掉追踪参数
+    """
+    value = value.strip()
+    if collection_mode == "keyword":
+        return " ".join(value.lower().split())
+
+    parsed = urlsplit(value if "://" in value else f"https://{value}")
+    path = parsed.path.rstrip("/") or "/"
+
+    query = ""
+    if collection_mode == "category":
+        params = [
+            (k, v)
+            for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+            if not k.lower().startswith(TRACKING_PARAM_PREFIXES)
+        ]
+        query = urlencode(sorted(params))
+
+    return urlunsplit(("https", parsed.netloc.lower(), path, query, ""))
+
+
+def extract_product_id(url):
+    match = PRODUCT_ID_RE.search(urlsplit(url).path)
+    return match.group(1) if match else None
+
+
+# ==========================================
+# 2. 提交：去重后进入待提交队列
+# ==========================================
+
+
+def active_inputs(collection_mode):
+    """正在采集中的 snapshot 已覆盖的输入"""
+    covered = set()
+    jobs = ScrapeJob.objects.filter(
+        collection_mode=collection_mode, status__in=ScrapeJob.ACTIVE_STATUSES
+    ).values_list("inputs", flat=True)
+    for inputs in jobs:
+        covered.update(normalize_input(i, collection_mode) for i in inputs or [])
+    return covered
+
+
+def queued_requests():
+    """
+    队列中尚未关联 snapshot 的请求：等待提交的，以及已被 flush 认领但还没有 job 的
+    (租约过期后会由 flush_scrape_requests 退回 pending)。
+    """
+    return ScrapeRequest.objects.filter(
+        Q(status="pending") | Q(status__in=("claimed", "submitted"), job__isnull=True)
+    )
+
+
+def _recent_inputs(collection_mode, cutoff):
+    """TTL 内已成功导入的输入"""
+    covered = set()
+    jobs = ScrapeJob.objects.filter(
+        collection_mode=collection_mode, status="imported", triggered_at__gte=cutoff
+    ).values_list("inputs", flat=True)
+    for inputs in jobs:
+        covered.update(normalize_input(i, collection_mode) for i in inputs or [])
+    return covered
+
+
+def _fresh_product_inputs(inputs, cutoff):
+    """
+    URL 模式：对应产品在 TTL 内采集过的输入。
+    按 last_scraped_at 判断：批量操作、AI 回调、admin 编辑也会更新 updated_at，不代表重新采集过。
+    """
+    ids = {url: extract_product_id(url) for url in inputs}
+    fresh = Product.objects.filter(last_scraped_at__gte=cutoff).filter(
+        Q(source_id__in=[i for i in ids.values() if i]) | Q(url__in=list(inputs))
+    )
+    fresh_ids, fresh_urls = set(), set()
+    for source_id, url in fresh.values_list("source_id", "url"):
+        fresh_ids.add(source_id)
+        if url:
+            fresh_urls.add(normalize_input(url, "url"))
+    return {url for url, pid in ids.items() if url in fresh_urls or (pid and pid in fresh_ids)}
+
+
+def submit_scrape_requests(raw_inputs, collection_mode, requested_by="", force=False):
+    """
+    规范化并去重采集输入，未被覆盖的输入进入待提交队列，由 flush_scrape_requests 合并提交。
+    以下输入会被跳过：本次重复、已在队列中、正在采集中；
+    force=False 时还会跳过 SCRAPE_FRESHNESS_TTL_HOURS 内已采集的输入和已采集的产品。
+    返回 (queued_count, {skip_reason: count})。
+    """
+    ttl_hours = getattr(settings, "SCRAPE_FRESHNESS_TTL_HOURS", 6)
+    cutoff = timezone.now() - timedelta(hours=ttl_hours)
+
+    normalized = [normalize_input(i, collection_mode) for i in raw_inputs if i.strip()]
+    unique = list(dict.fromkeys(normalized))
+
+    queued_inputs = set(
+        queued_requests()
+        .filter(collection_mode=collection_mode, input__in=unique)
+        .values_list("input", flat=True)
+    )
+    in_flight = active_inputs(collection_mode)
+    recent, fresh = set(), set()
+    if not force and ttl_hours > 0:
+        recent = _recent_inputs(collection_mode, cutoff)
+        if collection_mode == "url":
+            fresh = _fresh_product_inputs(unique, cutoff)
+
+    requests_to_create = []
+    skipped = Counter()
+    seen = set()
+    for value in normalized:
+        if value in seen:
+            reason = "duplicate"
+        elif value in queued_inputs:
+            reason = "queued"
+        elif value in in_flight:
+            reason = "in_flight"
+        elif value in recent:
+            reason = "recent"
+        elif value in fresh:
+            reason = "fresh"
+        else:
+            reason = ""
+        seen.add(value)
+
+        if reason:
+            skipped[reason] += 1
+            if reason == "duplicate":
+                continue
+        requests_to_create.append(
+            ScrapeRequest(
+                collection_mode=collection_mode,
+                input=value,
+                requested_by=requested_by or "",
+                status="skipped" if reason else "pending",
+                skip_reason=reason,
+            )
+        )
+
+    ScrapeRequest.objects.bulk_create(requests_to_create)
+    queued = sum(1 for r in requests_to_create if r.status == "pending")
+    if queued:
+        ensure_product_schedule("scrape_request_flush")
+
+    logger.info(f"采集提交 ({collection_mode})：入队 {queued} 个，跳过 {dict(skipped)}")
+    return queued, dict(skipped)
+
+
+# ==========================================
+# 3. 合并提交 (定时任务)
+# ==========================================
+
+
+def flush_scrape_requests():
+    """
+    定时任务 (每分钟)：把等待提交的输入按采集模式合并，
+    每次 trigger 最多 BRIGHT_DATA_MAX_INPUTS_PER_TRIGGER 个输入。返回 trigger 次数。
+
+    请求先被认领为 claimed，trigger 完成后由 _link_scrape_requests 关联 job 并标记为
+    submitted / failed。认领后超过 SCRAPE_REQUEST_CLAIM_LEASE_MINUTES 仍没有 job 的请求
+    (worker 在 trigger 前后崩溃) 在下一次 flush 时退回 pending 重新提交。
+    """
+    limit = max(1, getattr(settings, "BRIGHT_DATA_MAX_INPUTS_PER_TRIGGER", 500))
+    lease = timedelta(minutes=getattr(settings, "SCRAPE_REQUEST_CLAIM_LEASE_MINUTES", 10))
+    now = timezone.now()
+
+    with transaction.atomic():
+        released = ScrapeRequest.objects.filter(
+            status__in=("claimed", "submitted"), job__isnull=True, submitted_at__lt=now - lease
+        ).update(status="pending", submitted_at=None)
+        if released:
+            logger.warning(f"{released} 个采集请求认领后超时未关联 snapshot，退回队列重新提交")
+
+        pending = list(
+            ScrapeRequest.objects.select_for_update()
+            .filter(status="pending")
+            .order_by("id")
+            .values_list("pk", "collection_mode", "input")
+        )
+        ScrapeRequest.objects.filter(pk__in=[pk for pk, _, _ in pending]).update(
+            status="claimed", submitted_at=now
+        )
+
+    by_mode = {}
+    for pk, mode, value in pending:
+        # 不同 operator 在同一窗口内提交的相同输入只发送一次
+        by_mode.setdefault(mode, {}).setdefault(value, []).append(pk)
+
+    triggers = 0
+    for mode, inputs in by_mode.items():
+        values = list(inputs)
+        for i in range(0, len(values), limit):
+            chunk = values[i : i + limit]
+            request_ids = [pk for value in chunk for pk in inputs[value]]
+            trigger_bright_data_task(chunk, mode, request_ids=request_ids)
+            triggers += 1
+
+    if pending:
+        logger.info(f"合并提交 {len(pending)} 个采集输入，共 {triggers} 次 trigger")
+    return triggers
@@ -0,0 +1,215 @@
+# products/services/snapshot_archive.py
+
+import gzip
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from products.models import SnapshotRecord, SnapshotSegment
+from products.services.product_importer import import_products_from_list
+
+logger = logging.getLogger(__name__)
+
+# 每个 gzip 块包含的记录数：越小随机读取越快，越大压缩率越高
+BLOCK_RECORDS = 64
+
+# 回放时每批导入的产品数量
+REPLAY_BATCH_SIZE = 200
+
+
+def archive_root():
+    return getattr(
+        settings, "SNAPSHOT_ARCHIVE_ROOT", os.path.join(settings.BASE_DIR, "data", "archive")
+    )
+
+
+def segment_path(segment):
+    return os.path.join(archive_root(), segment.name)
+
+
+# ==========================================
+# 1. 写入归档
+# ==========================================
+
+
+def write_segment(snapshot_id, records, block_records=BLOCK_RECORDS):
+    """
+    把一个 snapshot 的记录写成 gzip 压缩的 NDJSON 文件，并为每条记录建立索引。
+    每 block_records 条记录压缩成一个独立的 gzip 块 (整个文件仍可用 gzip/zcat 直接读取)。
+    同一个 snapshot 重复写入时替换旧文件和索引，保留原来的归档时间
+    (latest_entries 按归档时间判断最新记录，重写旧 snapshot 不能让它变成最新)。返回 SnapshotSegment。
+    """
+    name = f"{timezone.now():%Y/%m}/snapshot_{snapshot_id}.ndjson.gz"
+    path = os.path.join(archive_root(), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    entries = []
+    offset = 0
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "wb") as f:
+        for start in range(0, len(records), block_records):
+            block = records[start : start + block_records]
+            lines = [
+                json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=str) for r in block
+            ]
+            data = gzip.compress(
+                ("\n".join(lines) + "\n").encode("utf-8"), compresslevel=6, mtime=0
+            )
+            f.write(data)
+            for line, record in enumerate(block):
+                source_id = record.get("id") if isinstance(record, dict) else None
+                if source_id:
+                    entries.append((str(source_id), offset, len(data), line))
+            offset += len(data)
+    os.replace(tmp_path, path)
+
+    with transaction.atomic():
+        defaults = {
+            "snapshot_id": snapshot_id,
+            "record_count": len(records),
+            "compressed_bytes": offset,
+        }
+        replaced = list(SnapshotSegment.objects.filter(snapshot_id=snapshot_id).exclude(name=name))
+        created = [old.created_at for old in replaced if old.created_at]
+        if created:
+            defaults["created_at"] = min(created)
+        for old in replaced:
+            _remove_file(segment_path(old))
+            old.delete()
+        segment, _ = SnapshotSegment.objects.update_or_create(name=name, defaults=defaults)
+        segment.records.all().delete()
+        SnapshotRecord.objects.bulk_create(
+            [
+                SnapshotRecord(
+                    segment=segment, source_id=source_id, offset=o, length=length, line=line
+                )
+                for source_id, o, length, line in entries
+            ],
+            batch_size=1000,
+        )
+
+    logger.info(f"归档 snapshot {snapshot_id}：{len(records)} 条记录，{offset} 字节 → {name}")
+    return segment
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ==========================================
+# 2. 按索引读取
+# ==========================================
+
+
+def load_records(entries):
+    """
+    按索引读取记录，entries 为 SnapshotRecord 列表 (需要 segment 已加载)。
+    同一个块只读取和解压一次。返回与 entries 顺序一致的记录列表。
+    """
+    blocks = {}
+    handles = {}
+    try:
+        for entry in sorted(entries, key=lambda e: (e.segment_id, e.offset)):
+            key = (entry.segment_id, entry.offset)
+            if key in blocks:
+                continue
+            f = handles.get(entry.segment_id)
+            if f is None:
+                f = handles[entry.segment_id] = open(segment_path(entry.segment), "rb")
+            f.seek(entry.offset)
+            blocks[key] = gzip.decompress(f.read(entry.length)).decode("utf-8").splitlines()
+    finally:
+        for f in handles.values():
+            f.close()
+
+    return [json.loads(blocks[(e.segment_id, e.offset)][e.line]) for e in entries]
+
+
+def archived_records(source_id, limit=10):
+    """某个产品最近 limit 次归档的原始记录 (新的在前)，只读取对应的 gzip 块"""
+    entries = list(
+        SnapshotRecord.objects.filter(source_id=source_id)
+        .select_related("segment")
+        .order_by("-segment__created_at", "-id")[:limit]
+    )
+    return [
+        {
+            "snapshot_id": entry.segment.snapshot_id,
+            "archived_at": entry.segment.created_at,
+            "record": record,
+        }
+        for entry, record in zip(entries, load_records(entries))
+    ]
+
+
+def latest_entries(source_ids=None, snapshot_ids=None):
+    """
+    每个产品最新的一条索引 (按归档位置排序，回放时顺序读取文件)。
+    最新按 snapshot 的归档时间判断，同一时间再按主键：重写旧 snapshot 时索引的主键会变大。
+    """
+    records = SnapshotRecord.objects.all()
+    if source_ids:
+        records = records.filter(source_id__in=list(source_ids))
+    if snapshot_ids:
+        records = records.filter(segment__snapshot_id__in=list(snapshot_ids))
+    latest_ids = (
+        records.annotate(
+            rank=Window(
+                RowNumber(),
+                partition_by=F("source_id"),
+                order_by=[F("segment__created_at").desc(nulls_last=True), F("pk").desc()],
+            )
+        )
+        .filter(rank=1)
+        .values("pk")
+    )
+    return (
+        SnapshotRecord.objects.filter(pk__in=latest_ids)
+        .select_related("segment")
+        .order_by("segment_id", "offset", "line")
+    )
+
+
+# ==========================================
+# 3. 回放 (重新导入)
+# ==========================================
+
+
+def _import_batch(entries):
+    try:
+        return import_products_from_list(load_records(entries))
+    finally:
+        # 每个线程有自己的数据库连接，导入结束后关闭
+        connection.close()
+
+
+def replay_archive(source_ids=None, snapshot_ids=None, workers=4, batch_size=REPLAY_BATCH_SIZE):
+    """
+    从归档重新导入产品：每个产品只导入最新的一条记录，
+    按归档位置分批，多个线程并行导入。返回 (记录数, 导入成功数)。
+    """
+    entries = list(latest_entries(source_ids, snapshot_ids).iterator(chunk_size=2000))
+    batches = [entries[i : i + batch_size] for i in range(0, len(entries), batch_size)]
+
+    imported = 0
+    if workers <= 1:
+        for batch in batches:
+            imported += import_products_from_list(load_records(batch))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_import_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                imported += future.result()
+
+    logger.info(f"归档回放：{len(entries)} 条记录，导入 {imported} 个产品")
+    return len(entries), imported
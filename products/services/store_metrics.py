@@ -0,0 +1,61 @@
+# products/services/store_metrics.py
+
+import logging
+
+from django.db.models import Avg, Count, Sum
+from django.utils import timezone
+
+from products.models import Product, Store
+
+logger = logging.getLogger(__name__)
+
+STORE_METRIC_FIELDS = ["tracked_products", "avg_price", "tracked_sold", "metrics_updated_at"]
+
+# 每批更新的店铺数量
+STORE_METRICS_BATCH_SIZE = 500
+
+
+def _refresh_batch(store_pks, now):
+    metrics = {
+        row["store_id"]: row
+        for row in Product.objects.filter(store_id__in=store_pks)
+        .values("store_id")
+        .annotate(count=Count("pk"), avg_price=Avg("final_price"), sold=Sum("sold"))
+    }
+
+    stores = []
+    for pk in store_pks:
+        row = metrics.get(pk, {})
+        avg_price = row.get("avg_price")
+        stores.append(
+            Store(
+                pk=pk,
+                tracked_products=row.get("count", 0),
+                avg_price=round(avg_price, 2) if avg_price is not None else None,
+                tracked_sold=row.get("sold") or 0,
+                metrics_updated_at=now,
+            )
+        )
+    Store.objects.bulk_update(stores, STORE_METRIC_FIELDS)
+    return len(stores)
+
+
+def refresh_store_metrics(store_pks=None):
+    """
+    根据本系统的产品数据更新店铺统计 (产品数、平均价格、总销量)，
+    每批店铺一次分组聚合 + 一次批量更新。
+    store_pks 为空时更新全部店铺 (定时任务每天执行一次，修正产品更换店铺后的旧店铺统计)。
+    返回更新的店铺数量。
+    """
+    if store_pks is None:
+        store_pks = Store.objects.order_by("pk").values_list("pk", flat=True)
+    store_pks = [pk for pk in store_pks if pk]
+
+    now = timezone.now()
+    updated = 0
+    for i in range(0, len(store_pks), STORE_METRICS_BATCH_SIZE):
+        updated += _refresh_batch(store_pks[i : i + STORE_METRICS_BATCH_SIZE], now)
+
+    if updated:
+        logger.info(f"更新店铺统计 {updated} 个")
+    return updated
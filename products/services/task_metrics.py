@@ -0,0 +1,250 @@
+# products/services/task_metrics.py
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Min
+from django.utils import timezone
+from django_q.conf import Conf
+from django_q.models import OrmQ
+from django_q.utils import get_func_repr
+
+from products.models import TaskRun
+from products.services.scrape_metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+TASK_METRIC_WINDOWS = {
+    "15m": timedelta(minutes=15),
+    "1h": timedelta(hours=1),
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+}
+
+# worker 开始执行任务时写入任务包的时间戳 (随结果一起传回 monitor 进程)
+EXEC_STARTED_KEY = "_exec_started"
+
+
+# ==========================================
+# 1. 记录 (django-q 信号，见 products/signals.py)
+# ==========================================
+
+
+def mark_task_started(task):
+    """pre_execute (worker 进程)：记录开始执行的时间"""
+    task[EXEC_STARTED_KEY] = timezone.now()
+
+
+def _seconds(start, end):
+    if start is None or end is None:
+        return None
+    return max((end - start).total_seconds(), 0.0)
+
+
+def record_task_run(task):
+    """post_execute (monitor 进程)：写入一条执行记录。任何异常只记录日志，不影响任务结果的保存。"""
+    try:
+        enqueued_at = task.get("started")
+        started_at = task.get(EXEC_STARTED_KEY)
+        stopped_at = task.get("stopped") or timezone.now()
+        TaskRun.objects.create(
+            task_id=str(task.get("id") or "")[:32],
+            func=get_func_repr(task["func"])[:256],
+            queue=(task.get("cluster") or Conf.CLUSTER_NAME)[:100],
+            enqueued_at=enqueued_at,
+            started_at=started_at,
+            stopped_at=stopped_at,
+            success=bool(task.get("success")),
+            duration=_seconds(started_at, stopped_at),
+            lag=_seconds(enqueued_at, started_at),
+        )
+    except Exception as e:
+        logger.warning(f"记录任务执行指标失败: {e}")
+
+
+def purge_task_runs():
+    """删除超过 TASK_METRICS_RETENTION_DAYS 天的执行记录，返回删除数量"""
+    retention_days = getattr(settings, "TASK_METRICS_RETENTION_DAYS", 7)
+    if retention_days <= 0:
+        return 0
+    deleted, _ = TaskRun.objects.filter(
+        stopped_at__lt=timezone.now() - timedelta(days=retention_days)
+    ).delete()
+    return deleted
+
+
+# ==========================================
+# 2. 汇总 (带缓存)
+# ==========================================
+
+
+def _stats(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def queue_depths():
+    """
+    每个队列 (django_q_ormq.key) 中等待的任务数，以及最早入队的任务已等待的秒数。
+    每个队列只解码最早的一条任务包。
+    """
+    now = timezone.now()
+    queues = []
+    for row in (
+        OrmQ.objects.values("key").annotate(depth=Count("id"), first_id=Min("id")).order_by("key")
+    ):
+        oldest_age = None
+        try:
+            enqueued_at = OrmQ.objects.get(pk=row["first_id"]).task.get("started")
+            oldest_age = round(_seconds(enqueued_at, now), 3) if enqueued_at else None
+        except Exception as e:
+            logger.debug(f"解析队列 {row['key']} 的任务包失败: {e}")
+        queues.append(
+            {"queue": row["key"], "depth": row["depth"], "oldest_age_seconds": oldest_age}
+        )
+    return queues
+
+
+def task_metrics(window="1h"):
+    """
+    最近 window 内按任务函数汇总：执行数、失败数、失败率、执行耗时和排队等待的 p50 / p95 / 最大值，
+    以及当前各队列的积压。结果缓存 TASK_METRICS_CACHE_SECONDS 秒。
+    """
+    if window not in TASK_METRIC_WINDOWS:
+        raise ValueError(f"未知的时间窗口: {window}")
+
+    cache_key = f"task_metrics:{window}"
+    timeout = getattr(settings, "TASK_METRICS_CACHE_SECONDS", 30)
+    if timeout > 0:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    groups = {}
+    rows = TaskRun.objects.filter(
+        stopped_at__gte=timezone.now() - TASK_METRIC_WINDOWS[window]
+    ).values_list("func", "success", "duration", "lag")
+    for func, success, duration, lag in rows.iterator(chunk_size=5000):
+        group = groups.setdefault(func, {"runs": 0, "failures": 0, "durations": [], "lags": []})
+        group["runs"] += 1
+        group["failures"] += 0 if success else 1
+        group["durations"].append(duration)
+        group["lags"].append(lag)
+
+    functions = [
+        {
+            "func": func,
+            "runs": group["runs"],
+            "failures": group["failures"],
+            "failure_rate": round(group["failures"] / group["runs"], 4),
+            "duration": _stats(group["durations"]),
+            "lag": _stats(group["lags"]),
+        }
+        for func, group in groups.items()
+    ]
+    functions.sort(key=lambda f: (-f["runs"], f["func"]))
+
+    runs = sum(f["runs"] for f in functions)
+    failures = sum(f["failures"] for f in functions)
+    metrics = {
+        "window": window,
+        "generated_at": timezone.now().isoformat(),
+        "totals": {
+            "runs": runs,
+            "failures": failures,
+            "failure_rate": round(failures / runs, 4) if runs else None,
+        },
+        "functions": functions,
+        "queues": queue_depths(),
+    }
+    if timeout > 0:
+        cache.set(cache_key, metrics, timeout)
+    return metrics
+
+
+def collect_queue_depths():
+    """/metrics 采集函数 (tiktok_pm_project.metrics)：各队列的积压任务数和最早任务已等待的秒数"""
+    queues = queue_depths()
+    return [
+        (
+            "tiktok_task_queue_depth",
+            "Tasks waiting in the queue.",
+            [({"queue": q["queue"]}, q["depth"]) for q in queues],
+        ),
+        (
+            "tiktok_task_queue_oldest_seconds",
+            "Age of the oldest waiting task.",
+            [
+                ({"queue": q["queue"]}, q["oldest_age_seconds"])
+                for q in queues
+                if q["oldest_age_seconds"] is not None
+            ],
+        ),
+    ]
+
+
+# ==========================================
+# 3. Prometheus 文本格式
+# ==========================================
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(metrics):
+    """把 task_metrics() 的结果转换为 Prometheus 文本格式 (窗口内的统计值均为 gauge)"""
+    window = _label(metrics["window"])
+    lines = [
+        "# HELP tiktok_task_runs Task runs finished in the window.",
+        "# TYPE tiktok_task_runs gauge",
+    ]
+    for f in metrics["functions"]:
+        func = _label(f["func"])
+        lines.append(
+            f'tiktok_task_runs{{func="{func}",status="success",window="{window}"}} {f["runs"] - f["failures"]}'
+        )
+        lines.append(
+            f'tiktok_task_runs{{func="{func}",status="failure",window="{window}"}} {f["failures"]}'
+        )
+
+    for name, key, help_text in (
+        ("tiktok_task_duration_seconds", "duration", "Task execution time."),
+        ("tiktok_task_lag_seconds", "lag", "Time from enqueue to start of execution."),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for f in metrics["functions"]:
+            func = _label(f["func"])
+            for stat, quantile in (("p50", "0.5"), ("p95", "0.95"), ("max", "1")):
+                value = f[key][stat]
+                if value is not None:
+                    lines.append(
+                        f'{name}{{func="{func}",quantile="{quantile}",window="{window}"}} {value}'
+                    )
+
+    lines += [
+        "# HELP tiktok_task_queue_depth Tasks waiting in the queue.",
+        "# TYPE tiktok_task_queue_depth gauge",
+    ]
+    lines += [
+        f'tiktok_task_queue_depth{{queue="{_label(q["queue"])}"}} {q["depth"]}'
+        for q in metrics["queues"]
+    ]
+    lines += [
+        "# HELP tiktok_task_queue_oldest_seconds Age of the oldest waiting task.",
+        "# TYPE tiktok_task_queue_oldest_seconds gauge",
+    ]
+    lines += [
+        f'tiktok_task_queue_oldest_seconds{{queue="{_label(q["queue"])}"}} {q["oldest_age_seconds"]}'
+        for q in metrics["queues"]
+        if q["oldest_age_seconds"] is not None
+    ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,130 @@
+# products/services/task_payloads.py
+
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Length
+from django.utils import timezone
+from django_q.models import Task
+
+from products.services.task_metrics import purge_task_runs
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_SUFFIX = ".json.gz"
+
+
+# ==========================================
+# 1. 大参数引用：任务参数只传 key
+# ==========================================
+# django-q 会把任务参数序列化进 broker 表 (django_q_ormq)，执行后再存进 django_q_task，
+# 几十 MB 的 snapshot 会被写两次。大数据先写入 TASK_PAYLOAD_ROOT，任务参数只传 key，
+# 任务成功后由任务自己删除 (release_payload)，失败时保留到 django-q 重试或过期清理。
+
+
+def payload_root():
+    return getattr(
+        settings, "TASK_PAYLOAD_ROOT", os.path.join(settings.BASE_DIR, "data", "task_payloads")
+    )
+
+
+def _payload_path(key):
+    # key 只来自 store_payload (uuid hex)，这里仍然去掉路径部分，避免读写目录外的文件
+    return os.path.join(payload_root(), os.path.basename(key) + PAYLOAD_SUFFIX)
+
+
+def store_payload(data, prefix="payload"):
+    """把 data 以 gzip JSON 写入磁盘，返回引用 key"""
+    key = f"{prefix}_{uuid.uuid4().hex}"
+    path = _payload_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = f"{path}.part"
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=1) as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+    return key
+
+
+def load_payload(key):
+    """读取 key 对应的数据；不存在 (已释放或已过期) 时抛出 FileNotFoundError"""
+    with gzip.open(_payload_path(key), "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def release_payload(key):
+    """任务成功后删除数据，返回是否删除了文件"""
+    try:
+        os.remove(_payload_path(key))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def purge_stale_payloads(max_age_hours=None):
+    """删除超过 TASK_PAYLOAD_RETENTION_HOURS 仍未被释放的数据 (任务最终失败时留下)。返回删除数量。"""
+    if max_age_hours is None:
+        max_age_hours = getattr(settings, "TASK_PAYLOAD_RETENTION_HOURS", 48)
+    root = payload_root()
+    if not os.path.isdir(root):
+        return 0
+
+    cutoff = time.time() - max_age_hours * 3600
+    deleted = 0
+    for entry in os.scandir(root):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+            deleted += 1
+    return deleted
+
+
+# ==========================================
+# 2. 任务历史清理 (定时任务)
+# ==========================================
+
+
+def purge_task_history():
+    """
+    清理 django_q_task 表：
+    - 超过 TASK_HISTORY_RETENTION_DAYS 天的任务记录删除 (save_limit 只限制成功任务，失败任务不会自动删除)
+    - 参数 + 结果超过 TASK_HISTORY_MAX_BYTES 的记录清空 args / kwargs / result，保留状态和时间
+    返回 {"deleted": 删除数, "trimmed": 清空大字段数}。
+    """
+    retention_days = getattr(settings, "TASK_HISTORY_RETENTION_DAYS", 14)
+    max_bytes = getattr(settings, "TASK_HISTORY_MAX_BYTES", 1024 * 1024)
+
+    deleted = 0
+    if retention_days > 0:
+        deleted, _ = Task.objects.filter(
+            stopped__lt=timezone.now() - timedelta(days=retention_days)
+        ).delete()
+
+    trimmed = 0
+    if max_bytes > 0:
+        oversized = (
+            Task.objects.annotate(args_size=Length("args"), result_size=Length("result"))
+            .filter(Q(args_size__gt=max_bytes) | Q(result_size__gt=max_bytes))
+            .values_list("pk", flat=True)
+        )
+        trimmed = Task.objects.filter(pk__in=list(oversized)).update(
+            args=None, kwargs=None, result=None
+        )
+
+    if deleted or trimmed:
+        logger.info(f"任务历史：删除 {deleted} 条，清空大字段 {trimmed} 条")
+    return {"deleted": deleted, "trimmed": trimmed}
+
+
+def cleanup_task_storage():
+    """定时任务 (每小时)：清理过期的大参数文件、任务历史和任务执行记录"""
+    result = purge_task_history()
+    result["payloads"] = purge_stale_payloads()
+    result["task_runs"] = purge_task_runs()
+    return result
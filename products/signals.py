@@ -0,0 +1,18 @@
+# products/signals.py
+
+from django.dispatch import receiver
+from django_q.signals import post_execute, pre_execute
+
+from .services.task_metrics import mark_task_started, record_task_run
+
+
+@receiver(pre_execute)
+def task_pre_execute(sender, func, task, **kwargs):
+    # worker 进程：task 字典执行后会随结果传回 monitor 进程
+    mark_task_started(task)
+
+
+@receiver(post_execute)
+def task_post_execute(sender, task, **kwargs):
+    # monitor 进程：任务结果已保存
+    record_task_run(task)
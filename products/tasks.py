@@ -1,31 +1,36 @@
 # products/tasks.py
 import json
 import logging
-import os
-from datetime import timedelta
 
 import requests
 from django.conf import settings
-from django.utils import timezone
-from django_q.models import Schedule
-from django_q.tasks import async_task
 
-logger = logging.getLogger(__name__)
+from products.models import Product, ScrapeRequest
+from products.services import http_client
+from products.services.bright_data_poller import (
+    check_snapshot,
+    record_failed_trigger,
+    register_snapshot,
+)
+from products.services.product_media_downloader import download_all_product_images
+from products.services.snapshot_archive import write_segment as write_snapshot_segment
 
-# 轮询任务配置
-INITIAL_DELAY = 30  # 第一次轮询延迟（秒）
-RETRY_DELAY = 60  # 重新轮询的间隔（秒）
+logger = logging.getLogger(__name__)
 
 
 # --------------------------
 # 任务 A (trigger_bright_data_task): 触发外部 API，成功后获取 ID。
 #
-# 任务 A 调度任务 B： 使用 async_task 调度 poll_bright_data_result 在 30 秒后运行。
+# 任务 A 把 snapshot 登记到 scrape_jobs 表 (register_snapshot)。
 #
-# 任务 B (poll_bright_data_result): 检查状态，如果未完成，再次调度任务 B (实现循环)。
+# 轮询协调任务 (bright_data_poller.poll_due_snapshots) 每分钟运行一次，
+# 按自适应间隔检查所有在途 snapshot，就绪后下载并导入。
 # --------------------------
-def trigger_bright_data_task(urls, collection_mode):
-    # ... (构造 payload 和 headers 的代码不变) ...
+def trigger_bright_data_task(urls, collection_mode, request_ids=None):
+    """
+    调用 Bright Data trigger 接口。
+    request_ids 为合并提交的 ScrapeRequest，会关联到本次生成的 ScrapeJob。
+    """
 
     # ----------------------------------------------------
     # 1. 构造 JSON Payload (根据 collection_mode 动态变化)
@@ -78,8 +83,8 @@ def trigger_bright_data_task(urls, collection_mode):
     # 4. 执行 API 调用
     # ----------------------------------------------------
     try:
-        response = requests.post(
-            final_trigger_url, headers=headers, data=json.dumps(payload), timeout=INITIAL_DELAY
+        response = http_client.post(
+            "bright_data", final_trigger_url, headers=headers, data=json.dumps(payload)
         )
         response.raise_for_status()
 
@@ -90,75 +95,52 @@ def trigger_bright_data_task(urls, collection_mode):
         if snapshot_id:
             logger.info(f"Bright Data API 触发成功。snapshot_id: {snapshot_id}")
 
-            # 第一次轮询任务（立即运行）
-            _schedule_delayed_poll(snapshot_id, delay_seconds=0)
+            # 交给轮询协调任务统一检查进度
+            job = register_snapshot(snapshot_id, collection_mode, inputs=urls)
+            _link_scrape_requests(request_ids, job, "submitted")
             return True
         else:
             logger.error(f"Bright Data API 触发成功，但未返回 snapshot_id。响应: {response.text}")
+            job = record_failed_trigger(
+                collection_mode, urls, f"未返回 snapshot_id: {response.text}"
+            )
+            _link_scrape_requests(request_ids, job, "failed")
             return False
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Bright Data API 触发失败。错误: {e}")
+        _link_scrape_requests(
+            request_ids, record_failed_trigger(collection_mode, urls, e), "failed"
+        )
         return False
 
     except Exception as e:
         logger.error(f"任务执行期间发生未知错误: {e}")
+        _link_scrape_requests(
+            request_ids, record_failed_trigger(collection_mode, urls, e), "failed"
+        )
         return False
 
 
-# ==========================================================
-# 任务：轮询 Bright Data 结果
-# ==========================================================
+def _link_scrape_requests(request_ids, job, status):
+    if request_ids:
+        ScrapeRequest.objects.filter(pk__in=request_ids).update(job=job, status=status)
+
+
 # ==========================================================
 # 任务：轮询 Bright Data 结果
 # ==========================================================
 def poll_bright_data_result(snapshot_id_list):
+    """
+    立即检查一次指定 snapshot 的进度 (兼容旧的 poll_<snapshot_id> Schedule)。
+    之后的轮询由 products.services.bright_data_poller.poll_due_snapshots 统一负责。
+    """
     # 关键修复：从列表中取出实际的 ID 字符串
     snapshot_id = snapshot_id_list[0]
     logger.info(f"轮询 snapshot_id={snapshot_id}")
 
-    headers = {"Authorization": f"Bearer {settings.BRIGHT_DATA_API_KEY}"}
-
-    try:
-        status_url = f"{settings.BRIGHT_DATA_STATUS_URL}{snapshot_id}"
-        response = requests.get(status_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        status_data = response.json()
-        status = status_data.get("status")
-        logger.debug(f"Bright Data 状态 = {status}")
-
-        # 未完成 → 重新调度（不阻塞 worker）
-        if status in ["pending", "running", "collecting"]:
-            logger.info("状态未完成，30 秒后继续轮询")
-
-            _schedule_delayed_poll(snapshot_id, delay_seconds=30)
-            return
-
-        # 完成 → 下载数据
-        if status == "ready":
-            download_url = f"{settings.BRIGHT_DATA_DOWNLOAD_BASE_URL}{snapshot_id}?format=json"
-            download_response = requests.get(download_url, headers=headers, timeout=180)
-            download_response.raise_for_status()
-
-            downloaded_data = download_response.json()
-            logger.info(f"下载成功 {len(downloaded_data)} records")
-
-            # 保存 JSON 文件
-            async_task("products.tasks.save_snapshot_file", snapshot_id, downloaded_data)
-
-            # 🌟 关键修改：指向新的 ORM 导入服务 🌟
-            async_task(
-                "products.services.product_importer.import_products_from_list", downloaded_data
-            )
-
-            return
-
-        logger.error(f"Bright Data 返回失败状态: {status}")
-
-    except Exception as e:
-        logger.error(f"轮询异常: {e}")
-        # 失败也建议 30 秒后重试一次
-        _schedule_delayed_poll(snapshot_id, delay_seconds=30)
+    job = register_snapshot(snapshot_id)
+    return check_snapshot(job)
 
 
 def log_task_completion(task):
@@ -190,45 +172,32 @@ def log_task_completion(task):
 
 
 # ===================================================================================
-# 轮询任务延迟调度（Django-Q 2.x 正确写法）
+# 数据保存（异步任务）
 # ===================================================================================
 
 
-def _schedule_delayed_poll(snapshot_id, delay_seconds=30):
+def save_snapshot_file(snapshot_id, data):
     """
-    创建 legitimate Django-Q 2.x schedule args:
-    使用 repr(list) 确保 args 存储为 Python literal 列表。
+    把 Bright Data 下载的数据写入快照归档 (gzip 压缩的 NDJSON + source_id 索引)，
+    见 products.services.snapshot_archive。下载的 snapshot 由 import_snapshot 在导入前归档。
     """
-
-    # 删除旧任务（避免重复）
-    Schedule.objects.filter(name=f"poll_{snapshot_id}").delete()
-
-    Schedule.objects.create(
-        name=f"poll_{snapshot_id}",
-        func="products.tasks.poll_bright_data_result",
-        args=repr([snapshot_id]),  # 必须是字符串，而不是 Python object
-        schedule_type=Schedule.ONCE,
-        next_run=timezone.now() + timedelta(seconds=delay_seconds),
-    )
-
-    logger.info(f"已调度下一次轮询：{delay_seconds} 秒后执行")
+    segment = write_snapshot_segment(snapshot_id, data)
+    logger.info(f"快照归档保存成功：{segment.name}")
+    return segment.name
 
 
 # ===================================================================================
-# 数据保存（异步任务）
+# 批量操作触发的单产品任务 (AI 分析见 products.services.ai_jobs)
 # ===================================================================================
 
 
-def save_snapshot_file(snapshot_id, data):
-    """
-    将 Bright Data 下载的数据保存到 /data/snapshot_xxx.json
-    """
-    json_data_dir = os.path.join(settings.BASE_DIR, "data", "json")
-    os.makedirs(json_data_dir, exist_ok=True)
-
-    target_file = os.path.join(json_data_dir, f"snapshot_{snapshot_id}.json")
-
-    with open(target_file, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def download_product_images_task(product_id):
+    """下载单个产品的所有图片到 PRODUCT_MEDIA_DOWNLOAD_ROOT"""
+    product = Product.objects.filter(pk=product_id).first()
+    if not product:
+        logger.warning(f"产品不存在，跳过图片下载: {product_id}")
+        return None
 
-    logger.info(f"JSON 文件保存成功：{target_file}")
+    target_dir, summary = download_all_product_images(product)
+    logger.info(f"产品 {product.source_id} 图片下载完成: {summary}")
+    return summary
@@ -1,16 +1,30 @@
+import gzip
 import json
 import os
+import tempfile
+import time
+import uuid
+import zipfile
+from io import BytesIO
+from datetime import timedelta
 from decimal import Decimal
 from unittest import mock
 
 import requests
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
 from django.test import TestCase, override_settings, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.test import APIClient, APITestCase
-from django_q.models import Schedule
+from django_q.models import OrmQ, Schedule, Task
+from django_q.signals import post_execute, pre_execute
+from django_q.signing import SignedPackage
 
 from .models import (
     Store,
@@ -21,6 +35,20 @@ from .models import (
     ProductReview,
     ProductTagDefinition,
     AIContentItem,
+    AIAnalysisJob,
+    AICallbackReceipt,
+    AIGeneration,
+    BulkOperation,
+    ScrapeJob,
+    ScrapeRequest,
+    ProductHistory,
+    ProductRollup,
+    ProductRawPayload,
+    RateLimitBucket,
+    SnapshotRecord,
+    SnapshotSegment,
+    TaskRun,
+    RequestProfile,
 )
 from .serializers import (
     ProductSerializer,
@@ -28,11 +56,52 @@ from .serializers import (
     ProductVideoSerializer,
     ProductVariationSerializer,
 )
+from .fields import COMPRESSED_PREFIX
+from .services.ai_content import ingest_ai_callbacks
+from .services.media_export import iter_media_entries
+from .services.product_export import iter_product_payloads
+from .services.product_payload import build_product_payload, build_product_payloads
+from .services import http_client, product_media_downloader, rate_limiter
+from .services.ai_jobs import close_jobs_for_callback, enqueue_analysis, run_analysis_job
+from .services.bright_data_poller import (
+    check_snapshot,
+    download_snapshot,
+    import_snapshot,
+    poll_due_snapshots,
+    register_snapshot,
+)
+from .services.scrape_metrics import scrape_latency_stats
+from .services.snapshot_archive import archived_records, latest_entries, write_segment
+from .services.request_profiling import QueryRecorder, trim_profiles
+from .services.task_metrics import prometheus_text, purge_task_runs, queue_depths, task_metrics
+from .services.task_payloads import cleanup_task_storage, load_payload, release_payload, store_payload
+from .services.product_history import compact_history, history_series, record_history
+from .services.product_importer import IMPORTED_PRODUCTS, import_products_from_list
+from .services.product_rollups import analytics_summary, rebuild_rollups, refresh_rollups
+from .services.raw_payloads import store_raw_payloads
+from .services.store_metrics import refresh_store_metrics
+from .services.refresh_scheduler import (
+    REFRESH_REQUESTER,
+    pick_refresh_candidates,
+    run_quota,
+    schedule_refresh,
+)
+from .services.scrape_requests import (
+    flush_scrape_requests,
+    normalize_input,
+    submit_scrape_requests,
+)
+from .services.bulk_actions import execute_bulk_operation, submit_bulk_action
 from .tasks import (
     trigger_bright_data_task,
     poll_bright_data_result,
     save_snapshot_file,
 )
+from .scheduler import setup_product_schedules
+from tiktok_pm_project.task_queues import queue_options
+from tiktok_pm_project import metrics
+from tiktok_pm_project.db_sync import SyncManager, SyncType
+from tiktok_pm_project.db_sync.sync_manager import SYNC_ROWS
 
 
 # ----------------------------------------------------------------------
@@ -678,16 +747,18 @@ class ProductFetchViewTest(TestCase):
         self.assertContains(response, "TikTok 产品数据抓取")
 
     def test_post_product_fetch_view_with_urls(self):
-        """测试POST请求提交URL列表"""
-        with mock.patch("products.views.async_task"):
-            response = self.client.post(
-                "/api/fetch/",
-                {
-                    "collection_mode": "url",
-                    "product_urls": "https://example.com/product1\nhttps://example.com/product2",
-                },
-            )
-            self.assertEqual(response.status_code, 302)
+        """测试POST请求提交URL列表：进入待提交队列，不直接触发采集"""
+        response = self.client.post(
+            "/api/fetch/",
+            {
+                "collection_mode": "url",
+                "product_urls": "https://example.com/product1\nhttps://example.com/product2",
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            ScrapeRequest.objects.filter(status="pending", requested_by="admin").count(), 2
+        )
 
     def test_post_product_fetch_view_empty_urls(self):
         """测试POST请求提交空URL列表"""
@@ -730,7 +801,7 @@ class ExportProductJsonViewTest(TestCase):
 
 
 class N8nAnalyzeViewTest(TestCase):
-    """测试n8n_analyze_view"""
+    """测试n8n_analyze_view (异步任务)"""
 
     def setUp(self):
         self.client = Client()
@@ -741,8 +812,31 @@ class N8nAnalyzeViewTest(TestCase):
             category="电子产品",
         )
 
+    @mock.patch("products.services.ai_jobs.async_task")
+    def test_n8n_analyze_creates_job(self, mock_async_task):
+        """视图只提交任务，不同步调用 n8n"""
+        url = reverse("n8n_analyze", kwargs={"product_id": self.product.pk})
+        with mock.patch("products.services.n8n_analyzer.http_client.post") as mock_post:
+            response = self.client.get(url)
+            self.assertFalse(mock_post.called)
+        self.assertEqual(response.status_code, 302)
+
+        job = AIAnalysisJob.objects.get(product=self.product)
+        self.assertEqual(job.status, "submitted")
+        mock_async_task.assert_called_once_with(
+            "products.services.ai_jobs.run_analysis_job", job.pk
+        )
+
+    @mock.patch("products.services.ai_jobs.async_task")
+    def test_n8n_analyze_skips_open_job(self, mock_async_task):
+        """已有进行中的任务时不重复提交"""
+        AIAnalysisJob.objects.create(product=self.product, status="processing")
+        url = reverse("n8n_analyze", kwargs={"product_id": self.product.pk})
+        self.client.get(url)
+        self.assertEqual(AIAnalysisJob.objects.filter(product=self.product).count(), 1)
+
     @override_settings(N8N_WEBHOOK_OPTIMIZE_PRODUCT_URL="http://example.com/webhook")
-    @mock.patch("products.views.requests.post")
+    @mock.patch("products.services.n8n_analyzer.http_client.post")
     def test_n8n_analyze_success(self, mock_post):
         """测试n8n分析成功"""
         mock_response = MockResponse(
@@ -751,23 +845,74 @@ class N8nAnalyzeViewTest(TestCase):
         )
         mock_post.return_value = mock_response
 
-        url = reverse("n8n_analyze", kwargs={"product_id": self.product.pk})
-        response = self.client.get(url)
-        self.assertEqual(response.status_code, 302)
+        job = AIAnalysisJob.objects.create(product=self.product, status="submitted")
+        self.assertTrue(run_analysis_job(job.pk))
+        self.assertEqual(mock_post.call_args.kwargs["json"]["job_id"], job.pk)
 
         self.product.refresh_from_db()
         self.assertEqual(self.product.description_1, "优化后的描述1")
         self.assertEqual(self.product.description_2, "优化后的描述2")
+        job.refresh_from_db()
+        self.assertEqual(job.status, "completed")
+
+    @override_settings(N8N_WEBHOOK_OPTIMIZE_PRODUCT_URL="http://example.com/webhook")
+    @mock.patch("products.services.n8n_analyzer.http_client.post")
+    def test_n8n_analyze_waits_for_callback(self, mock_post):
+        """n8n 未同步返回文案时等待回调"""
+        mock_post.return_value = MockResponse(status_code=200, json_data={})
+
+        job = AIAnalysisJob.objects.create(product=self.product, status="submitted")
+        run_analysis_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "processing")
 
     @override_settings(N8N_WEBHOOK_OPTIMIZE_PRODUCT_URL="http://example.com/webhook")
-    @mock.patch("products.views.requests.post")
+    @mock.patch("products.services.n8n_analyzer.http_client.post")
     def test_n8n_analyze_failure(self, mock_post):
         """测试n8n分析失败"""
         mock_post.side_effect = requests.exceptions.RequestException("Connection error")
 
-        url = reverse("n8n_analyze", kwargs={"product_id": self.product.pk})
-        response = self.client.get(url)
-        self.assertEqual(response.status_code, 302)
+        job = AIAnalysisJob.objects.create(product=self.product, status="submitted")
+        self.assertFalse(run_analysis_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertIn("Connection error", job.error)
+
+    @mock.patch("products.services.n8n_analyzer.http_client.post")
+    def test_n8n_analyze_deleted_product(self, mock_post):
+        """入队后产品被删除：任务失败结束，不调用 n8n"""
+        job = AIAnalysisJob.objects.create(product=self.product, status="submitted")
+        with mock.patch("products.services.n8n_analyzer.build_product_payload", return_value=None):
+            self.assertFalse(run_analysis_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        mock_post.assert_not_called()
+
+        self.product.delete()
+        self.assertFalse(run_analysis_job(job.pk))
+
+    @override_settings(N8N_MAX_CONCURRENT_JOBS=2)
+    @mock.patch("products.services.ai_jobs.async_task")
+    def test_concurrency_cap(self, mock_async_task):
+        """批量提交时最多同时发送 N8N_MAX_CONCURRENT_JOBS 个任务"""
+        products = [
+            Product.objects.create(source_id=f"cap_{i}", title="产品") for i in range(5)
+        ]
+        self.assertEqual(enqueue_analysis([p.pk for p in products]), 5)
+        self.assertEqual(mock_async_task.call_count, 2)
+        self.assertEqual(AIAnalysisJob.objects.filter(status="queued").count(), 3)
+
+        # 回调关闭一个任务后，空出的名额分配给下一个排队任务
+        close_jobs_for_callback(products[0])
+        self.assertEqual(mock_async_task.call_count, 3)
+
+    def test_status_view(self):
+        """状态接口返回最近一次任务"""
+        job = AIAnalysisJob.objects.create(product=self.product, status="processing")
+        url = reverse("n8n_analyze_status", kwargs={"product_id": self.product.pk})
+        data = self.client.get(url).json()
+        self.assertEqual(data["job_id"], job.pk)
+        self.assertTrue(data["is_open"])
 
 
 class UpdateProductAPITest(TestCase):
@@ -802,6 +947,144 @@ class UpdateProductAPITest(TestCase):
 
         self.assertEqual(self.product.ai_items.count(), 3)
 
+    @override_settings(N8N_API_SECRET="test_secret")
+    @mock.patch("products.services.ai_jobs.async_task")
+    def test_update_product_api_closes_job(self, mock_async_task):
+        """回调到达时关闭对应的 AI 分析任务"""
+        job = AIAnalysisJob.objects.create(product=self.product, status="processing")
+        data = {
+            "api_key": "test_secret",
+            "product_id": "test_product_001",
+            "job_id": job.pk,
+            "desc_zh": ["中文描述"],
+        }
+        self.client.post(
+            reverse("update_product_api"), data=json.dumps(data), content_type="application/json"
+        )
+        job.refresh_from_db()
+        self.assertEqual(job.status, "completed")
+
+    @override_settings(N8N_API_SECRET="test_secret")
+    def test_update_product_api_idempotent(self):
+        """相同幂等键的重试不会重复写入"""
+        url = reverse("update_product_api")
+        data = {
+            "api_key": "test_secret",
+            "product_id": "test_product_001",
+            "idempotency_key": "run-001",
+            "output": {"desc_zh": ["中文描述"], "desc_en": ["English"]},
+        }
+        first = self.client.post(url, data=json.dumps(data), content_type="application/json")
+        second = self.client.post(url, data=json.dumps(data), content_type="application/json")
+
+        self.assertEqual(first.json()["status"], "success")
+        self.assertEqual(second.json()["status"], "duplicate")
+        self.assertEqual(self.product.ai_items.count(), 1)
+
+    @override_settings(N8N_API_SECRET="test_secret")
+    def test_update_product_api_lookup_by_pk(self):
+        """product_id 也可以是产品主键"""
+        data = {
+            "api_key": "test_secret",
+            "product_id": self.product.pk,
+            "voice_zh": "配音文案",
+        }
+        response = self.client.post(
+            reverse("update_product_api"), data=json.dumps(data), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.product.ai_items.get().content_type, "voice")
+
+    @override_settings(N8N_API_SECRET="test_secret")
+    def test_update_product_api_batch(self):
+        """批量回调：一次请求写入多个产品，单次 bulk_create"""
+        other = Product.objects.create(source_id="test_product_002", title="另一个产品")
+        AIContentItem.objects.create(product=other, ai_model="old", content_type="desc")
+        data = {
+            "api_key": "test_secret",
+            "items": [
+                {"product_id": "test_product_001", "model_name": "gpt-4o", "desc_zh": ["描述"]},
+                {"product_id": "test_product_002", "model_name": "gpt-4o", "script_en": ["a", "b"]},
+                {"product_id": "missing", "desc_zh": ["描述"]},
+            ],
+        }
+        with mock.patch.object(
+            AIContentItem.objects, "bulk_create", wraps=AIContentItem.objects.bulk_create
+        ) as mock_bulk_create:
+            response = self.client.post(
+                reverse("update_product_api"),
+                data=json.dumps(data),
+                content_type="application/json",
+            )
+        self.assertEqual(mock_bulk_create.call_count, 1)
+
+        statuses = [r["status"] for r in response.json()["results"]]
+        self.assertEqual(statuses, ["success", "success", "not_found"])
+        self.assertEqual(self.product.ai_items.count(), 1)
+        # 旧内容作为历史版本保留，不再被删除
+        self.assertEqual(other.ai_items.count(), 3)
+        self.assertEqual(other.ai_generations.get().item_count, 2)
+
+    @override_settings(N8N_API_SECRET="test_secret")
+    def test_update_product_api_batch_concurrent_duplicate(self):
+        """并发请求先写入同一幂等键：只有该条目为 duplicate，其余条目照常写入"""
+        other = Product.objects.create(source_id="test_product_002", title="另一个产品")
+        data = {
+            "api_key": "test_secret",
+            "items": [
+                {"product_id": "test_product_001", "idempotency_key": "run-001", "desc_zh": ["描述"]},
+                {"product_id": "test_product_002", "idempotency_key": "run-002", "desc_zh": ["描述"]},
+            ],
+        }
+        real_bulk_create = AICallbackReceipt.objects.bulk_create
+
+        def racing_bulk_create(receipts, **kwargs):
+            AICallbackReceipt.objects.create(key="run-002", product=other, generation_uuid=uuid.uuid4())
+            return real_bulk_create(receipts, **kwargs)
+
+        with mock.patch.object(AICallbackReceipt.objects, "bulk_create", side_effect=racing_bulk_create):
+            response = self.client.post(
+                reverse("update_product_api"), data=json.dumps(data), content_type="application/json"
+            )
+
+        statuses = [r["status"] for r in response.json()["results"]]
+        self.assertEqual(statuses, ["success", "duplicate"])
+        self.assertEqual(self.product.ai_items.count(), 1)
+        self.assertFalse(other.ai_items.exists())
+        self.assertFalse(other.ai_generations.exists())
+
+    @override_settings(N8N_API_SECRET="test_secret")
+    def test_update_product_api_batch_same_product_twice(self):
+        """同一批中同一产品/模型的两次生成：只有后一次的内容是最新版本"""
+        data = {
+            "api_key": "test_secret",
+            "items": [
+                {"product_id": "test_product_001", "model_name": "gpt-4o", "desc_zh": ["第一次"]},
+                {"product_id": "test_product_001", "model_name": "gpt-4o", "desc_zh": ["重试"]},
+            ],
+        }
+        response = self.client.post(
+            reverse("update_product_api"), data=json.dumps(data), content_type="application/json"
+        )
+        self.assertEqual([r["status"] for r in response.json()["results"]], ["success", "success"])
+        self.assertEqual(self.product.ai_items.count(), 2)
+        latest = self.product.ai_items.get(is_latest=True)
+        self.assertEqual(latest.content_zh, "重试")
+        self.assertEqual(str(latest.generation_id), response.json()["results"][1]["generation_id"])
+
+    @override_settings(N8N_API_SECRET="test_secret")
+    def test_update_product_api_batch_rejects_non_dict(self):
+        """批量条目不是 JSON 对象时返回 400，不写入任何内容"""
+        data = {
+            "api_key": "test_secret",
+            "items": [{"product_id": "test_product_001", "desc_zh": ["描述"]}, "oops"],
+        }
+        response = self.client.post(
+            reverse("update_product_api"), data=json.dumps(data), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.product.ai_items.exists())
+
     @override_settings(N8N_API_SECRET="test_secret")
     def test_update_product_api_unauthorized(self):
         """测试更新产品API未授权"""
@@ -846,8 +1129,8 @@ class TriggerBrightDataTaskTest(TestCase):
         BRIGHT_DATA_DISCOVER_BY_KEYWORD="keyword/",
         BRIGHT_DATA_PARAM_LIMIT_PER_INPUT="?limit=10",
     )
-    @mock.patch("products.tasks.requests.post")
-    @mock.patch("products.tasks._schedule_delayed_poll")
+    @mock.patch("products.tasks.http_client.post")
+    @mock.patch("products.tasks.register_snapshot")
     def test_trigger_task_url_mode(self, mock_schedule, mock_post):
         """测试URL模式触发任务"""
         mock_response = MockResponse(
@@ -860,7 +1143,7 @@ class TriggerBrightDataTaskTest(TestCase):
         result = trigger_bright_data_task(urls, "url")
 
         self.assertTrue(result)
-        self.assertTrue(mock_schedule.called)
+        mock_schedule.assert_called_once_with("test_snapshot_001", "url", inputs=urls)
 
     @override_settings(
         BRIGHT_DATA_API_KEY="test_api_key",
@@ -871,7 +1154,7 @@ class TriggerBrightDataTaskTest(TestCase):
         BRIGHT_DATA_DISCOVER_BY_KEYWORD="keyword/",
         BRIGHT_DATA_PARAM_LIMIT_PER_INPUT="?limit=10",
     )
-    @mock.patch("products.tasks.requests.post")
+    @mock.patch("products.tasks.http_client.post")
     def test_trigger_task_category_mode(self, mock_post):
         """测试分类模式触发任务"""
         mock_response = MockResponse(
@@ -894,7 +1177,7 @@ class TriggerBrightDataTaskTest(TestCase):
         BRIGHT_DATA_DISCOVER_BY_KEYWORD="keyword/",
         BRIGHT_DATA_PARAM_LIMIT_PER_INPUT="?limit=10",
     )
-    @mock.patch("products.tasks.requests.post")
+    @mock.patch("products.tasks.http_client.post")
     def test_trigger_task_shop_mode(self, mock_post):
         """测试店铺模式触发任务"""
         mock_response = MockResponse(
@@ -917,7 +1200,7 @@ class TriggerBrightDataTaskTest(TestCase):
         BRIGHT_DATA_DISCOVER_BY_KEYWORD="keyword/",
         BRIGHT_DATA_PARAM_LIMIT_PER_INPUT="?limit=10",
     )
-    @mock.patch("products.tasks.requests.post")
+    @mock.patch("products.tasks.http_client.post")
     def test_trigger_task_keyword_mode(self, mock_post):
         """测试关键词模式触发任务"""
         mock_response = MockResponse(
@@ -935,7 +1218,7 @@ class TriggerBrightDataTaskTest(TestCase):
         BRIGHT_DATA_API_KEY="test_api_key",
         BRIGHT_DATA_BASE_SCRAPE_URL="http://example.com/scrape",
     )
-    @mock.patch("products.tasks.requests.post")
+    @mock.patch("products.tasks.http_client.post")
     def test_trigger_task_api_failure(self, mock_post):
         """测试API调用失败"""
         mock_post.side_effect = requests.exceptions.RequestException("API Error")
@@ -946,108 +1229,452 @@ class TriggerBrightDataTaskTest(TestCase):
         self.assertFalse(result)
 
 
+@override_settings(
+    BRIGHT_DATA_API_KEY="test_api_key",
+    BRIGHT_DATA_STATUS_URL="http://example.com/status/",
+    BRIGHT_DATA_DOWNLOAD_BASE_URL="http://example.com/download/",
+    BRIGHT_DATA_POLL_MIN_SECONDS=10,
+    BRIGHT_DATA_POLL_MAX_SECONDS=300,
+    BRIGHT_DATA_POLL_TICK_SECONDS=0,
+)
 class PollBrightDataResultTest(TestCase):
-    """测试poll_bright_data_result"""
+    """测试 snapshot 轮询协调任务"""
 
-    @override_settings(
-        BRIGHT_DATA_API_KEY="test_api_key",
-        BRIGHT_DATA_STATUS_URL="http://example.com/status/",
-        BRIGHT_DATA_DOWNLOAD_BASE_URL="http://example.com/download/",
-    )
-    @mock.patch("products.tasks.requests.get")
-    @mock.patch("products.tasks.async_task")
+    def setUp(self):
+        # 下载的数据和快照归档写入临时目录
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        overrides = override_settings(
+            TASK_PAYLOAD_ROOT=os.path.join(self.tmp.name, "payloads"),
+            SNAPSHOT_ARCHIVE_ROOT=os.path.join(self.tmp.name, "archive"),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    @mock.patch("products.services.bright_data_poller.http_client.get")
+    @mock.patch("products.services.bright_data_poller.async_task")
     def test_poll_ready_status(self, mock_async_task, mock_get):
-        """测试轮询到ready状态"""
-        mock_status_response = MockResponse(
-            status_code=200,
-            json_data={"status": "ready"},
-        )
-        mock_download_response = MockResponse(
-            status_code=200,
-            json_data=[{"id": "1", "title": "Product 1"}],
-        )
-        mock_get.side_effect = [mock_status_response, mock_download_response]
+        """轮询到 ready 后交给下载任务，下载完成后保存并导入"""
+        mock_get.side_effect = [
+            MockResponse(status_code=200, json_data={"status": "ready"}),
+            MockResponse(status_code=200, json_data=[{"id": "1", "title": "Product 1"}]),
+        ]
 
         poll_bright_data_result(["test_snapshot_001"])
+        mock_async_task.assert_called_once_with(
+            "products.services.bright_data_poller.download_snapshot", "test_snapshot_001"
+        )
+        self.assertEqual(ScrapeJob.objects.get(snapshot_id="test_snapshot_001").status, "ready")
+
+        download_snapshot("test_snapshot_001")
+        func, snapshot_id, payload_key = mock_async_task.call_args.args
+        self.assertEqual(func, "products.services.bright_data_poller.import_snapshot")
+        # 任务参数只有数据文件的 key
+        self.assertIsInstance(payload_key, str)
+        self.assertEqual(load_payload(payload_key), [{"id": "1", "title": "Product 1"}])
+        job = ScrapeJob.objects.get(snapshot_id="test_snapshot_001")
+        self.assertEqual(job.status, "downloaded")
+        self.assertEqual(job.record_count, 1)
+        self.assertIsNotNone(job.ready_at)
+
+        self.assertEqual(import_snapshot(snapshot_id, payload_key), 1)
+        self.assertEqual(ScrapeJob.objects.get(snapshot_id="test_snapshot_001").status, "imported")
+        self.assertEqual(SnapshotSegment.objects.get().snapshot_id, "test_snapshot_001")
+        with self.assertRaises(FileNotFoundError):
+            load_payload(payload_key)
+
+    @mock.patch("products.services.bright_data_poller.http_client.get")
+    def test_poll_pending_statuses_do_not_create_schedules(self, mock_get):
+        """未完成的 snapshot 只更新 next_poll_at，不再为每个 snapshot 创建 Schedule"""
+        for i, remote_status in enumerate(["pending", "running", "collecting"]):
+            mock_get.return_value = MockResponse(status_code=200, json_data={"status": remote_status})
+            poll_bright_data_result([f"snap_{i}"])
+
+            job = ScrapeJob.objects.get(snapshot_id=f"snap_{i}")
+            self.assertEqual(job.status, "running")
+            self.assertEqual(job.remote_status, remote_status)
+            self.assertGreater(job.next_poll_at, timezone.now())
+
+        self.assertFalse(Schedule.objects.filter(name__startswith="poll_").exists())
+        self.assertEqual(
+            list(Schedule.objects.values_list("name", flat=True)), ["bright_data_poll_coordinator"]
+        )
+
+    @mock.patch("products.services.bright_data_poller.http_client.get")
+    def test_backoff_grows_without_progress(self, mock_get):
+        """没有进展时指数退避，有进展时回到最小间隔"""
+        job = register_snapshot("snap_backoff", "url")
+
+        delays = []
+        for records in [None, None, None, 5]:
+            mock_get.return_value = MockResponse(
+                status_code=200, json_data={"status": "running", "records": records}
+            )
+            job.refresh_from_db()
+            before = timezone.now()
+            check_snapshot(job)
+            job.refresh_from_db()
+            delays.append(round((job.next_poll_at - before).total_seconds()))
+
+        # 第一次状态从空变为 running 视为有进展
+        self.assertEqual(delays, [10, 20, 40, 10])
+
+    @mock.patch("products.services.bright_data_poller.http_client.get")
+    def test_coordinator_checks_due_and_expires_old(self, mock_get):
+        """协调任务一次检查所有到期的 snapshot，超过最大等待时间的标记为超时"""
+        mock_get.return_value = MockResponse(status_code=200, json_data={"status": "running"})
+        past = timezone.now() - timedelta(seconds=1)
+        ScrapeJob.objects.create(snapshot_id="due_1", next_poll_at=past)
+        ScrapeJob.objects.create(snapshot_id="due_2", next_poll_at=past)
+        ScrapeJob.objects.create(snapshot_id="later", next_poll_at=timezone.now() + timedelta(hours=1))
+        old = ScrapeJob.objects.create(snapshot_id="old", next_poll_at=past)
+        ScrapeJob.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=1))
+
+        checked = poll_due_snapshots()
+
+        self.assertEqual(checked, 3)
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(ScrapeJob.objects.get(snapshot_id="old").status, "expired")
+        self.assertEqual(ScrapeJob.objects.get(snapshot_id="due_1").poll_count, 1)
+
+    @override_settings(BRIGHT_DATA_DOWNLOAD_LEASE_MINUTES=30)
+    @mock.patch("products.services.bright_data_poller.http_client.get")
+    @mock.patch("products.services.bright_data_poller.async_task")
+    def test_stale_ready_and_downloaded_jobs_are_requeued(self, mock_async_task, mock_get):
+        """下载或导入任务异常退出后，超过租约时间的 snapshot 重新轮询并再次下载"""
+        mock_get.return_value = MockResponse(status_code=200, json_data={"status": "ready"})
+        now = timezone.now()
+        ScrapeJob.objects.create(snapshot_id="stale_ready", status="ready", ready_at=now - timedelta(hours=1))
+        ScrapeJob.objects.create(
+            snapshot_id="stale_downloaded", status="downloaded", downloaded_at=now - timedelta(hours=1)
+        )
+        ScrapeJob.objects.create(snapshot_id="fresh", status="downloaded", downloaded_at=now)
+
+        self.assertEqual(poll_due_snapshots(), 2)
+
+        self.assertEqual(
+            sorted(call.args[1] for call in mock_async_task.call_args_list),
+            ["stale_downloaded", "stale_ready"],
+        )
+        self.assertEqual(ScrapeJob.objects.get(snapshot_id="stale_ready").status, "ready")
+        self.assertEqual(ScrapeJob.objects.get(snapshot_id="fresh").status, "downloaded")
+
+
+class ScrapeJobTrackingTest(TestCase):
+    """测试采集任务的全流程记录和耗时统计"""
 
-        self.assertTrue(mock_async_task.called)
+    def setUp(self):
+        # 下载的数据和快照归档写入临时目录
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        overrides = override_settings(
+            TASK_PAYLOAD_ROOT=os.path.join(self.tmp.name, "payloads"),
+            SNAPSHOT_ARCHIVE_ROOT=os.path.join(self.tmp.name, "archive"),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
 
     @override_settings(
         BRIGHT_DATA_API_KEY="test_api_key",
-        BRIGHT_DATA_STATUS_URL="http://example.com/status/",
+        BRIGHT_DATA_BASE_SCRAPE_URL="http://example.com/scrape",
     )
-    @mock.patch("products.tasks.requests.get")
-    @mock.patch("products.tasks._schedule_delayed_poll")
-    def test_poll_pending_status(self, mock_schedule, mock_get):
-        """测试轮询到pending状态"""
-        mock_response = MockResponse(
-            status_code=200,
-            json_data={"status": "pending"},
-        )
-        mock_get.return_value = mock_response
-
-        poll_bright_data_result(["test_snapshot_001"])
-
-        self.assertTrue(mock_schedule.called)
+    @mock.patch("products.tasks.http_client.post")
+    def test_trigger_records_inputs_and_failures(self, mock_post):
+        """trigger 成功记录输入，失败时也留下记录"""
+        mock_post.return_value = MockResponse(status_code=200, json_data={"snapshot_id": "s_ok"})
+        trigger_bright_data_task(["https://example.com/p1", "https://example.com/p2"], "url")
+        job = ScrapeJob.objects.get(snapshot_id="s_ok")
+        self.assertEqual(job.inputs, ["https://example.com/p1", "https://example.com/p2"])
+        self.assertIsNotNone(job.triggered_at)
+
+        mock_post.side_effect = requests.exceptions.RequestException("boom")
+        trigger_bright_data_task(["https://example.com/p3"], "url")
+        failed = ScrapeJob.objects.get(status="failed")
+        self.assertIsNone(failed.snapshot_id)
+        self.assertIn("boom", failed.error)
+
+    def test_import_snapshot_records_counts(self):
+        """导入完成后记录导入数量和完成时间"""
+        ScrapeJob.objects.create(
+            snapshot_id="s_imp", status="downloaded", triggered_at=timezone.now()
+        )
+        imported = import_snapshot("s_imp", [{"id": "imp_1", "title": "导入产品"}, {"title": "无 id"}])
+
+        job = ScrapeJob.objects.get(snapshot_id="s_imp")
+        self.assertEqual(imported, 1)
+        self.assertEqual(job.status, "imported")
+        self.assertEqual(job.imported_count, 1)
+        self.assertIsNotNone(job.time_to_import)
+
+    def test_latency_stats_per_mode(self):
+        """按采集模式统计提交到导入耗时的中位数和 p95"""
+        now = timezone.now()
+        for i, seconds in enumerate([60, 120, 180, 240, 600]):
+            ScrapeJob.objects.create(
+                snapshot_id=f"lat_{i}",
+                collection_mode="url",
+                status="imported",
+                triggered_at=now - timedelta(seconds=seconds),
+                imported_at=now,
+            )
+        ScrapeJob.objects.create(collection_mode="shop", status="failed", triggered_at=now)
+
+        stats = {row["collection_mode"]: row for row in scrape_latency_stats(days=7)}
+        self.assertEqual(stats["url"]["imported"], 5)
+        self.assertEqual(stats["url"]["total"], {"median": 180.0, "p95": 600.0})
+        self.assertEqual(stats["shop"]["failed"], 1)
+        self.assertIsNone(stats["shop"]["total"]["median"])
+
+    def test_admin_changelist_shows_stats(self):
+        """admin 采集任务列表显示耗时统计"""
+        admin_user = User.objects.create_superuser("scrape_admin", "s@example.com", "pw")
+        self.client.force_login(admin_user)
+        ScrapeJob.objects.create(
+            snapshot_id="adm_1", collection_mode="keyword", triggered_at=timezone.now()
+        )
+        response = self.client.get(reverse("admin:products_scrapejob_changelist"))
+        self.assertContains(response, "keyword")
+        self.assertContains(response, "进行中 1 个")
+
+
+class ScrapeRequestCoalescingTest(TestCase):
+    """测试采集输入的规范化、去重和合并提交"""
+
+    def test_normalize_input(self):
+        """同一目标的不同写法规范化为同一个输入"""
+        url = "https://shop.tiktok.com/view/product/1729384756102938475"
+        self.assertEqual(normalize_input(f" {url}/?utm_source=x#top ", "url"), url)
+        self.assertEqual(normalize_input("SHOP.tiktok.com/view/product/1729384756102938475", "url"), url)
+        self.assertEqual(
+            normalize_input("https://shop.tiktok.com/c/toys?utm_medium=a&page=2", "category"),
+            "https://shop.tiktok.com/c/toys?page=2",
+        )
+        self.assertEqual(normalize_input("  Phone   Case ", "keyword"), "phone case")
+
+    def test_submit_skips_duplicate_queued_in_flight_and_fresh(self):
+        """重复、已排队、正在采集和产品仍新鲜的输入被跳过"""
+        ScrapeJob.objects.create(
+            snapshot_id="s_run",
+            collection_mode="url",
+            status="running",
+            inputs=["https://example.com/product/1111111111111"],
+            triggered_at=timezone.now(),
+        )
+        Product.objects.create(source_id="2222222222222", title="新鲜产品", last_scraped_at=timezone.now())
+        # 只是被编辑过 (updated_at 为当前时间)、很久没有采集的产品不算新鲜
+        Product.objects.create(
+            source_id="5555555555555",
+            title="编辑过的产品",
+            last_scraped_at=timezone.now() - timedelta(days=2),
+        )
+        submit_scrape_requests(["https://example.com/product/3333333333333"], "url")
+
+        queued, skipped = submit_scrape_requests(
+            [
+                "https://example.com/product/4444444444444",
+                "https://example.com/product/4444444444444?share=1",
+                "https://example.com/product/3333333333333",
+                "https://example.com/product/1111111111111/",
+                "https://example.com/product/2222222222222",
+                "https://example.com/product/5555555555555",
+            ],
+            "url",
+            requested_by="op1",
+        )
+        self.assertEqual(queued, 2)
+        self.assertEqual(skipped, {"duplicate": 1, "queued": 1, "in_flight": 1, "fresh": 1})
+        self.assertEqual(ScrapeRequest.objects.filter(status="skipped").count(), 3)
+        self.assertTrue(Schedule.objects.filter(name="scrape_request_flush").exists())
+
+        # force 只忽略新鲜度检查
+        queued, skipped = submit_scrape_requests(
+            ["https://example.com/product/2222222222222"], "url", force=True
+        )
+        self.assertEqual((queued, skipped), (1, {}))
+
+    @mock.patch("products.services.scrape_requests.trigger_bright_data_task")
+    def test_flush_merges_requests_from_multiple_operators(self, mock_trigger):
+        """不同 operator 的提交合并成一次 trigger，相同输入只发送一次"""
+        ScrapeRequest.objects.create(collection_mode="url", input="https://example.com/a", requested_by="op1")
+        ScrapeRequest.objects.create(collection_mode="url", input="https://example.com/b", requested_by="op1")
+        ScrapeRequest.objects.create(collection_mode="url", input="https://example.com/a", requested_by="op2")
+        ScrapeRequest.objects.create(collection_mode="keyword", input="phone case", requested_by="op2")
+
+        self.assertEqual(flush_scrape_requests(), 2)
+        calls = {c.args[1]: c for c in mock_trigger.call_args_list}
+        self.assertEqual(calls["url"].args[0], ["https://example.com/a", "https://example.com/b"])
+        self.assertEqual(len(calls["url"].kwargs["request_ids"]), 3)
+        self.assertEqual(calls["keyword"].args[0], ["phone case"])
+        self.assertFalse(ScrapeRequest.objects.filter(status="pending").exists())
+        # trigger 关联 job 之前只是认领状态
+        self.assertEqual(ScrapeRequest.objects.filter(status="claimed").count(), 4)
+
+        # 租约内已认领的输入不会重复发送
+        self.assertEqual(flush_scrape_requests(), 0)
+
+    @mock.patch("products.services.scrape_requests.trigger_bright_data_task")
+    def test_flush_requeues_orphaned_claims_after_lease(self, mock_trigger):
+        """认领后 worker 崩溃、超过租约仍没有 job 的请求重新提交，且不被当作重复输入"""
+        stale = timezone.now() - timedelta(minutes=30)
+        orphan = ScrapeRequest.objects.create(
+            collection_mode="url", input="https://example.com/a", status="claimed", submitted_at=stale
+        )
+        legacy = ScrapeRequest.objects.create(
+            collection_mode="url", input="https://example.com/b", status="submitted", submitted_at=stale
+        )
+        fresh = ScrapeRequest.objects.create(
+            collection_mode="url",
+            input="https://example.com/c",
+            status="claimed",
+            submitted_at=timezone.now(),
+        )
+
+        # 队列中的孤儿请求仍覆盖相同输入
+        queued, skipped = submit_scrape_requests(
+            ["https://example.com/a", "https://example.com/c"], "url", force=True
+        )
+        self.assertEqual((queued, skipped), (0, {"queued": 2}))
+
+        self.assertEqual(flush_scrape_requests(), 1)
+        self.assertEqual(mock_trigger.call_args.args[0], ["https://example.com/a", "https://example.com/b"])
+        self.assertEqual(set(mock_trigger.call_args.kwargs["request_ids"]), {orphan.pk, legacy.pk})
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, "claimed")
+
+    @override_settings(BRIGHT_DATA_MAX_INPUTS_PER_TRIGGER=2)
+    @mock.patch("products.services.scrape_requests.trigger_bright_data_task")
+    def test_flush_splits_by_input_limit(self, mock_trigger):
+        """超过单次 trigger 输入上限时拆分"""
+        for i in range(5):
+            ScrapeRequest.objects.create(collection_mode="shop", input=f"https://example.com/shop/{i}")
+
+        self.assertEqual(flush_scrape_requests(), 3)
+        self.assertEqual([len(c.args[0]) for c in mock_trigger.call_args_list], [2, 2, 1])
 
     @override_settings(
         BRIGHT_DATA_API_KEY="test_api_key",
-        BRIGHT_DATA_STATUS_URL="http://example.com/status/",
+        BRIGHT_DATA_BASE_SCRAPE_URL="http://example.com/scrape",
     )
-    @mock.patch("products.tasks.requests.get")
-    @mock.patch("products.tasks._schedule_delayed_poll")
-    def test_poll_running_status(self, mock_schedule, mock_get):
-        """测试轮询到running状态"""
-        mock_response = MockResponse(
-            status_code=200,
-            json_data={"status": "running"},
-        )
-        mock_get.return_value = mock_response
+    @mock.patch("products.tasks.http_client.post")
+    def test_trigger_links_requests_to_job(self, mock_post):
+        """trigger 后请求关联到生成的采集任务"""
+        mock_post.return_value = MockResponse(status_code=200, json_data={"snapshot_id": "s_merged"})
+        first = ScrapeRequest.objects.create(collection_mode="url", input="https://example.com/a")
+        second = ScrapeRequest.objects.create(collection_mode="url", input="https://example.com/a")
 
-        poll_bright_data_result(["test_snapshot_001"])
+        flush_scrape_requests()
 
-        self.assertTrue(mock_schedule.called)
+        self.assertEqual(mock_post.call_count, 1)
+        job = ScrapeJob.objects.get(snapshot_id="s_merged")
+        self.assertEqual(job.inputs, ["https://example.com/a"])
+        self.assertEqual(set(job.requests.values_list("pk", flat=True)), {first.pk, second.pk})
+        self.assertFalse(job.requests.exclude(status="submitted").exists())
 
-    @override_settings(
-        BRIGHT_DATA_API_KEY="test_api_key",
-        BRIGHT_DATA_STATUS_URL="http://example.com/status/",
-    )
-    @mock.patch("products.tasks.requests.get")
-    @mock.patch("products.tasks._schedule_delayed_poll")
-    def test_poll_collecting_status(self, mock_schedule, mock_get):
-        """测试轮询到collecting状态"""
-        mock_response = MockResponse(
-            status_code=200,
-            json_data={"status": "collecting"},
+
+class ProductRefreshSchedulerTest(TestCase):
+    """测试按优先级定期刷新产品"""
+
+    def _product(self, source_id, hours_ago, **kwargs):
+        return Product.objects.create(
+            source_id=source_id,
+            title=source_id,
+            url=f"https://example.com/product/{source_id}",
+            last_scraped_at=timezone.now() - timedelta(hours=hours_ago),
+            **kwargs,
         )
-        mock_get.return_value = mock_response
 
-        poll_bright_data_result(["test_snapshot_001"])
+    def test_importer_records_velocity_and_volatility(self):
+        """重复导入时计算日均销量增长和价格波动"""
+        import_products_from_list([{"id": "rf_imp", "title": "t", "sold": 100, "final_price": "10.00"}])
+        Product.objects.filter(source_id="rf_imp").update(
+            last_scraped_at=timezone.now() - timedelta(days=2)
+        )
+        import_products_from_list([{"id": "rf_imp", "title": "t", "sold": 300, "final_price": "12.00"}])
 
-        self.assertTrue(mock_schedule.called)
+        product = Product.objects.get(source_id="rf_imp")
+        self.assertAlmostEqual(product.sold_velocity, 100, delta=1)
+        self.assertAlmostEqual(product.price_volatility, 0.1)
+        self.assertGreater(product.last_scraped_at, timezone.now() - timedelta(minutes=1))
+
+    def test_importer_reads_previous_stats_once_per_batch(self):
+        """上一次采集的销量/价格整批读取一次；同批重复出现的产品以前一条为上一次采集"""
+        for i in range(3):
+            self._product(f"rf_batch_{i}", 48, sold=100, final_price=Decimal("10.00"))
+
+        items = [{"id": f"rf_batch_{i}", "title": "t", "sold": 300, "final_price": "10.00"} for i in range(3)]
+        items.append({"id": "rf_batch_0", "title": "t", "sold": 300, "final_price": "20.00"})
+        with CaptureQueriesContext(connection) as ctx:
+            import_products_from_list(items)
+
+        stats_queries = [q for q in ctx.captured_queries if "price_volatility" in q["sql"] and " IN (" in q["sql"]]
+        self.assertEqual(len(stats_queries), 1)
+        product = Product.objects.get(source_id="rf_batch_0")
+        self.assertAlmostEqual(product.price_volatility, 0.5)
+
+    @override_settings(PRODUCT_REFRESH_MIN_AGE_HOURS=24, PRODUCT_REFRESH_TAG_WEIGHTS={"candidate": 3.0})
+    def test_pick_orders_by_priority(self):
+        """按时间、销量增长、价格波动和标签排序，新鲜和在途的产品不参与"""
+        self._product("rf_old", 24 * 5)
+        self._product("rf_fast", 30, sold_velocity=500)
+        self._product("rf_tagged", 30, tags=["candidate"])
+        self._product("rf_plain", 30)
+        self._product("rf_fresh", 2, sold_velocity=1000)
+        busy = self._product("rf_busy", 24 * 9)
+        ScrapeJob.objects.create(
+            snapshot_id="rf_s", collection_mode="url", status="running", inputs=[busy.url]
+        )
+
+        picked = [pk for _, pk, _ in pick_refresh_candidates(10)]
+        source_ids = dict(Product.objects.values_list("pk", "source_id"))
+        order = [source_ids[pk] for pk in picked]
+        self.assertEqual(order[0], "rf_fast")
+        self.assertEqual(order[-1], "rf_plain")
+        self.assertEqual(set(order), {"rf_old", "rf_fast", "rf_tagged", "rf_plain"})
+
+    def test_run_quota_spreads_daily_budget(self):
+        self.assertEqual(run_quota(240, 0), 10)
+        self.assertEqual(run_quota(240, 235), 5)
+        self.assertEqual(run_quota(240, 240), 0)
+
+    @override_settings(PRODUCT_REFRESH_DAILY_BUDGET=48)
+    def test_schedule_refresh_respects_budget(self):
+        """每次只提交按预算分配的数量，并计入当日已用预算"""
+        for i in range(5):
+            self._product(f"rf_b{i}", 48 + i)
+
+        self.assertEqual(schedule_refresh(), 2)
+        queued = ScrapeRequest.objects.filter(requested_by=REFRESH_REQUESTER, status="pending")
+        self.assertEqual(
+            set(queued.values_list("input", flat=True)),
+            {"https://example.com/product/rf_b4", "https://example.com/product/rf_b3"},
+        )
+
+        # 已入队的产品不会再次被选中
+        self.assertEqual(schedule_refresh(), 2)
+        self.assertEqual(queued.count(), 4)
+
+    @override_settings(PRODUCT_REFRESH_DAILY_BUDGET=0)
+    def test_schedule_refresh_disabled(self):
+        self._product("rf_off", 100)
+        self.assertEqual(schedule_refresh(), 0)
 
 
 class SaveSnapshotFileTest(TestCase):
     """测试save_snapshot_file"""
 
-    @override_settings(BASE_DIR="d:\\Python\\tiktok_pm")
     def test_save_snapshot_file(self):
-        """测试保存快照文件"""
+        """测试保存快照：写入压缩归档并建立索引"""
         snapshot_id = "test_snapshot_001"
         data = [{"id": "1", "title": "Product 1"}]
 
-        save_snapshot_file(snapshot_id, data)
-
-        expected_path = os.path.join(
-            "d:\\Python\\tiktok_pm", "data", "json", f"snapshot_{snapshot_id}.json"
-        )
-        self.assertTrue(os.path.exists(expected_path))
-
-        with open(expected_path, "r", encoding="utf-8") as f:
-            saved_data = json.load(f)
-            self.assertEqual(saved_data, data)
+        with tempfile.TemporaryDirectory() as tmp, override_settings(SNAPSHOT_ARCHIVE_ROOT=tmp):
+            name = save_snapshot_file(snapshot_id, data)
 
-        os.remove(expected_path)
+            path = os.path.join(tmp, name)
+            self.assertTrue(name.endswith(f"snapshot_{snapshot_id}.ndjson.gz"))
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                self.assertEqual([json.loads(line) for line in f], data)
+            self.assertEqual(SnapshotRecord.objects.get(source_id="1").segment.snapshot_id, snapshot_id)
 
 
 # ----------------------------------------------------------------------
@@ -1410,3 +2037,1459 @@ class IntegrationTests(TestCase):
 
         product = Product.objects.get(pk=product_id)
         self.assertEqual(product.product_variations.count(), 3)
+
+
+# ----------------------------------------------------------------------
+# 9. 批量操作测试
+# ----------------------------------------------------------------------
+class BulkActionTests(TestCase):
+    """测试批量打标签 / 上下架 / 后台批量任务"""
+
+    def setUp(self):
+        self.products = [
+            Product.objects.create(source_id=f"bulk_{i:03d}", title=f"产品 {i}", tags=["hot"])
+            for i in range(5)
+        ]
+        self.ids = [p.pk for p in self.products]
+
+    def test_add_tags_does_not_call_save(self):
+        """添加标签使用 UPDATE，不调用 Product.save()"""
+        with mock.patch.object(Product, "save") as mock_save:
+            operation, affected = submit_bulk_action("add_tags", self.ids, {"tags": ["candidate"]})
+
+        self.assertIsNone(operation)
+        self.assertEqual(affected, 5)
+        self.assertFalse(mock_save.called)
+        for product in Product.objects.filter(pk__in=self.ids):
+            self.assertEqual(product.tags, ["hot", "candidate"])
+
+    def test_add_existing_tag_is_noop(self):
+        """已存在的标签不会重复添加"""
+        _, affected = submit_bulk_action("add_tags", self.ids, {"tags": ["hot"]})
+        self.assertEqual(affected, 0)
+
+    def test_remove_tags(self):
+        """移除标签"""
+        _, affected = submit_bulk_action("remove_tags", self.ids[:2], {"tags": ["hot"]})
+        self.assertEqual(affected, 2)
+        self.assertEqual(Product.objects.get(pk=self.ids[0]).tags, [])
+        self.assertEqual(Product.objects.get(pk=self.ids[2]).tags, ["hot"])
+
+    def test_set_available(self):
+        """批量下架"""
+        submit_bulk_action("set_available", self.ids, {"available": False})
+        self.assertEqual(Product.objects.filter(available=True).count(), 0)
+
+    @override_settings(BULK_ACTION_SYNC_LIMIT=2)
+    @mock.patch("products.services.bulk_actions.async_task")
+    def test_large_selection_runs_in_background(self, mock_async_task):
+        """超过同步上限时创建 BulkOperation 并转入后台执行"""
+        operation, _ = submit_bulk_action("add_tags", self.ids, {"tags": ["new"]})
+        self.assertIsNotNone(operation)
+        self.assertEqual(operation.total, 5)
+        mock_async_task.assert_called_once_with(
+            "products.services.bulk_actions.execute_bulk_operation", operation.pk
+        )
+
+        self.assertTrue(execute_bulk_operation(operation.pk))
+        operation.refresh_from_db()
+        self.assertEqual(operation.status, "success")
+        self.assertEqual(operation.processed, 5)
+        self.assertEqual(operation.affected, 5)
+
+    @mock.patch("products.services.bulk_actions.async_task")
+    def test_download_media_enqueues_tasks(self, mock_async_task):
+        """批量下载图片为每个产品投递一个后台任务"""
+        submit_bulk_action("download_media", self.ids)
+        self.assertEqual(mock_async_task.call_count, 5)
+
+    def test_admin_add_tag_action(self):
+        """Admin 列表页批量添加 Tag"""
+        ProductTagDefinition.objects.create(code="candidate", name="待发布")
+        User.objects.create_superuser(username="admin", password="admin123")
+        self.client.login(username="admin", password="admin123")
+
+        response = self.client.post(
+            reverse("admin:products_product_changelist"),
+            {"action": "add_tag_to_selected", "tag": "candidate", "_selected_action": self.ids[:3]},
+        )
+        self.assertEqual(response.status_code, 302)
+        tagged = [p for p in Product.objects.filter(pk__in=self.ids) if "candidate" in p.tags]
+        self.assertEqual(len(tagged), 3)
+
+    def test_bulk_api(self):
+        """批量操作 API"""
+        client = APIClient()
+        response = client.post(
+            reverse("product-bulk"),
+            {"ids": self.ids, "action": "add_tags", "tags": ["candidate"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["affected"], 5)
+
+    def test_bulk_api_requires_tags(self):
+        """添加标签时必须提供 tags"""
+        client = APIClient()
+        response = client.post(
+            reverse("product-bulk"), {"ids": self.ids, "action": "add_tags"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_status_api(self):
+        """查询后台批量操作进度"""
+        operation = BulkOperation.objects.create(action="add_tags", total=10, processed=5)
+        client = APIClient()
+        response = client.get(reverse("product-bulk-status", kwargs={"operation_id": operation.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["progress_percent"], 50)
+
+
+# ----------------------------------------------------------------------
+# 10. AI 内容版本测试
+# ----------------------------------------------------------------------
+class AIContentVersionTests(TestCase):
+    """测试 AI 生成记录、最新内容指针和压缩存储"""
+
+    def setUp(self):
+        self.product = Product.objects.create(source_id="ver_001", title="版本产品")
+
+    def _callback(self, model_name="gpt-4o", **output):
+        entry = {"product_id": "ver_001", "model_name": model_name}
+        entry.update(output)
+        return ingest_ai_callbacks([entry])[0]
+
+    def test_new_generation_supersedes_same_model(self):
+        """同一模型再次生成后，旧内容保留但不再是最新"""
+        self._callback(desc_zh=["v1"])
+        self._callback(desc_zh=["v2"], script_zh=["s"])
+        self._callback(model_name="gemini", desc_zh=["g"])
+
+        self.assertEqual(self.product.ai_items.count(), 4)
+        self.assertEqual(self.product.ai_generations.count(), 3)
+        latest = self.product.ai_items.filter(is_latest=True)
+        self.assertEqual(
+            sorted(latest.values_list("ai_model", "content_zh")),
+            [("gemini", "g"), ("gpt-4o", "s"), ("gpt-4o", "v2")],
+        )
+
+    def test_generation_links_job_and_duration(self):
+        """回调携带 job_id 时，记录提交到完成的耗时"""
+        job = AIAnalysisJob.objects.create(
+            product=self.product,
+            status="processing",
+            submitted_at=timezone.now() - timedelta(seconds=3),
+        )
+        result = self._callback(job_id=job.pk, prompt_version="v7", desc_zh=["x"])
+
+        generation = AIGeneration.objects.get(pk=result["generation_id"])
+        self.assertEqual(generation.job, job)
+        self.assertEqual(generation.prompt_version, "v7")
+        self.assertEqual(generation.item_count, 1)
+        self.assertGreaterEqual(generation.duration_ms, 3000)
+
+    @override_settings(AI_CONTENT_COMPRESS_MIN_BYTES=100)
+    def test_large_content_is_compressed(self):
+        """超过阈值的内容压缩存储，读取时透明解压"""
+        long_text = "很长的描述" * 200
+        self._callback(desc_zh=[long_text], desc_en=["short"])
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT content_zh, content_en FROM ai_content_items")
+            raw_zh, raw_en = cursor.fetchone()
+        self.assertTrue(raw_zh.startswith(COMPRESSED_PREFIX))
+        self.assertEqual(raw_en, "short")
+        self.assertEqual(self.product.ai_items.get().content_zh, long_text)
+
+    def test_lookups_are_not_compressed(self):
+        """查询参数不压缩：明文存储的内容可以用 exact / icontains 查到"""
+        long_text = "很长的描述" * 200
+        self._callback(desc_zh=[long_text], desc_en=["Short Text"])
+
+        with override_settings(AI_CONTENT_COMPRESS_MIN_BYTES=100):
+            items = AIContentItem.objects.filter(product=self.product)
+            self.assertTrue(items.filter(content_zh=long_text).exists())
+            self.assertTrue(items.filter(content_en__icontains="short").exists())
+
+    def test_ai_content_api_returns_latest(self):
+        """AI 内容 API 只返回最新内容，history=1 附带生成记录"""
+        self._callback(desc_zh=["v1"])
+        self._callback(desc_zh=["v2"])
+
+        client = APIClient()
+        url = reverse("product-ai-content", kwargs={"pk": self.product.pk})
+        response = client.get(url, {"history": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([i["content_zh"] for i in response.data["items"]], ["v2"])
+        self.assertEqual(len(response.data["generations"]), 2)
+
+
+# ----------------------------------------------------------------------
+# 11. 媒体下载测试
+# ----------------------------------------------------------------------
+class FakeStreamResponse:
+    """模拟 stream=True 的下载响应"""
+
+    def __init__(self, body=b"", status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i : i + chunk_size]
+
+
+class MediaDownloaderTests(TestCase):
+    """测试并行下载、稳定文件名和断点续传"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.product = Product.objects.create(
+            source_id="media_001",
+            title="图片产品",
+            desc_detail={"blocks": [{"img": "https://cdn/d1.png"}, {"img": "https://cdn/d2.gif"}]},
+        )
+        for url in ("https://cdn/a.jpg", "https://cdn/b.webp"):
+            ProductImage.objects.create(product=self.product, original_url=url)
+        self.dir = os.path.join(self.tmp.name, "media_001")
+
+    def _run(self, responses):
+        def fake_get(url, headers=None, **kwargs):
+            response = responses[url]
+            return response(headers or {}) if callable(response) else response
+
+        with override_settings(PRODUCT_MEDIA_DOWNLOAD_ROOT=self.tmp.name, MEDIA_DOWNLOAD_WORKERS=2):
+            with mock.patch("requests.Session.get", side_effect=fake_get):
+                return product_media_downloader.download_all_product_images(self.product)
+
+    def test_desc_detail_images_always_list(self):
+        """详情为空时同样返回列表"""
+        extract = product_media_downloader.extract_images_from_desc_detail
+        self.assertEqual(extract({}), [])
+        self.assertEqual(extract(None), [])
+        self.assertEqual(extract({"a": ["https://cdn/x.png", "https://cdn/x.png"]}), ["https://cdn/x.png"])
+
+    def test_failure_does_not_shift_filenames(self):
+        """文件编号由 URL 顺序决定，失败的 URL 不影响后续文件名"""
+        _, summary = self._run(
+            {
+                "https://cdn/a.jpg": FakeStreamResponse(b"a"),
+                "https://cdn/b.webp": FakeStreamResponse(status_code=500),
+                "https://cdn/d1.png": FakeStreamResponse(b"d1"),
+                "https://cdn/d2.gif": FakeStreamResponse(b"d2"),
+            }
+        )
+        self.assertEqual(summary["downloaded"], 3)
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            ["media_001_1.jpg", "media_001_3.png", "media_001_4.gif"],
+        )
+
+    def test_resume_partial_and_skip_existing(self):
+        """已下载的文件跳过，.part 文件通过 Range 请求续传"""
+        os.makedirs(self.dir)
+        with open(os.path.join(self.dir, "media_001_1.jpg"), "wb") as f:
+            f.write(b"a")
+        with open(os.path.join(self.dir, "media_001_2.webp.part"), "wb") as f:
+            f.write(b"hello ")
+
+        def ranged(headers):
+            self.assertEqual(headers.get("Range"), "bytes=6-")
+            return FakeStreamResponse(b"world", status_code=206)
+
+        _, summary = self._run(
+            {
+                "https://cdn/b.webp": ranged,
+                "https://cdn/d1.png": FakeStreamResponse(b"d1"),
+                "https://cdn/d2.gif": FakeStreamResponse(b"d2"),
+            }
+        )
+        self.assertEqual(summary["skipped"], 1)
+        self.assertEqual(summary["downloaded"], 3)
+        with open(os.path.join(self.dir, "media_001_2.webp"), "rb") as f:
+            self.assertEqual(f.read(), b"hello world")
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "media_001_2.webp.part")))
+
+    def test_concurrent_writer_uses_own_temp_file(self):
+        """另一个下载持有 .part.lock 时写入自己的临时文件，不续传也不改动对方的 .part"""
+        os.makedirs(self.dir)
+        part = os.path.join(self.dir, "media_001_1.jpg.part")
+        with open(part, "wb") as f:
+            f.write(b"half")
+        open(part + ".lock", "w").close()
+
+        def full(headers):
+            self.assertNotIn("Range", headers)
+            return FakeStreamResponse(b"whole")
+
+        with override_settings(PRODUCT_MEDIA_DOWNLOAD_ROOT=self.tmp.name):
+            with mock.patch("requests.Session.get", side_effect=lambda url, headers=None, **kw: full(headers or {})):
+                outcome = product_media_downloader.download_file("https://cdn/a.jpg", self.dir, "media_001_1.jpg")
+
+        self.assertEqual(outcome, "downloaded")
+        with open(os.path.join(self.dir, "media_001_1.jpg"), "rb") as f:
+            self.assertEqual(f.read(), b"whole")
+        with open(part, "rb") as f:
+            self.assertEqual(f.read(), b"half")
+        self.assertEqual(
+            sorted(os.listdir(self.dir)),
+            ["media_001_1.jpg", "media_001_1.jpg.part", "media_001_1.jpg.part.lock"],
+        )
+
+    def test_media_entries_prefetch_images(self):
+        """导出时图片与 SKU 按批预取，查询数不随产品数增加"""
+        for i in range(3):
+            other = Product.objects.create(source_id=f"media_00{i + 2}")
+            ProductImage.objects.create(product=other, original_url=f"https://cdn/o{i}.jpg")
+            ProductVariation.objects.create(product=other, image_original_url=f"https://cdn/v{i}.jpg")
+
+        with self.assertNumQueries(3):
+            entries = list(iter_media_entries(Product.objects.order_by("id")))
+        self.assertEqual(len(entries), 4 + 3 * 2)
+
+    @mock.patch("products.admin.async_task")
+    def test_admin_download_runs_in_background(self, mock_async_task):
+        """admin 下载按钮只提交后台任务"""
+        admin_user = User.objects.create_superuser("media_admin", "m@example.com", "pw")
+        self.client.force_login(admin_user)
+        url = reverse("admin:products_product_download-images", args=[self.product.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        mock_async_task.assert_called_once_with(
+            "products.tasks.download_product_images_task", self.product.pk
+        )
+
+    def test_media_zip_api_streams_archive(self):
+        """ZIP 导出复用本地缓存，缺失的图片下载后写入压缩包"""
+        os.makedirs(self.dir)
+        with open(os.path.join(self.dir, "media_001_1.jpg"), "wb") as f:
+            f.write(b"cached")
+
+        requested = []
+
+        def fake_get(url, headers=None, **kwargs):
+            requested.append(url)
+            if url == "https://cdn/d2.gif":
+                return FakeStreamResponse(status_code=404)
+            return FakeStreamResponse(url.encode())
+
+        client = APIClient()
+        with override_settings(PRODUCT_MEDIA_DOWNLOAD_ROOT=self.tmp.name):
+            with mock.patch("requests.Session.get", side_effect=fake_get):
+                response = client.get(reverse("product-media-zip"), {"ids": str(self.product.pk)})
+                self.assertTrue(response.streaming)
+                body = b"".join(response.streaming_content)
+
+        self.assertNotIn("https://cdn/a.jpg", requested)
+        archive = zipfile.ZipFile(BytesIO(body))
+        self.assertEqual(
+            archive.namelist(),
+            [
+                "media_001/media_001_1.jpg",
+                "media_001/media_001_2.webp",
+                "media_001/media_001_3.png",
+                "_errors.txt",
+            ],
+        )
+        self.assertEqual(archive.read("media_001/media_001_1.jpg"), b"cached")
+        self.assertEqual(archive.read("media_001/media_001_3.png"), b"https://cdn/d1.png")
+        self.assertIn("d2.gif", archive.read("_errors.txt").decode())
+
+
+# ----------------------------------------------------------------------
+# 12. 批量导出测试
+# ----------------------------------------------------------------------
+class ProductExportTests(TestCase):
+    """测试 NDJSON 流式导出"""
+
+    def setUp(self):
+        for i in range(3):
+            product = Product.objects.create(
+                source_id=f"exp_{i}", title=f"导出产品 {i}", category="toys" if i else "books"
+            )
+            ProductImage.objects.create(product=product, original_url=f"https://cdn/{i}.jpg")
+
+    def test_export_api_streams_ndjson(self):
+        """导出 API 支持列表过滤条件，每行一个产品"""
+        client = APIClient()
+        response = client.get(reverse("product-export"), {"category": "toys"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([r["id"] for r in rows], ["exp_1", "exp_2"])
+        self.assertEqual(rows[0]["images"], ["https://cdn/1.jpg"])
+
+    def test_export_query_count_is_constant(self):
+        """按批 prefetch (产品+店铺、图片、变体)，查询次数与产品数量无关"""
+        with self.assertNumQueries(3):
+            payloads = list(iter_product_payloads(Product.objects.all(), chunk_size=100))
+        self.assertEqual(len(payloads), 3)
+
+    def test_export_command_writes_file(self):
+        """管理命令写入 NDJSON 文件"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.ndjson")
+            ids = ",".join(str(pk) for pk in Product.objects.values_list("pk", flat=True)[:2])
+            call_command("export_products", "--output", path, "--ids", ids, stdout=mock.Mock())
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+
+class ProductPayloadTests(TestCase):
+    """测试 payload 构造器的预加载和缓存"""
+
+    def setUp(self):
+        store = Store.objects.create(store_id="s_payload", name="Payload Store")
+        self.products = []
+        for i in range(3):
+            product = Product.objects.create(source_id=f"pl_{i}", title=f"P{i}", store=store)
+            ProductImage.objects.create(product=product, original_url=f"https://cdn/p{i}.jpg")
+            ProductVariation.objects.create(product=product, sku=f"sku_{i}", stock=i)
+            self.products.append(product)
+
+    def test_payload_includes_store_and_variations(self):
+        payload = build_product_payload(self.products[1])
+        self.assertEqual(payload["store"], "Payload Store")
+        self.assertEqual(payload["images"], ["https://cdn/p1.jpg"])
+        self.assertEqual(payload["variations"][0]["sku"], "sku_1")
+
+    @override_settings(PRODUCT_PAYLOAD_CACHE_TIMEOUT=60)
+    def test_cache_keyed_by_updated_at(self):
+        """缓存命中时只读取 pk/updated_at；updated_at 变化后重新构造"""
+        cache.clear()
+        queryset = Product.objects.filter(source_id__startswith="pl_")
+        list(build_product_payloads(queryset))
+
+        with self.assertNumQueries(1):
+            payloads = list(build_product_payloads(queryset))
+        self.assertEqual([p["id"] for p in payloads], ["pl_0", "pl_1", "pl_2"])
+
+        Product.objects.filter(pk=self.products[0].pk).update(
+            title="changed", updated_at=timezone.now() + timedelta(seconds=5)
+        )
+        with self.assertNumQueries(4):
+            payloads = list(build_product_payloads(queryset))
+        self.assertEqual(payloads[0]["title"], "changed")
+
+
+# ----------------------------------------------------------------------
+# 13. 产品历史测试
+# ----------------------------------------------------------------------
+class ProductHistoryTests(TestCase):
+    """测试价格/销量/库存历史的写入、整理和查询"""
+
+    def setUp(self):
+        self.product = Product.objects.create(source_id="hist_1", title="历史产品")
+
+    def test_import_records_only_changes(self):
+        """导入时写入历史，数值不变时不重复写入"""
+        item = {
+            "id": "hist_imp",
+            "title": "t",
+            "final_price": "9.90",
+            "sold": 10,
+            "variations": [{"sku": "a", "stock": 3}, {"sku": "b", "stock": 4}],
+        }
+        import_products_from_list([item])
+        import_products_from_list([item])
+        import_products_from_list([{**item, "sold": 12}])
+
+        history = ProductHistory.objects.filter(product__source_id="hist_imp").order_by("ts", "pk")
+        self.assertEqual(list(history.values_list("sold", "stock")), [(10, 7), (12, 7)])
+        self.assertEqual(history.first().price, Decimal("9.90"))
+
+    def test_record_history_batches_queries(self):
+        """上一条记录一次查询读取，变化的记录一次写入"""
+        others = [Product.objects.create(source_id=f"hist_b{i}") for i in range(5)]
+        record_history([(p.pk, 1, 1, 1) for p in others])
+        with self.assertNumQueries(3):
+            written = record_history([(p.pk, 1 if i else 2, 1, 1) for i, p in enumerate(others)])
+        self.assertEqual(written, 1)
+
+    @override_settings(PRODUCT_HISTORY_RAW_DAYS=30, PRODUCT_HISTORY_RETENTION_DAYS=365)
+    def test_compact_downsamples_and_expires(self):
+        """超过原始保留期的记录每天保留最后一条，超过保留期的删除"""
+        day = (timezone.now() - timedelta(days=40)).replace(hour=0, minute=0, second=0, microsecond=0)
+        for hour, sold in ((1, 1), (5, 2), (20, 3)):
+            ProductHistory.objects.create(product=self.product, ts=day + timedelta(hours=hour), sold=sold)
+        ProductHistory.objects.create(product=self.product, ts=timezone.now() - timedelta(days=400), sold=0)
+        ProductHistory.objects.create(product=self.product, ts=timezone.now() - timedelta(days=1), sold=4)
+        ProductHistory.objects.create(product=self.product, ts=timezone.now(), sold=5)
+
+        self.assertEqual(compact_history(), {"expired": 1, "downsampled": 2})
+        self.assertEqual(
+            list(ProductHistory.objects.order_by("ts").values_list("sold", flat=True)), [3, 4, 5]
+        )
+
+    def test_series_api_returns_columns(self):
+        """历史接口按产品返回列式时间序列，interval=day 每天一个点"""
+        other = Product.objects.create(source_id="hist_2", title="另一个产品")
+        base = timezone.now().replace(hour=1, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        ProductHistory.objects.create(product=self.product, ts=base, price=Decimal("10.00"), sold=1)
+        ProductHistory.objects.create(
+            product=self.product, ts=base + timedelta(hours=2), price=Decimal("11.00"), sold=2
+        )
+        ProductHistory.objects.create(product=other, ts=base, price=Decimal("5.00"), sold=9)
+
+        series = history_series([self.product.pk, other.pk], interval="day")
+        self.assertEqual(series[self.product.pk]["price"], [11.0])
+        self.assertEqual(series[self.product.pk]["ts"], [int((base + timedelta(hours=2)).timestamp())])
+
+        response = APIClient().get(reverse("product-history"), {"ids": f"{self.product.pk},{other.pk}"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["series"]
+        self.assertEqual(data[str(self.product.pk)]["sold"], [1, 2])
+        self.assertEqual(data[str(other.pk)]["price"], [5.0])
+
+        response = APIClient().get(reverse("product-history"), {"interval": "hour"})
+        self.assertEqual(response.status_code, 400)
+
+
+# ----------------------------------------------------------------------
+# 14. 产品汇总测试
+# ----------------------------------------------------------------------
+class ProductRollupTests(TestCase):
+    """测试分类/店铺汇总的计算、增量更新和仪表盘缓存"""
+
+    def setUp(self):
+        cache.clear()
+        self.store = Store.objects.create(store_id="roll_store", name="汇总店铺")
+        for i, price in enumerate([10, 20, 30, 40]):
+            Product.objects.create(
+                source_id=f"roll_{i}",
+                category="toys",
+                store=self.store if i < 2 else None,
+                final_price=Decimal(price),
+                sold=100,
+                In_stock=i % 2 == 0,
+            )
+        Product.objects.create(source_id="roll_books", category="books", final_price=Decimal(5), sold=1)
+
+    def test_rebuild_computes_aggregates(self):
+        """全量重算：数量、总销量、价格分位数和有货比例"""
+        rebuild_rollups()
+        toys = ProductRollup.objects.get(dimension="category", key="toys")
+        self.assertEqual((toys.product_count, toys.sold_total), (4, 400))
+        self.assertEqual((toys.price_min, toys.price_median, toys.price_max), (10, 20, 40))
+        self.assertEqual(toys.in_stock_ratio, 0.5)
+
+        store = ProductRollup.objects.get(dimension="store", key=str(self.store.pk))
+        self.assertEqual((store.label, store.product_count), ("汇总店铺", 2))
+        self.assertEqual(ProductRollup.objects.get(dimension="store", key="").product_count, 3)
+
+    def test_refresh_updates_only_affected_keys(self):
+        """增量更新只重算受影响的分类"""
+        rebuild_rollups()
+        Product.objects.create(source_id="roll_new", category="books", final_price=Decimal(7), sold=9)
+        Product.objects.filter(category="toys").update(sold=0)
+
+        refresh_rollups(categories=["books"])
+        books = ProductRollup.objects.get(dimension="category", key="books")
+        self.assertEqual((books.product_count, books.sold_total), (2, 10))
+        self.assertEqual(ProductRollup.objects.get(dimension="category", key="toys").sold_total, 400)
+
+    def test_import_refreshes_rollups(self):
+        """导入后自动更新对应分类的汇总"""
+        import_products_from_list([{"id": "roll_imp", "category": "garden", "sold": 3, "final_price": "9.90"}])
+        garden = ProductRollup.objects.get(dimension="category", key="garden")
+        self.assertEqual((garden.product_count, garden.sold_total), (1, 3))
+
+    def test_dashboard_api_is_cached(self):
+        """仪表盘接口读取汇总表并缓存，汇总更新后缓存失效"""
+        rebuild_rollups()
+        client = APIClient()
+        response = client.get(reverse("product-analytics"), {"dimension": "category"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["key"] for r in response.json()["rows"]], ["toys", "books"])
+
+        # 命中缓存时只读取最近一天和版本 (汇总行的最新 updated_at)
+        with self.assertNumQueries(2):
+            analytics_summary("category")
+
+        refresh_rollups(categories=["books"])
+        with self.assertNumQueries(3):
+            analytics_summary("category")
+
+        self.assertEqual(client.get(reverse("product-analytics"), {"dimension": "x"}).status_code, 400)
+
+    def test_dashboard_cache_sees_updates_from_other_processes(self):
+        """其他进程 (qcluster) 更新汇总表后，本进程的缓存同样失效"""
+        rebuild_rollups()
+        self.assertEqual(analytics_summary("category")["totals"]["sold_total"], 401)
+
+        ProductRollup.objects.filter(dimension="category", key="books").update(
+            sold_total=50, updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        self.assertEqual(analytics_summary("category")["totals"]["sold_total"], 450)
+
+    def test_upsert_without_conflict_target(self):
+        """MySQL/MariaDB 不支持指定冲突列：不传 unique_fields，重算照常写入"""
+        with mock.patch.object(connection.features, "supports_update_conflicts_with_target", False):
+            with mock.patch.object(
+                ProductRollup.objects, "bulk_create", wraps=ProductRollup.objects.bulk_create
+            ) as mock_bulk_create:
+                rebuild_rollups()
+        self.assertIsNone(mock_bulk_create.call_args.kwargs["unique_fields"])
+        self.assertEqual(ProductRollup.objects.get(dimension="category", key="toys").sold_total, 400)
+
+    def test_admin_dashboard(self):
+        rebuild_rollups()
+        admin_user = User.objects.create_superuser("rollup_admin", "r@example.com", "pw")
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse("admin:products_productrollup_changelist"))
+        self.assertContains(response, "按分类汇总")
+        self.assertContains(response, "汇总店铺")
+
+
+class StoreMetricsTests(TestCase):
+    """测试店铺批量写入和本系统店铺统计"""
+
+    def _items(self, count, store_id="shop_1", name="店铺一"):
+        return [
+            {
+                "id": f"{store_id}_p{i}",
+                "title": f"p{i}",
+                "final_price": f"{10 * (i + 1)}.00",
+                "sold": 5,
+                "store_details": {"url": f"https://shop.example.com/store/{store_id}", "name": name},
+            }
+            for i in range(count)
+        ]
+
+    def test_import_upserts_each_store_once(self):
+        """同一批产品的店铺只写入一次，重复导入时更新店铺信息"""
+        with mock.patch.object(Store.objects, "update_or_create") as update_or_create:
+            import_products_from_list(self._items(3) + self._items(2, "shop_2", "店铺二"))
+        update_or_create.assert_not_called()
+        self.assertEqual(Store.objects.count(), 2)
+        self.assertEqual(Product.objects.filter(store__store_id="shop_1").count(), 3)
+
+        import_products_from_list(self._items(1, name="店铺一 (新)"))
+        self.assertEqual(Store.objects.get(store_id="shop_1").name, "店铺一 (新)")
+        self.assertEqual(Store.objects.count(), 2)
+
+    def test_import_upserts_stores_without_conflict_target(self):
+        """MySQL/MariaDB 不支持指定冲突列：不传 unique_fields，店铺照常写入并关联到产品"""
+        with mock.patch.object(connection.features, "supports_update_conflicts_with_target", False):
+            with mock.patch.object(Store.objects, "bulk_create", wraps=Store.objects.bulk_create) as bulk_create:
+                import_products_from_list(self._items(2))
+        self.assertIsNone(bulk_create.call_args.kwargs["unique_fields"])
+        self.assertEqual(Product.objects.filter(store__store_id="shop_1").count(), 2)
+
+    def test_store_upsert_failure_keeps_existing_links(self):
+        """店铺批量写入失败时不把产品的店铺关联覆盖为空"""
+        import_products_from_list(self._items(2))
+        with mock.patch(
+            "products.services.product_importer._upsert_stores", side_effect=DatabaseError("boom")
+        ):
+            self.assertEqual(import_products_from_list(self._items(2)), 2)
+        self.assertEqual(Product.objects.filter(store__store_id="shop_1").count(), 2)
+
+    def test_import_updates_store_metrics(self):
+        """导入后更新受影响店铺的产品数、平均价格和总销量"""
+        import_products_from_list(self._items(3))
+        store = Store.objects.get(store_id="shop_1")
+        self.assertEqual((store.tracked_products, store.tracked_sold), (3, 15))
+        self.assertEqual(store.avg_price, Decimal("20.00"))
+        self.assertIsNotNone(store.metrics_updated_at)
+
+    def test_refresh_all_stores(self):
+        """全量更新修正产品更换店铺后的旧店铺统计"""
+        import_products_from_list(self._items(2))
+        empty = Store.objects.create(store_id="shop_empty", tracked_products=9)
+        Product.objects.filter(store__store_id="shop_1").update(store=None)
+
+        with self.assertNumQueries(3):
+            self.assertEqual(refresh_store_metrics(), 2)
+        self.assertEqual(Store.objects.get(store_id="shop_1").tracked_products, 0)
+        empty.refresh_from_db()
+        self.assertEqual(empty.tracked_products, 0)
+
+    def test_admin_sorts_by_metrics(self):
+        import_products_from_list(self._items(1) + self._items(2, "shop_2", "店铺二"))
+        admin_user = User.objects.create_superuser("store_admin", "st@example.com", "pw")
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse("admin:products_store_changelist"), {"o": "-10"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [s.store_id for s in response.context["cl"].result_list], ["shop_2", "shop_1"]
+        )
+
+
+# ----------------------------------------------------------------------
+# 15. 原始数据存储测试
+# ----------------------------------------------------------------------
+class RawPayloadTests(TestCase):
+    """测试原始记录的压缩、去重、按需加载和回填"""
+
+    def test_import_stores_payload_off_row(self):
+        """导入时原始记录写入压缩表，产品行不再保存 raw_json / input"""
+        item = {"id": "raw_1", "title": "t" * 2000, "input": {"url": "https://example.com/p/1"}}
+        import_products_from_list([item])
+
+        product = Product.objects.get(source_id="raw_1")
+        self.assertIsNone(product.raw_json)
+        self.assertIsNone(product.input)
+        self.assertEqual(product.get_raw_json()["title"], item["title"])
+        self.assertEqual(product.get_input(), {"url": "https://example.com/p/1"})
+
+        payload = ProductRawPayload.objects.get()
+        self.assertLess(len(bytes(payload.data)), payload.size)
+
+        # 内容相同的记录只保存一份
+        import_products_from_list([item])
+        self.assertEqual(ProductRawPayload.objects.count(), 1)
+
+    def test_backfill_command_moves_legacy_columns(self):
+        """回填命令分批移动旧数据，内容相同的产品共用一条记录"""
+        for i in range(5):
+            Product.objects.create(
+                source_id=f"raw_old_{i}",
+                raw_json={"id": "same", "title": "legacy"},
+                input={"url": f"https://example.com/{i}"} if i == 0 else None,
+            )
+        Product.objects.create(source_id="raw_none")
+
+        call_command("migrate_raw_payloads", "--chunk-size", "2", stdout=mock.Mock())
+
+        self.assertFalse(Product.objects.filter(raw_json__isnull=False).exists())
+        self.assertFalse(Product.objects.filter(input__isnull=False).exists())
+        self.assertEqual(ProductRawPayload.objects.count(), 2)
+        first = Product.objects.get(source_id="raw_old_0")
+        self.assertEqual(first.get_input(), {"url": "https://example.com/0"})
+        self.assertEqual(Product.objects.get(source_id="raw_old_3").get_raw_json()["title"], "legacy")
+        self.assertIsNone(Product.objects.get(source_id="raw_none").get_raw_json())
+
+    def test_reimport_deletes_replaced_payload(self):
+        """重新导入后旧原始记录没有其他产品引用时删除，仍被共用的保留"""
+        import_products_from_list([{"id": "raw_p", "title": "v1"}])
+        shared = ProductRawPayload.objects.get()
+        Product.objects.create(source_id="raw_shared", raw_payload=shared)
+
+        import_products_from_list([{"id": "raw_p", "title": "v2"}])
+        self.assertEqual(ProductRawPayload.objects.count(), 2)
+
+        # 同一批中重复出现的产品，中间版本也不会遗留
+        import_products_from_list([{"id": "raw_p", "title": "v3"}, {"id": "raw_p", "title": "v4"}])
+        self.assertEqual(ProductRawPayload.objects.count(), 2)
+        self.assertTrue(ProductRawPayload.objects.filter(pk=shared.pk).exists())
+        self.assertEqual(Product.objects.get(source_id="raw_p").get_raw_json()["title"], "v4")
+
+    def test_purge_orphans(self):
+        import_products_from_list([{"id": "raw_p", "title": "v1"}])
+        store_raw_payloads({"orphan": {"id": "raw_orphan"}})
+        self.assertEqual(ProductRawPayload.objects.count(), 2)
+
+        call_command("migrate_raw_payloads", "--purge-orphans", stdout=mock.Mock())
+        self.assertEqual(ProductRawPayload.objects.count(), 1)
+        self.assertEqual(Product.objects.get(source_id="raw_p").get_raw_json()["title"], "v1")
+
+
+# ----------------------------------------------------------------------
+# 16. 快照归档测试
+# ----------------------------------------------------------------------
+class SnapshotArchiveTests(TestCase):
+    """测试快照归档的写入、按索引读取和回放"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        overrides = override_settings(SNAPSHOT_ARCHIVE_ROOT=self.tmp.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def _records(self, count, title="v1"):
+        return [{"id": f"arc_{i}", "title": f"{title}-{i}", "sold": i} for i in range(count)]
+
+    def test_segment_is_block_compressed_and_indexed(self):
+        """每个 gzip 块可以单独读取，整个文件也可以顺序读取"""
+        segment = write_segment("s_blocks", self._records(10), block_records=4)
+        self.assertEqual(segment.record_count, 10)
+
+        offsets = set(SnapshotRecord.objects.values_list("offset", flat=True))
+        self.assertEqual(len(offsets), 3)
+        with gzip.open(os.path.join(self.tmp.name, segment.name), "rt", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 10)
+
+        history = archived_records("arc_9")
+        self.assertEqual(history[0]["record"]["title"], "v1-9")
+        self.assertEqual(history[0]["snapshot_id"], "s_blocks")
+
+    def test_rewrite_snapshot_replaces_index(self):
+        write_segment("s_again", self._records(3))
+        write_segment("s_again", self._records(2, "v2"))
+        self.assertEqual(SnapshotSegment.objects.filter(snapshot_id="s_again").count(), 1)
+        self.assertEqual(SnapshotRecord.objects.count(), 2)
+
+    def test_rewritten_old_snapshot_is_not_latest(self):
+        """重写旧 snapshot 后索引主键变大，但最新记录仍按归档时间判断"""
+        write_segment("s_first", self._records(2))
+        SnapshotSegment.objects.filter(snapshot_id="s_first").update(
+            created_at=timezone.now() - timedelta(days=40)
+        )
+        write_segment("s_second", self._records(2, "v2"))
+
+        # 上个月的归档重写后文件名不同，仍保留原来的归档时间
+        with mock.patch(
+            "products.services.snapshot_archive.timezone.now",
+            return_value=timezone.now() + timedelta(days=40),
+        ):
+            write_segment("s_first", self._records(2, "v3"))
+        first = SnapshotSegment.objects.get(snapshot_id="s_first")
+        self.assertLess(first.created_at, timezone.now() - timedelta(days=30))
+
+        latest = {e.source_id: e.segment.snapshot_id for e in latest_entries()}
+        self.assertEqual(latest, {"arc_0": "s_second", "arc_1": "s_second"})
+        self.assertEqual(archived_records("arc_1")[0]["record"]["title"], "v2-1")
+
+    def test_raw_history_api(self):
+        """原始记录接口按索引返回产品的历次记录，新的在前"""
+        write_segment("s_old", self._records(2))
+        write_segment("s_new", self._records(2, "v2"))
+        product = Product.objects.create(source_id="arc_1", title="x")
+
+        response = APIClient().get(reverse("product-raw-history", args=[product.pk]))
+        self.assertEqual(response.status_code, 200)
+        records = response.json()["records"]
+        self.assertEqual([r["snapshot_id"] for r in records], ["s_new", "s_old"])
+        self.assertEqual(records[0]["record"]["title"], "v2-1")
+
+    def test_replay_imports_latest_record(self):
+        """回放命令每个产品只导入最新的记录，可以只回放指定产品"""
+        write_segment("s_r1", self._records(3))
+        write_segment("s_r2", self._records(2, "v2"), block_records=1)
+
+        call_command(
+            "replay_snapshots", "--source-ids", "arc_1,arc_2", "--workers", "1", stdout=mock.Mock()
+        )
+        self.assertEqual(
+            dict(Product.objects.values_list("source_id", "title")), {"arc_1": "v2-1", "arc_2": "v1-2"}
+        )
+
+        call_command("replay_snapshots", "--workers", "1", stdout=mock.Mock())
+        self.assertEqual(Product.objects.get(source_id="arc_0").title, "v2-0")
+
+    def test_import_json_data_archives_files(self):
+        """import_json_data 导入后把文件写入归档并删除源文件"""
+        json_dir = os.path.join(self.tmp.name, "media", "temp_json")
+        os.makedirs(json_dir)
+        path = os.path.join(json_dir, "batch_1.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self._records(2), f)
+
+        with override_settings(MEDIA_ROOT=os.path.join(self.tmp.name, "media")):
+            call_command("import_json_data", stdout=mock.Mock())
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(SnapshotSegment.objects.get().snapshot_id, "batch_1")
+        self.assertEqual(Product.objects.count(), 2)
+
+
+# ----------------------------------------------------------------------
+# 17. 外部 HTTP 客户端测试
+# ----------------------------------------------------------------------
+@override_settings(HTTP_CIRCUIT_FAILURE_THRESHOLD=2, HTTP_CIRCUIT_RESET_SECONDS=60)
+class HttpClientTests(TestCase):
+    """测试共享客户端的连接池配置、熔断和统计"""
+
+    def setUp(self):
+        http_client.reset_clients()
+        self.addCleanup(http_client.reset_clients)
+
+    def test_clients_are_shared_and_configured_per_service(self):
+        client = http_client.get_client("bright_data")
+        self.assertIs(http_client.get_client("bright_data"), client)
+
+        retry = client.session.get_adapter("https://api.brightdata.com").max_retries
+        self.assertEqual(retry.total, 3)
+        self.assertNotIn("POST", retry.allowed_methods)
+        n8n = http_client.get_client("n8n")
+        self.assertEqual(n8n.config["timeout"], (10, 30))
+        self.assertEqual(n8n.session.get_adapter("https://n8n.example.com").max_retries.total, 0)
+        with self.assertRaises(ValueError):
+            http_client.get_client("unknown")
+
+    @override_settings(HTTP_CLIENT_SERVICES={"n8n": {"timeout": (1, 2)}})
+    def test_settings_override_and_default_timeout(self):
+        with mock.patch("requests.Session.post", return_value=MockResponse(200, {})) as mock_post:
+            http_client.post("n8n", "http://example.com/hook", json={})
+        self.assertEqual(mock_post.call_args.kwargs["timeout"], (1, 2))
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        """连续失败达到阈值后熔断，不再发出请求；到期后放行一个试探请求"""
+        with mock.patch("requests.Session.get", return_value=MockResponse(503, {})) as mock_get:
+            for _ in range(2):
+                http_client.get("zipline", "http://example.com/a")
+            with self.assertRaises(http_client.CircuitOpenError):
+                http_client.get("zipline", "http://example.com/a")
+        self.assertEqual(mock_get.call_count, 2)
+
+        client = http_client.get_client("zipline")
+        self.assertEqual(client.breaker.state, "open")
+        client.breaker.opened_at -= 60
+        with mock.patch("requests.Session.get", return_value=MockResponse(200, {})):
+            http_client.get("zipline", "http://example.com/a")
+        self.assertEqual(client.breaker.state, "closed")
+
+    def test_metrics_record_statuses_errors_and_latency(self):
+        with mock.patch("requests.Session.get", return_value=MockResponse(200, {})):
+            http_client.get("tiktok_cdn", "http://cdn/a.jpg")
+        with mock.patch("requests.Session.get", side_effect=requests.exceptions.ReadTimeout("slow")):
+            with self.assertRaises(requests.exceptions.RequestException):
+                http_client.get("tiktok_cdn", "http://cdn/b.jpg")
+
+        stats = http_client.service_stats()["tiktok_cdn"]
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["statuses"], {"2xx": 1})
+        self.assertEqual(stats["errors"], {"timeout": 1})
+        self.assertEqual(stats["latency_buckets"]["+Inf"], 2)
+        self.assertEqual(stats["circuit"], "closed")
+
+
+# ----------------------------------------------------------------------
+# 18. 跨进程限速测试
+# ----------------------------------------------------------------------
+@override_settings(HTTP_RATE_LIMITS={"zipline": {"rate": 2, "burst": 3}, "n8n": {"rate": 0}})
+class RateLimiterTests(TestCase):
+    """测试数据库令牌桶的取令牌、补充和等待"""
+
+    def setUp(self):
+        http_client.reset_clients()
+        self.addCleanup(http_client.reset_clients)
+
+    def _age_bucket(self, key, seconds):
+        RateLimitBucket.objects.filter(key=key).update(refilled_at=F("refilled_at") - seconds)
+
+    def test_burst_then_refill(self):
+        """桶满时可以连续取 burst 个，之后按速率补充"""
+        results = [rate_limiter.try_acquire("zipline", "z.example.com") for _ in range(4)]
+        self.assertEqual([ok for ok, _ in results], [True, True, True, False])
+        self.assertAlmostEqual(results[-1][1], 0.5, delta=0.05)
+
+        self._age_bucket("zipline:z.example.com", 1)
+        self.assertTrue(rate_limiter.try_acquire("zipline", "z.example.com")[0])
+        # 不同主机使用各自的桶
+        self.assertTrue(rate_limiter.try_acquire("zipline", "other.example.com")[0])
+        self.assertEqual(RateLimitBucket.objects.count(), 2)
+
+    @override_settings(HTTP_RATE_LIMITS={"tiktok_cdn": {"rate": 20, "burst": 40, "block": 10}})
+    def test_block_service_takes_tokens_in_blocks(self):
+        """配置 block 的服务一次取 block 个令牌，进程内逐个发放，不是每个请求都锁定令牌桶"""
+        with mock.patch.object(rate_limiter, "_take", wraps=rate_limiter._take) as take:
+            for _ in range(25):
+                self.assertTrue(rate_limiter.try_acquire("tiktok_cdn", "cdn.example.com")[0])
+        self.assertEqual(take.call_count, 3)
+        bucket = RateLimitBucket.objects.get(key="tiktok_cdn:cdn.example.com")
+        self.assertLess(bucket.tokens, 11)
+
+        # 预留的令牌不跨主机使用
+        rate_limiter.try_acquire("tiktok_cdn", "other.example.com")
+        self.assertEqual(RateLimitBucket.objects.count(), 2)
+
+    def test_unlimited_service(self):
+        for _ in range(10):
+            self.assertEqual(rate_limiter.try_acquire("n8n", "n8n.example.com"), (True, 0.0))
+        self.assertFalse(RateLimitBucket.objects.exists())
+
+    @mock.patch("products.services.rate_limiter.time.sleep")
+    def test_blocking_acquire_waits_or_times_out(self, mock_sleep):
+        for _ in range(3):
+            rate_limiter.acquire("zipline", "z.example.com")
+
+        def refill(seconds):
+            self._age_bucket("zipline:z.example.com", seconds)
+
+        mock_sleep.side_effect = refill
+        rate_limiter.acquire("zipline", "z.example.com", timeout=5)
+        self.assertAlmostEqual(mock_sleep.call_args.args[0], 0.5, delta=0.05)
+
+        with self.assertRaises(rate_limiter.RateLimitTimeout):
+            rate_limiter.acquire("zipline", "z.example.com", timeout=0)
+
+    def test_http_client_non_blocking_request(self):
+        """rate_limit_wait=0 时没有令牌直接失败，不发出请求"""
+        with mock.patch("requests.Session.get", return_value=MockResponse(200, {})) as mock_get:
+            for _ in range(3):
+                http_client.get("zipline", "https://z.example.com/a")
+            with self.assertRaises(requests.exceptions.RequestException):
+                http_client.get("zipline", "https://z.example.com/a", rate_limit_wait=0)
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(http_client.service_stats()["zipline"]["errors"], {"rate_limited": 1})
+
+    def test_no_bucket_lock_inside_caller_transaction(self):
+        """在调用方的事务中不锁定令牌桶 (行锁会持有到外层事务提交)，放行并记录警告"""
+        with transaction.atomic():
+            with self.assertLogs("products.services.rate_limiter", "WARNING"):
+                self.assertEqual(rate_limiter.try_acquire("zipline", "z.example.com"), (True, 0.0))
+        self.assertFalse(RateLimitBucket.objects.exists())
+
+    @override_settings(IMAGE_DOWNLOAD_FLAG=True)
+    def test_importer_fetches_media_outside_product_transaction(self):
+        """导入时媒体下载/上传在产品事务之外执行，相同 URL 只处理一次"""
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def fake_process(url, download_flag):
+            depths.append(len(connection.atomic_blocks))
+            return f"https://zipline/{url.rsplit('/', 1)[-1]}"
+
+        item = {
+            "id": "media_tx",
+            "images": ["https://cdn/a.jpg", "https://cdn/b.jpg"],
+            "variations": [{"sku": "s1", "image": "https://cdn/a.jpg"}],
+        }
+        with mock.patch("products.services.product_importer.process_media_url", side_effect=fake_process):
+            import_products_from_list([item])
+
+        self.assertEqual(depths, [depth, depth])
+        product = Product.objects.get(source_id="media_tx")
+        self.assertEqual(product.product_variations.get().image_zipline_url, "https://zipline/a.jpg")
+
+
+# ----------------------------------------------------------------------
+# 19. 任务队列路由测试
+# ----------------------------------------------------------------------
+class TaskQueueRoutingTests(TestCase):
+    """测试任务和定时任务按负载类型进入命名队列"""
+
+    def test_default_queue_when_disabled(self):
+        with override_settings(TASK_QUEUES_ENABLED=False):
+            self.assertEqual(queue_options("poll"), {})
+            setup_product_schedules()
+        self.assertFalse(Schedule.objects.exclude(cluster=None).exists())
+
+    @override_settings(TASK_QUEUES_ENABLED=True)
+    def test_schedules_routed_to_named_clusters(self):
+        """定时任务由对应队列的 qcluster 调度执行，重复执行时更新已有任务的队列"""
+        Schedule.objects.create(func="x", name="bright_data_poll_coordinator", schedule_type=Schedule.MINUTES)
+        setup_product_schedules()
+        clusters = dict(Schedule.objects.values_list("name", "cluster"))
+        self.assertEqual(clusters["bright_data_poll_coordinator"], "poll")
+        self.assertEqual(clusters["product_rollup_rebuild"], "import")
+        self.assertEqual(clusters["ai_analysis_job_maintenance"], "ai")
+        self.assertEqual(queue_options("unknown"), {})
+
+    @override_settings(TASK_QUEUES_ENABLED=True)
+    @mock.patch("products.services.bright_data_poller.async_task")
+    @mock.patch("products.services.ai_jobs.async_task")
+    def test_async_tasks_routed_at_call_sites(self, ai_async_task, poller_async_task):
+        product = Product.objects.create(source_id="queue_1", title="q")
+        enqueue_analysis([product.pk])
+        self.assertEqual(ai_async_task.call_args.kwargs, {"cluster": "ai"})
+
+        job = register_snapshot("snap_queue", "url")
+        with mock.patch(
+            "products.services.bright_data_poller.http_client.get",
+            return_value=MockResponse(200, {"status": "ready"}),
+        ):
+            check_snapshot(job)
+        self.assertEqual(poller_async_task.call_args.kwargs, {"cluster": "import"})
+
+    def test_alt_cluster_settings(self):
+        from django.conf import settings
+
+        self.assertEqual(set(settings.Q_CLUSTER["ALT_CLUSTERS"]), {"poll", "import", "media", "sync", "ai"})
+        for conf in settings.Q_CLUSTER["ALT_CLUSTERS"].values():
+            self.assertGreater(conf["retry"], conf["timeout"])
+
+
+# ----------------------------------------------------------------------
+# 20. 任务大参数与任务历史清理测试
+# ----------------------------------------------------------------------
+class TaskPayloadTests(TestCase):
+    """测试大参数引用文件的读写、过期清理和任务历史清理"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        overrides = override_settings(TASK_PAYLOAD_ROOT=self.tmp.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_store_load_release(self):
+        key = store_payload([{"id": "1", "title": "大数据"}], prefix="snapshot_s1")
+        self.assertTrue(key.startswith("snapshot_s1_"))
+        self.assertEqual(load_payload(key), [{"id": "1", "title": "大数据"}])
+        self.assertTrue(release_payload(key))
+        self.assertFalse(release_payload(key))
+
+    def test_failed_import_keeps_payload(self):
+        """导入失败时保留数据文件，供重试"""
+        ScrapeJob.objects.create(snapshot_id="s_fail", status="downloaded")
+        key = store_payload([{"id": "f1"}])
+        with mock.patch(
+            "products.services.bright_data_poller.import_products_from_list", side_effect=RuntimeError("db down")
+        ), mock.patch("products.services.bright_data_poller.write_segment"):
+            self.assertFalse(import_snapshot("s_fail", key))
+        self.assertEqual(load_payload(key), [{"id": "f1"}])
+        self.assertEqual(ScrapeJob.objects.get(snapshot_id="s_fail").status, "failed")
+
+    @override_settings(TASK_PAYLOAD_RETENTION_HOURS=1, TASK_HISTORY_RETENTION_DAYS=7, TASK_HISTORY_MAX_BYTES=1000)
+    def test_cleanup_task_storage(self):
+        """过期的数据文件和任务历史被删除，超大的任务记录清空参数和结果"""
+        stale = store_payload([1])
+        fresh = store_payload([2])
+        old_time = time.time() - 2 * 3600
+        os.utime(os.path.join(self.tmp.name, stale + ".json.gz"), (old_time, old_time))
+
+        now = timezone.now()
+
+        def task(name, stopped, args):
+            return Task.objects.create(
+                id=name, name=name, func="f", args=args, started=stopped, stopped=stopped, success=True
+            )
+
+        task("old", now - timedelta(days=8), ("x",))
+        task("big", now, (["x" * 2000],))
+        task("small", now, ("x",))
+
+        result = cleanup_task_storage()
+
+        self.assertEqual(result, {"deleted": 1, "trimmed": 1, "payloads": 1, "task_runs": 0})
+        self.assertEqual(load_payload(fresh), [2])
+        self.assertIsNone(Task.objects.get(id="big").args)
+        self.assertEqual(Task.objects.get(id="small").args, ("x",))
+
+
+# ----------------------------------------------------------------------
+# 21. 任务执行指标测试
+# ----------------------------------------------------------------------
+@override_settings(TASK_METRICS_CACHE_SECONDS=0)
+class TaskMetricsTests(TestCase):
+    """测试任务执行记录、按函数汇总、队列积压和指标接口"""
+
+    def _run(self, func, success=True, duration=1.0, lag=0.5, ago=timedelta(minutes=1)):
+        stopped_at = timezone.now() - ago
+        started_at = stopped_at - timedelta(seconds=duration)
+        return TaskRun.objects.create(
+            task_id="t",
+            func=func,
+            queue="default",
+            enqueued_at=started_at - timedelta(seconds=lag),
+            started_at=started_at,
+            stopped_at=stopped_at,
+            success=success,
+            duration=duration,
+            lag=lag,
+        )
+
+    def test_signals_record_run(self):
+        """pre_execute 记录开始执行时间，post_execute 写入执行记录 (耗时和排队等待分开计算)"""
+        now = timezone.now()
+        task = {"id": "abc", "func": "products.tasks.trigger", "started": now - timedelta(seconds=10), "success": True}
+        pre_execute.send(sender="test", func=task["func"], task=task)
+        task["_exec_started"] = now - timedelta(seconds=4)
+        task["stopped"] = now
+        post_execute.send(sender="test", task=task)
+
+        run = TaskRun.objects.get()
+        self.assertEqual(run.func, "products.tasks.trigger")
+        self.assertTrue(run.success)
+        self.assertAlmostEqual(run.duration, 4, places=3)
+        self.assertAlmostEqual(run.lag, 6, places=3)
+
+    def test_record_failure_does_not_raise(self):
+        post_execute.send(sender="test", task={"id": "x"})
+        self.assertFalse(TaskRun.objects.exists())
+
+    def test_task_metrics_by_function(self):
+        for i in range(1, 21):
+            self._run("products.tasks.a", success=i != 20, duration=float(i))
+        self._run("products.tasks.b", success=False, lag=30)
+        self._run("products.tasks.old", ago=timedelta(hours=2))
+
+        metrics = task_metrics("1h")
+
+        self.assertEqual(metrics["totals"], {"runs": 21, "failures": 2, "failure_rate": round(2 / 21, 4)})
+        self.assertEqual([f["func"] for f in metrics["functions"]], ["products.tasks.a", "products.tasks.b"])
+        a = metrics["functions"][0]
+        self.assertEqual(a["failure_rate"], 0.05)
+        self.assertEqual(a["duration"]["max"], 20)
+        self.assertGreater(a["duration"]["p95"], a["duration"]["p50"])
+        self.assertEqual(metrics["functions"][1]["lag"]["max"], 30)
+        self.assertEqual(task_metrics("24h")["totals"]["runs"], 22)
+        with self.assertRaises(ValueError):
+            task_metrics("1y")
+
+    @override_settings(TASK_METRICS_CACHE_SECONDS=30)
+    def test_task_metrics_cached(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self._run("products.tasks.a")
+        task_metrics("15m")
+        self._run("products.tasks.a")
+        with self.assertNumQueries(0):
+            self.assertEqual(task_metrics("15m")["totals"]["runs"], 1)
+
+    def test_queue_depths(self):
+        enqueued = timezone.now() - timedelta(seconds=120)
+        for key in ("import", "import", "media"):
+            OrmQ.objects.create(
+                key=key, payload=SignedPackage.dumps({"id": "x", "func": "f", "started": enqueued}), lock=None
+            )
+
+        depths = {q["queue"]: q for q in queue_depths()}
+
+        self.assertEqual(depths["import"]["depth"], 2)
+        self.assertEqual(depths["media"]["depth"], 1)
+        self.assertGreaterEqual(depths["import"]["oldest_age_seconds"], 120)
+
+    @override_settings(TASK_METRICS_RETENTION_DAYS=7)
+    def test_purge_task_runs(self):
+        self._run("products.tasks.a", ago=timedelta(days=8))
+        self._run("products.tasks.a")
+        self.assertEqual(purge_task_runs(), 1)
+        self.assertEqual(TaskRun.objects.count(), 1)
+
+    def test_metrics_endpoint(self):
+        self._run('products.tasks."quoted"', success=False)
+        url = reverse("task_metrics")
+
+        data = self.client.get(url, {"window": "15m"}).json()
+        self.assertEqual(data["window"], "15m")
+        self.assertEqual(data["totals"]["failures"], 1)
+
+        response = self.client.get(url, {"format": "prometheus"})
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn('tiktok_task_runs{func="products.tasks.\\"quoted\\"",status="failure",window="1h"} 1', body)
+        self.assertIn('tiktok_task_duration_seconds{func="products.tasks.\\"quoted\\"",quantile="0.95"', body)
+        self.assertEqual(body, prometheus_text(task_metrics("1h")))
+
+        self.assertEqual(self.client.get(url, {"window": "1y"}).status_code, 400)
+
+    def test_admin_dashboard(self):
+        self._run("products.tasks.dashboard_task")
+        admin_user = User.objects.create_superuser("task_admin", "t@example.com", "pw")
+        self.client.force_login(admin_user)
+        response = self.client.get(reverse("admin:products_taskrun_changelist"), {"window": "24h"})
+        self.assertContains(response, "任务指标")
+        self.assertContains(response, "products.tasks.dashboard_task")
+        self.assertContains(response, "<strong>24h</strong>", html=False)
+
+
+# ----------------------------------------------------------------------
+# 22. Prometheus 指标测试
+# ----------------------------------------------------------------------
+class MetricsRegistryTests(TestCase):
+    """测试指标注册表、多进程文件汇总、归档合并和 /metrics 端点"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.registry = metrics.Registry()
+
+    def _other_process(self, name, value, age=0):
+        """模拟另一个进程写入的指标文件"""
+        path = os.path.join(self.tmp.name, name)
+        metrics._write_json(
+            path,
+            {
+                "metrics": {
+                    "test_jobs_total": {
+                        "type": "counter",
+                        "help": "Jobs.",
+                        "labels": ["kind"],
+                        "samples": [[["a"], value]],
+                    }
+                }
+            },
+        )
+        if age:
+            old = time.time() - age
+            os.utime(path, (old, old))
+        return path
+
+    def test_render_counter_and_histogram(self):
+        jobs = self.registry.counter("test_jobs_total", "Jobs.", ("kind",))
+        latency = self.registry.histogram("test_latency_seconds", "Latency.", ("view",), buckets=(0.1, 1))
+        jobs.inc(kind='say "hi"')
+        jobs.inc(2, kind='say "hi"')
+        for value in (0.05, 0.5, 3):
+            latency.observe(value, view="home")
+
+        text = self.registry.render()
+
+        self.assertIn('test_jobs_total{kind="say \\"hi\\""} 3', text)
+        self.assertIn('test_latency_seconds_bucket{view="home",le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{view="home",le="1"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{view="home",le="+Inf"} 3', text)
+        self.assertIn('test_latency_seconds_count{view="home"} 3', text)
+        self.assertIn('test_latency_seconds_sum{view="home"} 3.55', text)
+        self.assertIn("# TYPE test_latency_seconds histogram", text)
+
+        with self.assertRaises(ValueError):
+            jobs.inc(other="x")
+        with self.assertRaises(ValueError):
+            self.registry.histogram("test_jobs_total", "Jobs.", ("kind",))
+        self.assertIs(self.registry.counter("test_jobs_total", "Jobs.", ("kind",)), jobs)
+
+    def test_fork_resets_inherited_values(self):
+        jobs = self.registry.counter("test_jobs_total", "Jobs.", ("kind",))
+        jobs.inc(5, kind="a")
+        self.registry._pid = -1  # 模拟 fork 后的子进程
+        jobs.inc(kind="a")
+        self.assertEqual(self.registry.dump()["test_jobs_total"]["samples"], [[["a"], 1]])
+
+    def test_collect_sums_process_files(self):
+        with override_settings(METRICS_DIR=self.tmp.name):
+            self.registry.counter("test_jobs_total", "Jobs.", ("kind",)).inc(kind="a")
+            self._other_process("other_1_x.json", 10)
+            self._other_process("other_2_x.json", 5)
+
+            text = self.registry.render()
+
+            self.assertIn('test_jobs_total{kind="a"} 16', text)
+            self.assertTrue(os.path.exists(self.registry.process_file()))
+
+    def test_compact_metrics(self):
+        with override_settings(METRICS_DIR=self.tmp.name, METRICS_STALE_SECONDS=60):
+            self.registry.counter("test_jobs_total", "Jobs.", ("kind",)).inc(kind="a")
+            dead = self._other_process("other_1_x.json", 10, age=120)
+            self._other_process("other_2_x.json", 5)
+
+            self.assertEqual(metrics.compact_metrics(), 1)
+            self.assertFalse(os.path.exists(dead))
+            self.assertIn('test_jobs_total{kind="a"} 16', self.registry.render())
+
+            # 归档已写入、文件还未删除时读取：已合并的文件不重复计数
+            self._other_process("other_1_x.json", 10)
+            self.assertIn('test_jobs_total{kind="a"} 16', self.registry.render())
+
+            # 下一次合并覆盖归档，累计值不变
+            self._other_process("other_3_x.json", 1, age=120)
+            os.remove(dead)
+            self.assertEqual(metrics.compact_metrics(), 1)
+            self.assertIn('test_jobs_total{kind="a"} 17', self.registry.render())
+
+    def test_metrics_endpoint(self):
+        """请求耗时 / 查询数按视图统计，队列积压在抓取时查询"""
+        self.client.get(reverse("product-list"))
+        OrmQ.objects.create(
+            key="import", payload=SignedPackage.dumps({"id": "x", "func": "f", "started": timezone.now()}), lock=None
+        )
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertRegex(text, r'tiktok_http_request_duration_seconds_count\{view="product-list",method="GET",status="2xx"\} \d+')
+        self.assertIn('tiktok_http_request_queries_bucket{view="product-list",le="0"}', text)
+        self.assertIn('tiktok_task_queue_depth{queue="import"} 1', text)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_metrics_endpoint_requires_token(self):
+        """设置了 METRICS_TOKEN 时匿名请求返回 401，且不执行队列积压查询"""
+        with mock.patch.object(metrics.registry, "render") as render:
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+            response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(response.status_code, 401)
+            render.assert_not_called()
+
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+
+    def _value(self, metric, *labels):
+        return dict((tuple(k), v) for k, v in metric.samples()).get(labels, 0)
+
+    def test_import_and_sync_counters(self):
+        imported = IMPORTED_PRODUCTS
+        before = self._value(imported, "imported")
+        import_products_from_list([{"id": "metrics_p1", "title": "指标测试"}])
+        self.assertEqual(self._value(imported, "imported"), before + 1)
+
+        rows_before = self._value(SYNC_ROWS, "products", "REMOTE_TO_LOCAL")
+        db = mock.Mock()
+        db.table_exists.return_value = True
+        with mock.patch.object(SyncManager, "_full_sync", return_value=7), mock.patch(
+            "tiktok_pm_project.db_sync.config.SyncConfig._load_table_configs"
+        ):
+            SyncManager()._sync_table_direction("products", mock.Mock(), SyncType.FULL, db, db, "REMOTE_TO_LOCAL")
+        self.assertEqual(self._value(SYNC_ROWS, "products", "REMOTE_TO_LOCAL"), rows_before + 7)
+
+
+# ----------------------------------------------------------------------
+# 23. 请求性能采样测试
+# ----------------------------------------------------------------------
+@override_settings(
+    REQUEST_PROFILING_ENABLED=True,
+    REQUEST_PROFILE_SAMPLE_RATE=1,
+    REQUEST_PROFILE_BUDGETS={"*": {"ms": 60000, "queries": 1000}},
+)
+class RequestProfilingTests(TestCase):
+    """测试请求性能采样中间件、视图预算和采样表"""
+
+    def setUp(self):
+        product = Product.objects.create(source_id="profile_p1", title="采样产品")
+        ProductVariation.objects.create(product=product, sku="s1")
+
+    def test_records_request(self):
+        response = self.client.get(reverse("product-list"))
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.view, "product-list")
+        self.assertEqual(profile.path, reverse("product-list"))
+        self.assertEqual(profile.status_code, 200)
+        self.assertGreater(profile.query_count, 0)
+        self.assertGreater(profile.duration_ms, 0)
+        self.assertEqual(profile.response_bytes, len(response.content))
+        self.assertEqual(profile.over_budget, [])
+
+    @override_settings(REQUEST_PROFILING_ENABLED=False)
+    def test_disabled(self):
+        self.client.get(reverse("product-list"))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(REQUEST_PROFILE_SAMPLE_RATE=0, REQUEST_PROFILE_BUDGETS={"product-list": {"queries": 0}})
+    def test_over_budget_always_saved(self):
+        with self.assertLogs("products.services.request_profiling", level="WARNING") as logs:
+            self.client.get(reverse("product-list"))
+        self.assertIn("queries", logs.output[0])
+        self.assertEqual(RequestProfile.objects.get().over_budget, ["queries"])
+
+        self.client.get(reverse("product-detail", args=[Product.objects.get().pk]))
+        self.assertEqual(RequestProfile.objects.count(), 1)
+
+    def test_duplicate_queries(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for _ in range(3):
+                list(Product.objects.filter(source_id="profile_p1"))
+            list(Product.objects.filter(source_id="other"))
+
+        summary = recorder.summary()
+        self.assertEqual(summary["query_count"], 4)
+        self.assertEqual(summary["duplicate_queries"], 2)
+        self.assertEqual(summary["top_repeated_count"], 4)
+        self.assertIn("SELECT", summary["top_repeated_sql"])
+
+    @override_settings(REQUEST_PROFILE_MAX_ROWS=2)
+    def test_trim_profiles(self):
+        for i in range(5):
+            RequestProfile.objects.create(view="v", method="GET", path=f"/{i}", status_code=200, duration_ms=1)
+        self.assertEqual(trim_profiles(), 3)
+        self.assertEqual(list(RequestProfile.objects.values_list("path", flat=True).order_by("pk")), ["/3", "/4"])
+
+    def test_admin_over_budget_filter(self):
+        RequestProfile.objects.create(view="slow", method="GET", path="/slow", status_code=200, duration_ms=1, over_budget=["ms"])
+        RequestProfile.objects.create(view="fast", method="GET", path="/fast", status_code=200, duration_ms=1)
+        admin_user = User.objects.create_superuser("profile_admin", "p@example.com", "pw")
+        self.client.force_login(admin_user)
+
+        response = self.client.get(reverse("admin:products_requestprofile_changelist"), {"over_budget": "yes"})
+
+        self.assertContains(response, "/slow")
+        self.assertNotContains(response, "/fast")
@@ -22,6 +22,13 @@ urlpatterns = [
     path("export/<int:product_id>/", views.export_product_json_view, name="export_product_json"),
     # n8n 分析功能
     path("n8n-analyze/<int:product_id>/", views.n8n_analyze_view, name="n8n_analyze"),
+    path(
+        "n8n-analyze/<int:product_id>/status/",
+        views.n8n_analyze_status_view,
+        name="n8n_analyze_status",
+    ),
+    # 任务指标 (JSON / Prometheus)
+    path("task-metrics/", views.task_metrics_view, name="task_metrics"),
     # 产品抓取视图
     path("fetch/", views.product_fetch_view, name="product_fetch"),
 ]
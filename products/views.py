@@ -1,13 +1,16 @@
 import json
 import logging
+from datetime import date, datetime
 
-import requests
 from django import forms
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, viewsets
+from rest_framework import filters, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
 logger = logging.getLogger(__name__)
 
@@ -18,15 +21,30 @@ from django.contrib import admin
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-# 导入 django-q 任务调度器
-from django_q.tasks import async_task
-
 # 导入模型和序列化器
-from .models import AIContentItem, Product, ProductVariation
-from .serializers import ProductSerializer, ProductVariationSerializer
-
-# 导入任务函数
-from .tasks import trigger_bright_data_task
+from .models import AIAnalysisJob, BulkOperation, Product, ProductVariation
+from .serializers import (
+    BulkOperationSerializer,
+    ProductBulkActionSerializer,
+    ProductSerializer,
+    ProductVariationSerializer,
+)
+from .services.ai_content import (
+    LATEST_ITEM_FIELDS,
+    InvalidCallback,
+    ingest_ai_callbacks,
+    latest_content_items,
+)
+from .services.ai_jobs import enqueue_analysis
+from .services.bulk_actions import submit_bulk_action
+from .services.media_export import stream_media_zip
+from .services.product_export import iter_ndjson
+from .services.product_history import SERIES_INTERVALS, history_series
+from .services.product_rollups import ROLLUP_DIMENSIONS, analytics_summary
+from .services.product_payload import build_product_payload
+from .services.scrape_requests import SKIP_REASONS, submit_scrape_requests
+from .services.snapshot_archive import archived_records
+from .services.task_metrics import TASK_METRIC_WINDOWS, prometheus_text, task_metrics
 
 
 class ProductViewSet(viewsets.ModelViewSet):
@@ -62,6 +80,192 @@ class ProductViewSet(viewsets.ModelViewSet):
             .order_by("-updated_at")
         )
 
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request):
+        """
+        批量操作 API：添加/移除标签、设置上架状态、触发图片下载或 AI 分析。
+        小批量直接以分块 UPDATE 执行；超过 BULK_ACTION_SYNC_LIMIT 时转入后台任务，
+        返回 operation_id 供查询进度。
+        """
+        serializer = ProductBulkActionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        params = {}
+        if "tags" in data:
+            params["tags"] = data["tags"]
+        if "available" in data:
+            params["available"] = data["available"]
+        if request.user.is_authenticated:
+            params["requested_by"] = request.user.get_username()
+
+        operation, affected = submit_bulk_action(
+            data["action"],
+            data["ids"],
+            params,
+            created_by=params.get("requested_by", ""),
+        )
+
+        if operation:
+            return Response(
+                {"status": "queued", "operation": BulkOperationSerializer(operation).data},
+                status=status.HTTP_202_ACCEPTED,
+            )
+        return Response({"status": "success", "affected": affected})
+
+    @action(detail=False, methods=["get"], url_path=r"bulk/(?P<operation_id>\d+)")
+    def bulk_status(self, request, operation_id=None):
+        """查询后台批量操作的进度"""
+        operation = get_object_or_404(BulkOperation, pk=operation_id)
+        return Response(BulkOperationSerializer(operation).data)
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request):
+        """
+        以 NDJSON 流式导出产品 (每行一个产品，格式同单个产品 JSON 导出)。
+        ids=1,2,3 指定产品；未指定时使用列表接口的过滤/搜索条件。
+        """
+        queryset = self.filter_queryset(Product.objects.all())
+        ids = [i for i in request.query_params.get("ids", "").split(",") if i.strip().isdigit()]
+        if ids:
+            queryset = queryset.filter(pk__in=ids)
+
+        filename = f"products_{timezone.now():%Y%m%d_%H%M%S}.ndjson"
+        response = StreamingHttpResponse(iter_ndjson(queryset), content_type="application/x-ndjson")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False, methods=["get"], url_path="media-zip")
+    def media_zip(self, request):
+        """
+        以 ZIP 流式下载多个产品的图片。
+        ids=1,2,3 指定产品；未指定时使用列表接口的过滤/搜索条件。
+        """
+        queryset = self.filter_queryset(Product.objects.order_by("id"))
+        ids = [i for i in request.query_params.get("ids", "").split(",") if i.strip().isdigit()]
+        if ids:
+            queryset = queryset.filter(pk__in=ids)
+
+        limit = getattr(settings, "MEDIA_EXPORT_MAX_PRODUCTS", 500)
+        if queryset.count() > limit:
+            return Response(
+                {"status": "error", "message": f"一次最多导出 {limit} 个产品的图片"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return media_zip_response(queryset)
+
+    @action(detail=False, methods=["get"], url_path="history")
+    def history(self, request):
+        """
+        多个产品的价格/销量/库存时间序列 (按列返回，便于绘图)。
+        ids=1,2,3 指定产品；未指定时使用列表接口的过滤/搜索条件。
+        可选参数：since / until (YYYY-MM-DD 或 ISO 时间)、interval=raw|day。
+        """
+        queryset = self.filter_queryset(Product.objects.all())
+        ids = [i for i in request.query_params.get("ids", "").split(",") if i.strip().isdigit()]
+        if ids:
+            queryset = queryset.filter(pk__in=ids)
+
+        interval = request.query_params.get("interval", "raw")
+        if interval not in SERIES_INTERVALS:
+            return Response(
+                {"status": "error", "message": f"interval 只支持 {', '.join(SERIES_INTERVALS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        bounds = {}
+        for name in ("since", "until"):
+            value = request.query_params.get(name)
+            if not value:
+                continue
+            try:
+                bounds[name] = datetime.fromisoformat(value)
+            except ValueError:
+                return Response(
+                    {"status": "error", "message": f"无效的时间: {value}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if timezone.is_naive(bounds[name]):
+                bounds[name] = timezone.make_aware(bounds[name])
+
+        limit = getattr(settings, "PRODUCT_HISTORY_MAX_PRODUCTS", 5000)
+        product_ids = list(queryset.order_by().values_list("pk", flat=True)[: limit + 1])
+        if len(product_ids) > limit:
+            return Response(
+                {"status": "error", "message": f"一次最多查询 {limit} 个产品的历史"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        series = history_series(product_ids, interval=interval, **bounds)
+        return Response({"interval": interval, "series": series})
+
+    @action(detail=False, methods=["get"], url_path="analytics")
+    def analytics(self, request):
+        """
+        按分类或店铺预聚合的产品统计 (数量、总销量、价格分位数、有货比例)。
+        参数：dimension=category|store、day (YYYY-MM-DD，默认最近一天)、limit (默认 50)。
+        """
+        dimension = request.query_params.get("dimension", "category")
+        if dimension not in ROLLUP_DIMENSIONS:
+            return Response(
+                {"status": "error", "message": f"dimension 只支持 {', '.join(ROLLUP_DIMENSIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            day = request.query_params.get("day")
+            day = date.fromisoformat(day) if day else None
+            limit = min(int(request.query_params.get("limit", 50)), 500)
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "无效的 day 或 limit 参数"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(analytics_summary(dimension, day=day, limit=limit))
+
+    @action(detail=True, methods=["get"], url_path="raw-history")
+    def raw_history(self, request, pk=None):
+        """
+        产品在快照归档中的原始采集记录 (新的在前)，通过索引直接读取，不扫描归档文件。
+        可选参数：limit (默认 10，最多 100)。
+        """
+        product = self.get_object()
+        try:
+            limit = min(int(request.query_params.get("limit", 10)), 100)
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "无效的 limit 参数"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            {"source_id": product.source_id, "records": archived_records(product.source_id, limit)}
+        )
+
+    @action(detail=True, methods=["get"], url_path="ai-content")
+    def ai_content(self, request, pk=None):
+        """
+        产品的最新 AI 内容 (每个类型/模型只返回最新一次生成)。
+        可选参数：content_type、ai_model；history=1 时附带最近的生成记录。
+        """
+        product = self.get_object()
+        items = latest_content_items(
+            [product.pk],
+            content_type=request.query_params.get("content_type"),
+            ai_model=request.query_params.get("ai_model"),
+        )
+        data = {
+            "product_id": product.pk,
+            "items": [
+                {field: getattr(item, field) for field in LATEST_ITEM_FIELDS} for item in items
+            ],
+        }
+        if request.query_params.get("history") in ("1", "true"):
+            data["generations"] = list(
+                product.ai_generations.values(
+                    "id", "ai_model", "prompt_version", "item_count", "duration_ms", "completed_at"
+                )[:20]
+            )
+        return Response(data)
+
 
 class ProductVariationViewSet(viewsets.ModelViewSet):
     """
@@ -108,6 +312,12 @@ class ProductUrlsForm(forms.Form):
             raise forms.ValidationError("请输入至少一个有效的 URL。")
         return urls
 
+    force = forms.BooleanField(
+        label="强制重新采集",
+        required=False,
+        help_text="忽略新鲜度检查，重新采集最近已采集过的输入 (正在采集中的输入仍会跳过)。",
+    )
+
 
 # ----------------------------------------------------
 # 🌟 View 定义 (已修改支持 Sidebar)
@@ -124,14 +334,21 @@ def product_fetch_view(request):
             logger.info(f"collection_mode: {collection_mode}")
 
             # 触发异步任务
-            async_task(
-                trigger_bright_data_task,
+            # 去重后进入待提交队列，由 scrape_request_flush 定时任务合并提交
+            queued, skipped = submit_scrape_requests(
                 urls_list,
                 collection_mode,
-                hook="products.tasks.log_task_completion",
+                requested_by=request.user.get_username(),
+                force=form.cleaned_data["force"],
             )
 
-            messages.success(request, f"成功提交 {len(urls_list)} 个任务。任务已转入后台异步处理。")
+            message = f"已提交 {queued} 个采集输入，将在 1 分钟内合并提交到 Bright Data。"
+            if skipped:
+                details = "，".join(
+                    f"{SKIP_REASONS.get(reason, reason)} {count} 个" for reason, count in skipped.items()
+                )
+                message += f" 已跳过：{details}。"
+            messages.success(request, message)
 
             # 重定向回 Products 列表页
             return redirect("admin:products_product_changelist")
@@ -161,8 +378,8 @@ def export_product_json_view(request, product_id):
     """生成并下载产品的 JSON 文件"""
     product = get_object_or_404(Product, pk=product_id)
 
-    # 提取数据 (抽取为通用函数以便复用)
-    product_data = _extract_product_data(product)
+    # 提取数据 (与批量导出、n8n 分析共用同一个 payload 构造器)
+    product_data = build_product_payload(product)
 
     # 生成响应
     response = JsonResponse(product_data, json_dumps_params={"indent": 4, "ensure_ascii": False})
@@ -170,213 +387,122 @@ def export_product_json_view(request, product_id):
     return response
 
 
+def media_zip_response(products):
+    """以流式响应返回所选产品全部图片的 ZIP，压缩包边下载边生成，不在内存中组装"""
+    filename = f"product_media_{timezone.now():%Y%m%d_%H%M%S}.zip"
+    response = StreamingHttpResponse(stream_media_zip(products), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
 # ============================================================
-# 2. 调用 n8n 分析功能
+# 2. 调用 n8n 分析功能 (异步任务)
 # ============================================================
 def n8n_analyze_view(request, product_id):
     """
-    1. 生成产品 JSON
-    2. 发送给 n8n Webhook
-    3. 接收 n8n 返回的优化文案
-    4. 更新 Product 的 description_1 和 description_2
+    提交 n8n AI 分析任务：
+    1. 创建 AIAnalysisJob 记录 (排队)
+    2. 由 django-q 在并发上限内发送给 n8n，不占用 gunicorn worker
+    3. n8n 回调 update_product_api 时关闭任务
     """
     product = get_object_or_404(Product, pk=product_id)
-    product_data = _extract_product_data(product)
-
-    n8n_webhook_url = getattr(settings, "N8N_WEBHOOK_OPTIMIZE_PRODUCT_URL", None)
-    logger.info(f"n8n_webhook_url: {n8n_webhook_url}")
-    logger.debug(f"product_data: {product_data}")
 
-    try:
-        # 发送请求给 n8n
-        # timeout 设置为 30秒，防止 n8n 处理太久导致 Django 卡死
-        response = requests.post(n8n_webhook_url, json=product_data, timeout=30)
-
-        if response.status_code == 200:
-            result = response.json()
-
-            # 🌟 预期 n8n 返回格式: {"desc_1": "...", "desc_2": "..."}
-            new_desc_1 = result.get("desc_1")
-            new_desc_2 = result.get("desc_2")
-
-            updated_fields = []
-            if new_desc_1:
-                product.description_1 = new_desc_1
-                updated_fields.append("Description 1")
-
-            if new_desc_2:
-                product.description_2 = new_desc_2
-                updated_fields.append("Description 2")
-
-            if updated_fields:
-                product.save()
-                messages.success(request, f"✅ AI 优化成功！已更新: {', '.join(updated_fields)}")
-            else:
-                messages.warning(
-                    request, "⚠️ n8n 调用成功，请稍后刷新页面查看内容。"
-                )
-        else:
-            messages.error(
-                request, f"❌ n8n 调用失败: HTTP {response.status_code} - {response.text}"
-            )
+    requested_by = request.user.get_username() if request.user.is_authenticated else ""
+    created = enqueue_analysis([product.pk], requested_by=requested_by)
 
-    except requests.exceptions.RequestException as e:
-        messages.error(request, f"❌ 连接 n8n 发生错误: {str(e)}")
+    if created:
+        messages.info(request, "🤖 AI 分析任务已提交，结果返回后页面会自动刷新。")
+    else:
+        messages.warning(request, "⚠️ 该产品已有进行中的 AI 分析任务，请稍后刷新页面查看。")
 
     # 操作完成后，重定向回产品详情页
     return redirect("admin:products_product_change", product_id)
 
 
-# ============================================================
-# 通用工具函数：提取产品数据
-# ============================================================
-def _extract_product_data(product):
-    """构造标准化的产品数据字典"""
-
-    # 获取图片列表
-    images = [img.original_url for img in product.product_images.all() if img.original_url]
-
-    return {
-        "id": product.source_id,
-        "title": product.title,
-        "category": product.category,
-        "url": product.url,
-        "price": str(product.final_price),
-        "description": product.description,  # 原始描述
-        "description_detail": product.desc_detail,  # 详细描述
-        "specifications": product.specifications,  # 规格参数
-        "images": images,  # 图片 URL 列表
-        # 如果有变体信息也可以加上
-        # "variations": [...]
-    }
+def n8n_analyze_status_view(request, product_id):
+    """返回产品最近一次 AI 分析任务的状态，供 Admin 页面轮询"""
+    job = AIAnalysisJob.objects.filter(product_id=product_id).order_by("-id").first()
+    if not job:
+        return JsonResponse({"status": None})
+
+    return JsonResponse(
+        {
+            "job_id": job.pk,
+            "status": job.status,
+            "is_open": job.is_open,
+            "error": job.error,
+            "created_at": job.created_at,
+            "completed_at": job.completed_at,
+        }
+    )
+
+
+def task_metrics_view(request):
+    """
+    django-q 任务指标：按任务函数的执行数、失败率、耗时 / 排队等待分位数，以及各队列积压。
+    参数：window=15m|1h|24h|7d (默认 1h)、format=prometheus (Prometheus 文本格式)。
+    """
+    window = request.GET.get("window", "1h")
+    if window not in TASK_METRIC_WINDOWS:
+        return JsonResponse(
+            {"status": "error", "message": f"window 只支持 {', '.join(TASK_METRIC_WINDOWS)}"},
+            status=400,
+        )
+    metrics = task_metrics(window)
+    if request.GET.get("format") == "prometheus":
+        return HttpResponse(prometheus_text(metrics), content_type="text/plain; version=0.0.4; charset=utf-8")
+    return JsonResponse(metrics)
 
 
 # ============================================================
-# 接收 n8n 回调 API (新增)
+# 接收 n8n 回调 API
 # ============================================================
 @csrf_exempt
 @require_POST
 def update_product_api(request):
-    API_SECRET = settings.N8N_API_SECRET
-    logger.info(f"API_SECRET: {API_SECRET}")
+    """
+    接收 n8n 回调并写入 AI 内容。支持两种请求体：
+
+    - 单个产品: {"api_key", "product_id", "model_name", "job_id", "idempotency_key", ...输出字段}
+    - 批量:     {"api_key", "items": [{"product_id", "model_name", ...}, ...]}
 
+    幂等键也可以通过 Idempotency-Key 请求头传入 (仅单个产品)。
+    """
     try:
         data = json.loads(request.body)
-        logger.debug(f"data: {data}")
 
-        if data.get("api_key") != API_SECRET:
+        if not isinstance(data, dict) or data.get("api_key") != settings.N8N_API_SECRET:
             return JsonResponse({"status": "error", "message": "Unauthorized"}, status=403)
 
-        p_id = data.get("product_id")
-        logger.info(f"product_id: {p_id}")
-        
-        if not p_id:
+        # 批量模式
+        if isinstance(data.get("items"), list):
+            results = ingest_ai_callbacks(data["items"])
+            return JsonResponse({"status": "success", "results": results})
+
+        if not data.get("product_id"):
             return JsonResponse({"status": "error", "message": "Product ID is required"}, status=400)
-        
-        # 获取模型名称，默认为 unknown
-        model_used = data.get("model_name", "unknown-model")
 
-        product = None
-        try:
-            # 尝试通过 source_id 查找
-            product = Product.objects.filter(source_id=p_id).first()
-            # 如果没找到，尝试通过主键查找
-            if not product:
-                product = Product.objects.filter(pk=p_id).first()
-        except (ValueError, TypeError):
-            # 如果 p_id 不是有效的数字，继续使用 None
-            pass
-            
-        if not product:
+        entry = dict(data)
+        header_key = request.headers.get("Idempotency-Key")
+        if header_key and not entry.get("idempotency_key"):
+            entry["idempotency_key"] = header_key
+
+        result = ingest_ai_callbacks([entry])[0]
+        logger.info(f"update_product_api: product_id={result['product_id']}, status={result['status']}")
+
+        if result["status"] == "not_found":
             return JsonResponse({"status": "error", "message": "Product not found"}, status=404)
+        if result["status"] == "duplicate":
+            return JsonResponse({"status": "duplicate"})
 
-        from django.db import transaction
-
-        with transaction.atomic():
-            # 这里的删除策略可以根据需求调整：
-            # 是删除该产品所有的旧草稿，还是只删除该产品下同一个模型生成的旧草稿？
-            # 建议：只删除该产品同类型的旧草稿，保留不同模型的对比数据
-            AIContentItem.objects.filter(product=product, status="draft").delete()
-
-            # 从 n8n 返回的 JSON 结构中提取 output 数据
-            output_data = None
-            if isinstance(data, list) and len(data) > 0 and isinstance(data[0], dict):
-                output_data = data[0].get("output")
-                
-            elif isinstance(data, dict) and "output" in data:
-                output_data = data.get("output")
-            else:
-                output_data = data
-
-            logger.debug(f"output_data extracted: {output_data}")
-
-            def create_items(data_list_zh, data_list_en, type_key):
-                # -------------------------------------------------------
-                # 修复逻辑：兼容 String 和 List
-                # -------------------------------------------------------
-
-                # 添加详细日志
-                logger.debug(f"create_items called - Type: {type_key}")
-                logger.debug(f"  data_list_zh type: {type(data_list_zh)}, value: {data_list_zh}")
-                logger.debug(f"  data_list_en type: {type(data_list_en)}, value: {data_list_en}")
-
-                # 处理中文输入
-                if isinstance(data_list_zh, list):
-                    zh_list = data_list_zh
-                elif isinstance(data_list_zh, str) and data_list_zh.strip():
-                    # 如果是字符串且不为空，转换成单元素列表
-                    zh_list = [data_list_zh]
-                else:
-                    zh_list = []
-
-                # 处理英文输入
-                if isinstance(data_list_en, list):
-                    en_list = data_list_en
-                elif isinstance(data_list_en, str) and data_list_en.strip():
-                    # 如果是字符串且不为空，转换成单元素列表
-                    en_list = [data_list_en]
-                else:
-                    en_list = []
-
-                # -------------------------------------------------------
-
-                length = max(len(zh_list), len(en_list))
-                logger.debug(f"Type: {type_key}, Length: {length}, zh_list length: {len(zh_list)}, en_list length: {len(en_list)}")
-
-                for i in range(length):
-                    created_item = AIContentItem.objects.create(
-                        product=product,
-                        ai_model=model_used,
-                        content_type=type_key,
-                        option_index=i + 1,
-                        # 安全获取索引，越界则填空字符串
-                        content_zh=zh_list[i] if i < len(zh_list) else "",
-                        content_en=en_list[i] if i < len(en_list) else "",
-                    )
-                    logger.debug(f"Created AIContentItem - ID: {created_item.id}, Type: {type_key}, Index: {i + 1}")
-
-            # 映射字段（需与 n8n 节点的输出 JSON 匹配）
-            # 使用 output_data 而不是 data，因为 n8n 返回的是 [{"output": {...}}]
-            logger.debug(f"output_data keys: {output_data.keys() if output_data else 'None'}")
-            logger.debug(f"desc_zh: {output_data.get('desc_zh')}")
-            logger.debug(f"desc_en: {output_data.get('desc_en')}")
-            logger.debug(f"script_zh: {output_data.get('script_zh')}")
-            logger.debug(f"script_en: {output_data.get('script_en')}")
-            logger.debug(f"voice_zh: {output_data.get('voice_zh')}")
-            logger.debug(f"voice_en: {output_data.get('voice_en')}")
-            logger.debug(f"img_p_zh: {output_data.get('img_p_zh')}")
-            logger.debug(f"img_p_en: {output_data.get('img_p_en')}")
-
-            create_items(output_data.get("desc_zh"), output_data.get("desc_en"), "desc")
-            create_items(output_data.get("script_zh"), output_data.get("script_en"), "script")
-            create_items(output_data.get("voice_zh"), output_data.get("voice_en"), "voice")
-            create_items(output_data.get("img_p_zh"), output_data.get("img_p_en"), "img_prompt")
-            create_items(output_data.get("vid_p_zh"), output_data.get("vid_p_en"), "vid_prompt")
-
-        return JsonResponse({"status": "success", "model": model_used})
+        return JsonResponse(
+            {"status": "success", "model": result["model"], "items": result["items"]}
+        )
 
     except json.JSONDecodeError:
         return JsonResponse({"status": "error", "message": "Invalid JSON"}, status=400)
+    except InvalidCallback as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
     except Exception as e:
         logger.error(f"Error in update_product_api: {str(e)}", exc_info=True)
         return JsonResponse({"status": "error", "message": str(e)}, status=500)
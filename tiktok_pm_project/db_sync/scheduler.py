@@ -4,6 +4,7 @@ from django_q.models import Schedule
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
+from tiktok_pm_project.task_queues import queue_cluster
 from .sync_manager import SyncManager
 
 logger = logging.getLogger(__name__)
@@ -33,6 +34,7 @@ def setup_db_sync_scheduler():
             existing_schedule.schedule_type = Schedule.MINUTES
             existing_schedule.minutes = sync_interval
             existing_schedule.next_run = timezone.now() + timedelta(minutes=sync_interval)
+            existing_schedule.cluster = queue_cluster('sync')
             existing_schedule.save()
         else:
             logger.info(f'创建新的同步任务，间隔: {sync_interval}分钟')
@@ -41,7 +43,8 @@ def setup_db_sync_scheduler():
                 name=task_name,
                 schedule_type=Schedule.MINUTES,
                 minutes=sync_interval,
-                repeats=-1
+                repeats=-1,
+                cluster=queue_cluster('sync')  # 在独立的 sync 队列中执行，不阻塞导入
             )
         
         logger.info(f'数据库同步定时任务已设置: 每{sync_interval}分钟执行一次')
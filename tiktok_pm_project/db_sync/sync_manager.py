@@ -3,9 +3,18 @@ from datetime import datetime
 from typing import List, Optional, Dict, Any
 from .config import SyncConfig, SyncType, SyncDirection, ConflictResolution, TableSyncConfig
 from .connection import DatabaseConnection
+from tiktok_pm_project import metrics
 
 logger = logging.getLogger(__name__)
 
+SYNC_RUNS = metrics.counter('tiktok_sync_runs_total', 'Database sync runs by status.', ('status',))
+SYNC_DURATION = metrics.histogram(
+    'tiktok_sync_duration_seconds',
+    'Duration of a full database sync run.',
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+SYNC_ROWS = metrics.counter('tiktok_sync_rows_total', 'Rows synced by table and direction.', ('table', 'direction'))
+
 
 class SyncManager:
     def __init__(self, config: Optional[SyncConfig] = None):
@@ -64,6 +73,8 @@ class SyncManager:
         
         result['end_time'] = datetime.now()
         result['duration'] = (result['end_time'] - result['start_time']).total_seconds()
+        SYNC_RUNS.inc(status=status)
+        SYNC_DURATION.observe(result['duration'])
         
         self._update_sync_log(log_id, status, result)
         return result
@@ -128,6 +139,7 @@ class SyncManager:
                 result['rows_affected'] = self._incremental_sync(
                     table_name, table_config, source_db, target_db
                 )
+            SYNC_ROWS.inc(result['rows_affected'], table=table_name, direction=direction)
             
         except Exception as e:
             logger.error(f"同步表 {table_name} ({direction}) 失败: {e}")
@@ -206,9 +206,10 @@ class Command(BaseCommand):
         monitor.set_database_monitor(db_config)
         
         def monitor_callback(metrics):
-            logger.info(f'监控指标 - 数据库连接: {metrics.get("database", {}).get("connection_pool", {}).get("active", 0)}, '
-                       f'CPU: {metrics.get("system", {}).get("cpu_percent", 0)}%, '
-                       f'内存: {metrics.get("system", {}).get("memory_percent", 0)}%')
+            logger.info(f'监控指标 - 数据库连接: {metrics.get("database", {}).get("connection_count", 0)}, '
+                        f'QPS: {metrics.get("database", {}).get("qps")}, '
+                        f'CPU: {metrics.get("system", {}).get("cpu_percent", 0)}%, '
+                        f'内存: {metrics.get("system", {}).get("memory_percent", 0)}%')
         
         monitor.add_callback(monitor_callback)
         
@@ -3,10 +3,11 @@ import psutil
 import subprocess
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Callable
+from typing import Dict, List, Any, Optional, Callable, Deque, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 import threading
+from collections import deque
 
 class MonitorStatus(Enum):
     HEALTHY = "healthy"
@@ -23,6 +24,10 @@ class DatabaseMetrics:
     uptime: int = 0
     database_size: float = 0.0
     table_count: int = 0
+    table_locks_waited: int = 0
+    qps: Optional[float] = None
+    slow_queries_per_sec: Optional[float] = None
+    timestamp: datetime = field(default_factory=datetime.now)
     status: MonitorStatus = MonitorStatus.UNKNOWN
     
     def to_dict(self) -> Dict[str, Any]:
@@ -34,6 +39,10 @@ class DatabaseMetrics:
             'uptime': self.uptime,
             'database_size': self.database_size,
             'table_count': self.table_count,
+            'table_locks_waited': self.table_locks_waited,
+            'qps': self.qps,
+            'slow_queries_per_sec': self.slow_queries_per_sec,
+            'timestamp': self.timestamp.isoformat(),
             'status': self.status.value
         }
 
@@ -80,62 +89,142 @@ class SystemMetrics:
         }
 
 class DatabaseMonitor:
-    def __init__(self, db_config: Dict[str, Any], logger: logging.Logger):
+    # 一次 SHOW GLOBAL STATUS 取回的状态变量；Questions / Slow_queries 是累计值，速率由相邻两次采样的差值计算
+    STATUS_VARIABLES = ('Threads_connected', 'Threads_running', 'Questions', 'Slow_queries',
+                        'Uptime', 'Table_locks_waited')
+    HISTORY_TABLE = 'db_monitor_history'
+    # MySQL/MariaDB 错误码：表不存在 (未执行 mariadb/init/01-init.sql)
+    ER_NO_SUCH_TABLE = 1146
+    # 写入失败后等待重试的聚合桶上限 (默认 5 分钟一个桶，约一天)，超出时丢弃最旧的
+    MAX_PENDING_BUCKETS = 288
+    # 慢查询速率超过该值 (条/秒) 时告警
+    SLOW_QUERY_RATE_WARNING = 0.1
+
+    def __init__(self, db_config: Dict[str, Any], logger: logging.Logger,
+                 max_history_size: int = 720, downsample_seconds: int = 300,
+                 retention_days: int = 30, table_count_interval: int = 300,
+                 persist: bool = True):
         self.db_config = db_config
         self.logger = logger
-        self.metrics_history: List[DatabaseMetrics] = []
-        self.max_history_size = 100
+        # 最近的原始采样 (环形缓冲区)；更长时间的趋势按 downsample_seconds 聚合后写入 db_monitor_history
+        self.max_history_size = max_history_size
+        self.metrics_history: Deque[DatabaseMetrics] = deque(maxlen=max_history_size)
+        self.downsample_seconds = downsample_seconds
+        self.retention_days = retention_days
+        self.table_count_interval = table_count_interval
+        self.persist = persist
+        self._connection = None
+        self._previous: Optional[Tuple[float, Dict[str, int]]] = None
+        self._table_count = 0
+        self._table_count_at: Optional[float] = None
+        self._bucket: Optional[Dict[str, Any]] = None
+        self._pending_rows: Deque[tuple] = deque(maxlen=self.MAX_PENDING_BUCKETS)
+
+    def _config(self, key: str, default: Any = None) -> Any:
+        # 兼容 pymysql 风格 (host / user) 和 Django DATABASES 风格 (HOST / USER / NAME) 的配置
+        django_keys = {'database': 'NAME'}
+        value = self.db_config.get(key)
+        if value in (None, ''):
+            value = self.db_config.get(django_keys.get(key, key.upper()))
+        return default if value in (None, '') else value
+
+    def _connect(self):
+        import pymysql
+
+        return pymysql.connect(
+            host=self._config('host', 'localhost'),
+            port=int(self._config('port', 3306)),
+            user=self._config('user', 'root'),
+            password=self._config('password', ''),
+            database=self._config('database', 'information_schema'),
+            autocommit=True,
+            connect_timeout=5,
+            read_timeout=10,
+            write_timeout=10
+        )
+
+    def _execute(self, sql: str, params: Optional[tuple] = None) -> List[tuple]:
+        """在持久连接上执行；连接失效时重连一次后重试"""
+        import pymysql
+
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                with self._connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return list(cursor.fetchall())
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                self.close()
+                if attempt:
+                    raise
+        return []
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _read_status(self) -> Dict[str, int]:
+        placeholders = ', '.join(['%s'] * len(self.STATUS_VARIABLES))
+        rows = self._execute(
+            f"SHOW GLOBAL STATUS WHERE Variable_name IN ({placeholders})",
+            self.STATUS_VARIABLES
+        )
+        return {name: int(value) for name, value in rows}
+
+    def _read_table_count(self, now: float) -> int:
+        # information_schema 查询较重，每 table_count_interval 秒才刷新一次
+        if self._table_count_at is None or now - self._table_count_at >= self.table_count_interval:
+            rows = self._execute(
+                "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s",
+                (self._config('database'),)
+            )
+            self._table_count = int(rows[0][0]) if rows else 0
+            self._table_count_at = now
+        return self._table_count
+
+    def _rates(self, now: float, status: Dict[str, int]) -> Tuple[Optional[float], Optional[float]]:
+        previous, self._previous = self._previous, (now, status)
+        if previous is None:
+            return None, None
+
+        previous_time, previous_status = previous
+        elapsed = now - previous_time
+        # 计数器变小或 Uptime 倒退说明数据库重启过，本次不计算速率
+        restarted = status.get('Uptime', 0) < previous_status.get('Uptime', 0) or any(
+            status.get(name, 0) < previous_status.get(name, 0) for name in ('Questions', 'Slow_queries')
+        )
+        if elapsed <= 0 or restarted:
+            return None, None
+
+        qps = (status.get('Questions', 0) - previous_status.get('Questions', 0)) / elapsed
+        slow = (status.get('Slow_queries', 0) - previous_status.get('Slow_queries', 0)) / elapsed
+        return round(qps, 3), round(slow, 4)
     
     def get_current_metrics(self) -> DatabaseMetrics:
         metrics = DatabaseMetrics()
         
         try:
-            import pymysql
-            
-            connection = pymysql.connect(
-                host=self.db_config.get('host', 'localhost'),
-                port=self.db_config.get('port', 3306),
-                user=self.db_config.get('user', 'root'),
-                password=self.db_config.get('password', ''),
-                database=self.db_config.get('database', 'information_schema')
-            )
-            
-            with connection.cursor() as cursor:
-                cursor.execute("SHOW STATUS LIKE 'Threads_connected'")
-                result = cursor.fetchone()
-                metrics.connection_count = int(result[1]) if result else 0
-                
-                cursor.execute("SHOW STATUS LIKE 'Threads_running'")
-                result = cursor.fetchone()
-                metrics.active_connections = int(result[1]) if result else 0
-                
-                cursor.execute("SHOW STATUS LIKE 'Questions'")
-                result = cursor.fetchone()
-                metrics.query_count = int(result[1]) if result else 0
-                
-                cursor.execute("SHOW STATUS LIKE 'Slow_queries'")
-                result = cursor.fetchone()
-                metrics.slow_queries = int(result[1]) if result else 0
-                
-                cursor.execute("SHOW STATUS LIKE 'Uptime'")
-                result = cursor.fetchone()
-                metrics.uptime = int(result[1]) if result else 0
-                
-                cursor.execute("SHOW STATUS LIKE 'Table_locks_waited'")
-                result = cursor.fetchone()
-                table_locks = int(result[1]) if result else 0
-                
-                cursor.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = %s", 
-                             (self.db_config.get('database'),))
-                result = cursor.fetchone()
-                metrics.table_count = int(result[0]) if result else 0
-            
-            connection.close()
+            now = time.monotonic()
+            status = self._read_status()
+            metrics.connection_count = status.get('Threads_connected', 0)
+            metrics.active_connections = status.get('Threads_running', 0)
+            metrics.query_count = status.get('Questions', 0)
+            metrics.slow_queries = status.get('Slow_queries', 0)
+            metrics.uptime = status.get('Uptime', 0)
+            metrics.table_locks_waited = status.get('Table_locks_waited', 0)
+            metrics.qps, metrics.slow_queries_per_sec = self._rates(now, status)
+            metrics.table_count = self._read_table_count(now)
             
             metrics.status = self._evaluate_status(metrics)
             
         except Exception as e:
             self.logger.error(f"获取数据库指标失败: {e}")
+            self.close()
             metrics.status = MonitorStatus.CRITICAL
         
         self._add_to_history(metrics)
@@ -146,19 +235,118 @@ class DatabaseMonitor:
             return MonitorStatus.CRITICAL
         elif metrics.connection_count > 80:
             return MonitorStatus.WARNING
-        elif metrics.slow_queries > 10:
+        elif (metrics.slow_queries_per_sec or 0) > self.SLOW_QUERY_RATE_WARNING:
+            # 慢查询按速率判断 (Slow_queries 是数据库启动以来的累计值)
             return MonitorStatus.WARNING
         else:
             return MonitorStatus.HEALTHY
     
     def _add_to_history(self, metrics: DatabaseMetrics):
         self.metrics_history.append(metrics)
-        if len(self.metrics_history) > self.max_history_size:
-            self.metrics_history.pop(0)
+        if metrics.status != MonitorStatus.CRITICAL:
+            self._downsample(metrics)
     
     def get_metrics_history(self, minutes: int = 10) -> List[DatabaseMetrics]:
         cutoff_time = datetime.now() - timedelta(minutes=minutes)
-        return [m for m in self.metrics_history if m.status != MonitorStatus.UNKNOWN]
+        return [m for m in self.metrics_history
+                if m.timestamp >= cutoff_time and m.status != MonitorStatus.UNKNOWN]
+
+    # ------------------------------------------------------------------
+    # 长期趋势：按 downsample_seconds 聚合后写入 db_monitor_history
+    # ------------------------------------------------------------------
+
+    def _bucket_start(self, timestamp: datetime) -> datetime:
+        epoch = int(timestamp.timestamp())
+        return datetime.fromtimestamp(epoch - epoch % self.downsample_seconds)
+
+    def _downsample(self, metrics: DatabaseMetrics):
+        bucket_start = self._bucket_start(metrics.timestamp)
+        if self._bucket is not None and self._bucket['bucket_start'] != bucket_start:
+            self.flush_history()
+        if self._bucket is None:
+            self._bucket = {'bucket_start': bucket_start, 'samples': 0, 'connections_sum': 0,
+                            'connections_max': 0, 'running_sum': 0, 'qps': [], 'slow': []}
+
+        bucket = self._bucket
+        bucket['samples'] += 1
+        bucket['connections_sum'] += metrics.connection_count
+        bucket['connections_max'] = max(bucket['connections_max'], metrics.connection_count)
+        bucket['running_sum'] += metrics.active_connections
+        if metrics.qps is not None:
+            bucket['qps'].append(metrics.qps)
+            bucket['slow'].append(metrics.slow_queries_per_sec or 0.0)
+
+    def _bucket_row(self, bucket: Dict[str, Any]) -> tuple:
+        samples = bucket['samples']
+        qps, slow = bucket['qps'], bucket['slow']
+        return (
+            bucket['bucket_start'],
+            self.downsample_seconds,
+            samples,
+            round(bucket['connections_sum'] / samples, 2),
+            bucket['connections_max'],
+            round(bucket['running_sum'] / samples, 2),
+            round(sum(qps) / len(qps), 3) if qps else None,
+            max(qps) if qps else None,
+            round(sum(slow) / len(slow), 4) if slow else None,
+        )
+
+    def flush_history(self):
+        """
+        把当前聚合桶写入 db_monitor_history 并清理超过 retention_days 的记录。
+        写入失败的聚合桶保留在内存中，下次 flush 时重试；只有表不存在时才停止持久化。
+        """
+        bucket, self._bucket = self._bucket, None
+        if not self.persist:
+            return
+        if bucket and bucket['samples']:
+            self._pending_rows.append(self._bucket_row(bucket))
+        if not self._pending_rows:
+            return
+
+        try:
+            while self._pending_rows:
+                self._execute(
+                    f"INSERT INTO {self.HISTORY_TABLE} (bucket_start, bucket_seconds, samples, "
+                    "connections_avg, connections_max, running_avg, qps_avg, qps_max, slow_queries_per_sec) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE samples = VALUES(samples), connections_avg = VALUES(connections_avg), "
+                    "connections_max = VALUES(connections_max), running_avg = VALUES(running_avg), "
+                    "qps_avg = VALUES(qps_avg), qps_max = VALUES(qps_max), "
+                    "slow_queries_per_sec = VALUES(slow_queries_per_sec)",
+                    self._pending_rows[0]
+                )
+                self._pending_rows.popleft()
+            if self.retention_days:
+                self._execute(
+                    f"DELETE FROM {self.HISTORY_TABLE} WHERE bucket_start < %s",
+                    (datetime.now() - timedelta(days=self.retention_days),)
+                )
+        except Exception as e:
+            if e.args and e.args[0] == self.ER_NO_SUCH_TABLE:
+                # 表不存在时只保留内存中的采样
+                self.logger.warning(f"数据库监控历史表不存在，停止持久化: {e}")
+                self.persist = False
+                self._pending_rows.clear()
+            else:
+                # 连接中断、锁等待超时等临时错误：保留聚合桶，下次 flush 时重试
+                self.logger.error(
+                    f"写入数据库监控历史失败，{len(self._pending_rows)} 个聚合桶等待下次重试: {e}"
+                )
+
+    def get_long_term_history(self, hours: int = 24) -> List[Dict[str, Any]]:
+        columns = ('bucket_start', 'bucket_seconds', 'samples', 'connections_avg', 'connections_max',
+                   'running_avg', 'qps_avg', 'qps_max', 'slow_queries_per_sec')
+        try:
+            rows = self._execute(
+                f"SELECT {', '.join(columns)} FROM {self.HISTORY_TABLE} "
+                "WHERE bucket_start >= %s ORDER BY bucket_start",
+                (datetime.now() - timedelta(hours=hours),)
+            )
+        except Exception as e:
+            self.logger.error(f"读取数据库监控历史失败: {e}")
+            return []
+        return [dict(zip(columns, row)) for row in rows]
 
 class SyncMonitor:
     def __init__(self, logger: logging.Logger):
@@ -205,8 +393,8 @@ class SyncMonitor:
 class SystemMonitor:
     def __init__(self, logger: logging.Logger):
         self.logger = logger
-        self.metrics_history: List[SystemMetrics] = []
         self.max_history_size = 100
+        self.metrics_history: Deque[SystemMetrics] = deque(maxlen=self.max_history_size)
     
     def get_current_metrics(self) -> SystemMetrics:
         metrics = SystemMetrics()
@@ -252,8 +440,6 @@ class SystemMonitor:
     
     def _add_to_history(self, metrics: SystemMetrics):
         self.metrics_history.append(metrics)
-        if len(self.metrics_history) > self.max_history_size:
-            self.metrics_history.pop(0)
 
 class RealTimeMonitor:
     def __init__(self, logger: logging.Logger, interval: int = 5):
@@ -286,6 +472,9 @@ class RealTimeMonitor:
         self.is_monitoring = False
         if self.monitor_thread:
             self.monitor_thread.join(timeout=5)
+            if self.monitor_thread.is_alive():
+                # 监控线程仍在采集或休眠：数据库连接和聚合桶只由监控线程使用，它退出循环时再写入并关闭
+                self.logger.warning("监控线程未在 5 秒内退出，监控历史将在线程结束时写入")
         self.logger.info("实时监控已停止")
     
     def _monitor_loop(self):
@@ -303,6 +492,11 @@ class RealTimeMonitor:
                 self.logger.error(f"监控循环异常: {e}")
             
             time.sleep(self.interval)
+
+        # 在监控线程中写入最后的聚合桶并关闭连接，不与 stop() 所在线程并发使用同一个连接
+        if self.db_monitor:
+            self.db_monitor.flush_history()
+            self.db_monitor.close()
     
     def collect_metrics(self) -> Dict[str, Any]:
         metrics = {
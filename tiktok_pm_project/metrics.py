@@ -0,0 +1,376 @@
+"""
+跨进程的 Prometheus 指标注册表。
+
+各模块在模块级定义指标 (counter / histogram)，在当前进程内累加；
+设置了 METRICS_DIR 时，每个进程 (gunicorn worker、qcluster 的 worker / monitor) 由后台线程
+每 METRICS_FLUSH_SECONDS 秒把自己的累计值写入 METRICS_DIR/<主机名>_<pid>_<随机串>.json，
+GET /metrics 读取目录下所有文件相加后输出 Prometheus 文本格式。
+进程退出后文件保留 (计数不会倒退)，超过 METRICS_STALE_SECONDS 未更新的文件由
+compact_metrics 定时任务合并进 _archive.json 后删除。未设置 METRICS_DIR 时只输出当前进程的值。
+设置了 METRICS_TOKEN 时 /metrics 需要 Authorization: Bearer <METRICS_TOKEN>，未设置时允许匿名访问。
+"""
+
+import atexit
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+ARCHIVE_FILE = "_archive.json"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        unknown = set(labels) - set(self.labelnames)
+        if unknown:
+            raise ValueError(f"指标 {self.name} 没有标签: {', '.join(sorted(unknown))}")
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def describe(self):
+        return {"type": self.kind, "help": self.help, "labels": list(self.labelnames)}
+
+    def samples(self):
+        return [[list(key), value] for key, value in self._values.items()]
+
+    def reset(self):
+        self._values = {}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("counter 只能增加")
+        key = self._key(labels)
+        with self.registry.lock():
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def describe(self):
+        return {**super().describe(), "buckets": list(self.buckets)}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # [每个桶的计数..., +Inf 桶的计数, 总和]，总数由各桶计数相加得到
+        index = next(
+            (i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets)
+        )
+        with self.registry.lock():
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += value
+
+    def samples(self):
+        return [[list(key), list(value)] for key, value in self._values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # 进程文件名中的随机串：容器重启后 pid 可能重复，不能与已归档的文件同名
+        self._token = uuid.uuid4().hex[:8]
+        self._flusher_pid = None
+
+    def lock(self):
+        """更新指标前调用：fork 出的子进程清空从父进程继承的值，并按需启动写文件线程"""
+        if self._pid != os.getpid():
+            self._after_fork()
+        if self._flusher_pid != self._pid and metrics_dir():
+            self._start_flusher()
+        return self._lock
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._token = uuid.uuid4().hex[:8]
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def _register(self, cls, name, help_text, labelnames, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(self, name, help_text, labelnames, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"指标 {name} 已用不同的类型或标签定义")
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector):
+        """
+        注册在 /metrics 请求时执行的采集函数 (如队列积压)。
+        collector() 返回 [(指标名, 说明, [(标签 dict, 值), ...]), ...]，均按 gauge 输出。
+        """
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    # ------------------------------------------------------------------
+    # 进程文件
+    # ------------------------------------------------------------------
+
+    def dump(self):
+        with self._lock:
+            return {
+                name: {**metric.describe(), "samples": metric.samples()}
+                for name, metric in self.metrics.items()
+                if metric._values
+            }
+
+    def process_file(self):
+        return os.path.join(metrics_dir(), f"{socket.gethostname()}_{self._pid}_{self._token}.json")
+
+    def flush(self):
+        """把当前进程的累计值写入进程文件 (没有数据时也更新修改时间，表示进程仍在运行)"""
+        if not metrics_dir() or self._pid != os.getpid():
+            return
+        try:
+            _write_json(self.process_file(), {"pid": os.getpid(), "metrics": self.dump()})
+        except OSError as e:
+            logger.warning(f"写入指标文件失败: {e}")
+
+    def _start_flusher(self):
+        self._flusher_pid = self._pid
+        interval = getattr(settings, "METRICS_FLUSH_SECONDS", 10)
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.flush()
+
+        threading.Thread(target=run, name="metrics-flusher", daemon=True).start()
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # 输出
+    # ------------------------------------------------------------------
+
+    def collect(self):
+        """所有进程 (或只有当前进程) 的指标值之和：{指标名: {type, help, labels, buckets, samples}}"""
+        directory = metrics_dir()
+        if not directory:
+            return _merge([{"metrics": self.dump()}])
+
+        self.flush()
+        # 先读进程文件再读归档：compact_metrics 先写归档再删文件，
+        # 读到的文件如果已在归档的 merged 列表中则忽略，避免重复计数
+        files = {}
+        for name in _process_files(directory):
+            data = _read_json(os.path.join(directory, name))
+            if data is not None:
+                files[name] = data
+        archive = _read_json(os.path.join(directory, ARCHIVE_FILE)) or {}
+        for name in archive.get("merged", []):
+            files.pop(name, None)
+        return _merge([archive, *files.values()])
+
+    def render(self):
+        lines = []
+        for name, family in sorted(self.collect().items()):
+            lines += [f"# HELP {name} {family['help']}", f"# TYPE {name} {family['type']}"]
+            for labels, value in sorted(family["samples"].items()):
+                labels = dict(zip(family["labels"], labels))
+                if family["type"] == "counter":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(family["buckets"] + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning(
+                    f"指标采集函数 {getattr(collector, '__name__', collector)} 失败: {e}"
+                )
+                continue
+            for name, help_text, samples in families:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+                lines += [f"{name}{_labels(labels)} {_number(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+def metrics_dir():
+    return getattr(settings, "METRICS_DIR", "")
+
+
+def _process_files(directory):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [name for name in names if name.endswith(".json") and name != ARCHIVE_FILE]
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取指标文件 {path} 失败: {e}")
+        return None
+
+
+def _merge(dumps):
+    """把多个进程文件的指标相加；类型、标签或桶不一致的数据忽略"""
+    merged = {}
+    for dump in dumps:
+        for name, data in (dump.get("metrics") or {}).items():
+            family = merged.setdefault(
+                name,
+                {
+                    "type": data["type"],
+                    "help": data["help"],
+                    "labels": data["labels"],
+                    "buckets": data.get("buckets"),
+                    "samples": {},
+                },
+            )
+            if (family["type"], family["labels"], family["buckets"]) != (
+                data["type"],
+                data["labels"],
+                data.get("buckets"),
+            ):
+                logger.warning(f"指标 {name} 在不同进程中的定义不一致，忽略部分数据")
+                continue
+            samples = family["samples"]
+            for labels, value in data["samples"]:
+                key = tuple(labels)
+                if key not in samples:
+                    samples[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    samples[key] = [a + b for a, b in zip(samples[key], value)]
+                else:
+                    samples[key] += value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+counter = registry.counter
+histogram = registry.histogram
+register_collector = registry.register_collector
+
+
+def compact_metrics():
+    """
+    定时任务：把超过 METRICS_STALE_SECONDS 未更新的进程文件 (进程已退出) 合并进归档文件后删除，
+    返回合并的文件数。运行中的进程每 METRICS_FLUSH_SECONDS 秒更新一次自己的文件。
+    """
+    directory = metrics_dir()
+    if not directory:
+        return 0
+    cutoff = time.time() - getattr(settings, "METRICS_STALE_SECONDS", 600)
+
+    stale = []
+    for name in _process_files(directory):
+        try:
+            if os.path.getmtime(os.path.join(directory, name)) < cutoff:
+                stale.append(name)
+        except FileNotFoundError:
+            continue
+    if not stale:
+        return 0
+
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    archive = _read_json(archive_path) or {}
+    dumps = [archive]
+    for name in stale:
+        data = _read_json(os.path.join(directory, name))
+        if data is not None:
+            dumps.append(data)
+    merged = _merge(dumps)
+    metrics = {
+        name: {
+            "type": family["type"],
+            "help": family["help"],
+            "labels": family["labels"],
+            **({"buckets": family["buckets"]} if family["buckets"] is not None else {}),
+            "samples": [[list(labels), value] for labels, value in family["samples"].items()],
+        }
+        for name, family in merged.items()
+    }
+    # 先写归档 (记录已合并的文件名)，再删除进程文件
+    _write_json(archive_path, {"metrics": metrics, "merged": stale})
+    for name in stale:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    logger.info(f"合并了 {len(stale)} 个已退出进程的指标文件")
+    return len(stale)
+
+
+def metrics_view(request):
+    """Prometheus 抓取端点 (文本格式)；设置了 METRICS_TOKEN 时校验 Bearer token，未通过不执行采集"""
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(given.strip(), token):
+            response = HttpResponse("Unauthorized", status=401, content_type="text/plain")
+            response["WWW-Authenticate"] = 'Bearer realm="metrics"'
+            return response
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,49 @@
+"""
+项目级中间件。
+"""
+
+import time
+
+from django.db import connection
+
+from tiktok_pm_project import metrics
+
+REQUEST_DURATION = metrics.histogram(
+    "tiktok_http_request_duration_seconds",
+    "HTTP request latency by view.",
+    ("view", "method", "status"),
+)
+REQUEST_QUERIES = metrics.histogram(
+    "tiktok_http_request_queries",
+    "Database queries per HTTP request by view.",
+    ("view",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+
+class MetricsMiddleware:
+    """按视图记录请求耗时和数据库查询数 (view 为 URL 名称，未命名时为视图函数路径)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "<unresolved>"
+        REQUEST_DURATION.observe(
+            elapsed, view=view, method=request.method, status=f"{response.status_code // 100}xx"
+        )
+        REQUEST_QUERIES.observe(queries, view=view)
+        return response
@@ -107,6 +107,8 @@ INSTALLED_APPS = [
 # 中间件按顺序处理请求，按逆序处理响应
 # 每个中间件可以修改请求、响应或执行特定逻辑
 MIDDLEWARE = [
+    "tiktok_pm_project.middleware.MetricsMiddleware",  # 按视图统计请求耗时和查询数 (/metrics)
+    "products.middleware.RequestProfilingMiddleware",  # 请求性能采样 (REQUEST_PROFILING_ENABLED 开启时生效)
     "django.middleware.security.SecurityMiddleware",  # 安全相关的中间件，如HTTPS重定向
     "django.contrib.sessions.middleware.SessionMiddleware",  # 会话管理
     "django.middleware.common.CommonMiddleware",  # 常用中间件，处理URL规范化等
@@ -218,6 +220,24 @@ CACHES = {
 # 在多worker环境下，每个worker的内存是独立的，LocMemCache会导致会话不一致
 SESSION_ENGINE = "django.contrib.sessions.backends.db"
 
+# 命名任务队列：每个队列由独立的 qcluster 进程运行 (docker-compose 中的 worker_<队列名> 服务)，
+# 长任务不会阻塞其他类型的任务。启动方式：Q_CLUSTER_NAME=<队列名> python manage.py qcluster
+# - poll：Bright Data 轮询、采集请求提交、定期刷新调度 (短任务)
+# - import：snapshot 下载/保存/导入、批量操作、历史/汇总/店铺统计的定时重算
+# - media：产品图片下载
+# - sync：数据库同步 (run_db_sync)
+# - ai：n8n 分析任务及其维护任务
+# django-q 没有任务优先级，各队列通过独立的 worker 数和超时隔离
+# TASK_QUEUES_ENABLED 为 false 时 (本地只运行一个 qcluster) 所有任务进入默认队列
+TASK_QUEUES_ENABLED = os.environ.get("TASK_QUEUES_ENABLED", "false").lower() == "true"
+TASK_QUEUES = {
+    "poll": {"workers": int(os.environ.get("Q_POLL_WORKERS", "2")), "timeout": 120, "retry": 180},
+    "import": {"workers": int(os.environ.get("Q_IMPORT_WORKERS", "2")), "timeout": 900, "retry": 1200},
+    "media": {"workers": int(os.environ.get("Q_MEDIA_WORKERS", "2")), "timeout": 1800, "retry": 2400},
+    "sync": {"workers": int(os.environ.get("Q_SYNC_WORKERS", "1")), "timeout": 3600, "retry": 4000},
+    "ai": {"workers": int(os.environ.get("Q_AI_WORKERS", "2")), "timeout": 300, "retry": 360},
+}
+
 # Django-Q配置
 # Django-Q是一个分布式任务队列，用于执行异步任务和定时任务
 # 使用Django ORM作为broker，无需额外的Redis或Celery服务
@@ -238,6 +258,8 @@ Q_CLUSTER = {
     "scheduler": True,
     # 不使用单worker模式（sync模式会导致无限循环）
     "sync": False,
+    # 命名队列的配置 (覆盖上面的 workers / timeout / retry)，按 Q_CLUSTER_NAME 选择
+    "ALT_CLUSTERS": {name: dict(conf) for name, conf in TASK_QUEUES.items()},
 }
 
 
@@ -318,6 +340,10 @@ STATICFILES_DIRS = [
 # False: 仅保留产品数据中的原始图片 URL。
 IMAGE_DOWNLOAD_FLAG = False
 
+# 批量操作 (打标签、上下架、触发 AI/图片任务) 同步执行的产品数量上限
+# 超过该数量时转为 django-q 后台任务，并在 BulkOperation 中记录进度
+BULK_ACTION_SYNC_LIMIT = int(os.environ.get("BULK_ACTION_SYNC_LIMIT", "1000"))
+
 # ==========================================================
 # Bright Data / Zipline 配置 (从环境变量读取)
 # ==========================================================
@@ -377,10 +403,137 @@ if not N8N_API_SECRET:
 PRODUCT_MEDIA_DOWNLOAD_ROOT = os.getenv(
     "PRODUCT_MEDIA_DOWNLOAD_ROOT", os.path.join(BASE_DIR, "downloaded_products")
 )
+# 单个产品图片并行下载的线程数
+MEDIA_DOWNLOAD_WORKERS = int(os.environ.get("MEDIA_DOWNLOAD_WORKERS", "4"))
+# 图片 ZIP 打包导出一次最多包含的产品数
+MEDIA_EXPORT_MAX_PRODUCTS = int(os.environ.get("MEDIA_EXPORT_MAX_PRODUCTS", "500"))
+
+# Bright Data snapshot 轮询 (由 bright_data_poll_coordinator 定时任务统一执行)
+# - 有进展时按最小间隔轮询，连续无进展时指数退避到最大间隔
+# - 超过最大等待时间的 snapshot 标记为超时
+# - 已就绪 / 已下载超过租约时间仍未导入 (下载或导入任务异常退出) 的 snapshot 重新轮询
+BRIGHT_DATA_POLL_MIN_SECONDS = int(os.environ.get("BRIGHT_DATA_POLL_MIN_SECONDS", "10"))
+BRIGHT_DATA_POLL_MAX_SECONDS = int(os.environ.get("BRIGHT_DATA_POLL_MAX_SECONDS", "300"))
+BRIGHT_DATA_POLL_TICK_SECONDS = int(os.environ.get("BRIGHT_DATA_POLL_TICK_SECONDS", "50"))
+BRIGHT_DATA_SNAPSHOT_MAX_AGE_MINUTES = int(os.environ.get("BRIGHT_DATA_SNAPSHOT_MAX_AGE_MINUTES", "180"))
+BRIGHT_DATA_DOWNLOAD_LEASE_MINUTES = int(os.environ.get("BRIGHT_DATA_DOWNLOAD_LEASE_MINUTES", "60"))
+
+# 采集请求合并提交 (由 scrape_request_flush 定时任务每分钟执行)
+# - 新鲜度有效期内已采集的输入/产品不再重复提交 (0 表示不检查)
+# - 每次 trigger 最多包含的输入数量，超出后拆分为多次 trigger
+# - 被认领后超过租约仍未关联 snapshot 的请求 (worker 在 trigger 前崩溃) 退回等待提交
+SCRAPE_FRESHNESS_TTL_HOURS = int(os.environ.get("SCRAPE_FRESHNESS_TTL_HOURS", "6"))
+BRIGHT_DATA_MAX_INPUTS_PER_TRIGGER = int(os.environ.get("BRIGHT_DATA_MAX_INPUTS_PER_TRIGGER", "500"))
+SCRAPE_REQUEST_CLAIM_LEASE_MINUTES = int(os.environ.get("SCRAPE_REQUEST_CLAIM_LEASE_MINUTES", "10"))
+
+# 产品定期刷新 (由 product_refresh_scheduler 定时任务每小时执行)
+# - 每日最多提交的产品数，0 表示关闭定期刷新；预算按每小时平均分配
+# - 距上次采集不足 PRODUCT_REFRESH_MIN_AGE_HOURS 的产品不参与刷新
+# - 标签加权格式：candidate:3,hot:1.5
+PRODUCT_REFRESH_DAILY_BUDGET = int(os.environ.get("PRODUCT_REFRESH_DAILY_BUDGET", "0"))
+PRODUCT_REFRESH_MIN_AGE_HOURS = int(os.environ.get("PRODUCT_REFRESH_MIN_AGE_HOURS", "24"))
+PRODUCT_REFRESH_TAG_WEIGHTS = {
+    tag.strip(): float(weight)
+    for tag, _, weight in (
+        item.partition(":") for item in os.environ.get("PRODUCT_REFRESH_TAG_WEIGHTS", "candidate:3").split(",")
+    )
+    if tag.strip() and weight
+}
+
+# 产品价格/销量/库存历史 (由 product_history_compaction 定时任务每天整理)
+# - 超过 PRODUCT_HISTORY_RAW_DAYS 天的记录每个产品每天只保留一条
+# - 超过 PRODUCT_HISTORY_RETENTION_DAYS 天的记录删除 (0 表示永久保留)
+# - 历史接口一次最多查询的产品数
+PRODUCT_HISTORY_RAW_DAYS = int(os.environ.get("PRODUCT_HISTORY_RAW_DAYS", "30"))
+PRODUCT_HISTORY_RETENTION_DAYS = int(os.environ.get("PRODUCT_HISTORY_RETENTION_DAYS", "365"))
+PRODUCT_HISTORY_MAX_PRODUCTS = int(os.environ.get("PRODUCT_HISTORY_MAX_PRODUCTS", "5000"))
+
+# 产品汇总仪表盘 (admin Product Rollups 页面和 /api/products/analytics/) 的缓存时间 (秒)
+PRODUCT_ANALYTICS_CACHE_SECONDS = int(os.environ.get("PRODUCT_ANALYTICS_CACHE_SECONDS", "300"))
+
+# 快照归档 (gzip 压缩的 NDJSON + source_id 索引) 的存放目录，以及回放时的并行线程数
+SNAPSHOT_ARCHIVE_ROOT = os.environ.get("SNAPSHOT_ARCHIVE_ROOT", os.path.join(BASE_DIR, "data", "archive"))
+SNAPSHOT_REPLAY_WORKERS = int(os.environ.get("SNAPSHOT_REPLAY_WORKERS", "4"))
+
+# 任务大参数和任务历史 (由 task_storage_cleanup 定时任务每小时清理)
+# - snapshot 等大数据写入 TASK_PAYLOAD_ROOT，任务参数只传 key；任务成功后删除，
+#   未被删除 (任务失败) 的文件保留 TASK_PAYLOAD_RETENTION_HOURS 小时
+# - django_q_task 中超过 TASK_HISTORY_RETENTION_DAYS 天的记录删除 (0 表示不删除)
+# - 参数或结果超过 TASK_HISTORY_MAX_BYTES 的任务记录清空参数和结果 (0 表示不清空)
+TASK_PAYLOAD_ROOT = os.environ.get("TASK_PAYLOAD_ROOT", os.path.join(BASE_DIR, "data", "task_payloads"))
+TASK_PAYLOAD_RETENTION_HOURS = int(os.environ.get("TASK_PAYLOAD_RETENTION_HOURS", "48"))
+TASK_HISTORY_RETENTION_DAYS = int(os.environ.get("TASK_HISTORY_RETENTION_DAYS", "14"))
+TASK_HISTORY_MAX_BYTES = int(os.environ.get("TASK_HISTORY_MAX_BYTES", str(1024 * 1024)))
+
+# 任务执行指标 (django-q 信号写入 task_runs，/api/task-metrics/ 和 Admin 仪表盘读取)
+# - 汇总结果缓存秒数 (0 表示不缓存)
+# - 执行记录保留天数，由 task_storage_cleanup 定时任务清理 (0 表示不删除)
+TASK_METRICS_CACHE_SECONDS = int(os.environ.get("TASK_METRICS_CACHE_SECONDS", "30"))
+TASK_METRICS_RETENTION_DAYS = int(os.environ.get("TASK_METRICS_RETENTION_DAYS", "7"))
+
+# Prometheus 指标 (tiktok_pm_project/metrics.py，GET /metrics)
+# - METRICS_DIR：各进程 (gunicorn / qcluster) 写入指标文件的共享目录，/metrics 汇总所有进程；
+#   为空时只输出处理请求的进程自己的值
+# - 每个进程每 METRICS_FLUSH_SECONDS 秒写一次文件；超过 METRICS_STALE_SECONDS 未更新的文件
+#   (进程已退出) 由 metrics_compaction 定时任务合并进归档
+# - METRICS_TOKEN：设置后 /metrics 需要 Authorization: Bearer <token> (抓取时会查询队列积压)；
+#   为空时允许匿名访问，只应在内网或由 nginx 限制访问时留空
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_FLUSH_SECONDS = int(os.environ.get("METRICS_FLUSH_SECONDS", "10"))
+METRICS_STALE_SECONDS = int(os.environ.get("METRICS_STALE_SECONDS", "600"))
+
+# 请求性能采样 (products/middleware.py，默认关闭)
+# - 开启后记录每个请求的耗时、查询数 / 查询耗时、重复查询和响应大小
+# - 按 REQUEST_PROFILE_SAMPLE_RATE 抽样写入 request_profiles 表 (超出预算的请求总是写入)，
+#   只保留最近 REQUEST_PROFILE_MAX_ROWS 条
+# - REQUEST_PROFILE_BUDGETS：按视图名称 (URL 名称) 的预算，"*" 为默认值；超出时记录警告
+#   ms：请求耗时 (毫秒)，queries：查询数，query_ms：查询耗时 (毫秒)，duplicates：重复查询数
+REQUEST_PROFILING_ENABLED = os.environ.get("REQUEST_PROFILING_ENABLED", "False").lower() == "true"
+REQUEST_PROFILE_SAMPLE_RATE = float(os.environ.get("REQUEST_PROFILE_SAMPLE_RATE", "0.1"))
+REQUEST_PROFILE_MAX_ROWS = int(os.environ.get("REQUEST_PROFILE_MAX_ROWS", "5000"))
+REQUEST_PROFILE_BUDGETS = {
+    "*": {"ms": 2000, "queries": 100, "duplicates": 20},
+    "admin:products_product_changelist": {"ms": 1500, "queries": 30},
+    "admin:products_product_change": {"ms": 2000, "queries": 60},
+    "product-list": {"ms": 1000, "queries": 20},
+    "product-detail": {"ms": 500, "queries": 15},
+}
+
+# 外部 HTTP 服务 (bright_data / zipline / n8n / tiktok_cdn) 共享客户端 (products/services/http_client.py)
+# - 重试退避系数 (秒)：第 n 次重试前等待 backoff * 2^(n-1)
+# - 熔断：连续失败 HTTP_CIRCUIT_FAILURE_THRESHOLD 次后暂停请求 HTTP_CIRCUIT_RESET_SECONDS 秒 (0 表示不熔断)
+# - HTTP_CLIENT_SERVICES 按服务覆盖默认配置，例如 {"n8n": {"timeout": (10, 120)}}
+HTTP_CLIENT_BACKOFF = float(os.environ.get("HTTP_CLIENT_BACKOFF", "0.5"))
+HTTP_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("HTTP_CIRCUIT_FAILURE_THRESHOLD", "5"))
+HTTP_CIRCUIT_RESET_SECONDS = int(os.environ.get("HTTP_CIRCUIT_RESET_SECONDS", "30"))
+HTTP_CLIENT_SERVICES = {}
+
+# 外部服务跨进程限速 (令牌桶保存在 rate_limit_buckets 表，按服务 + 主机限速)
+# - HTTP_RATE_LIMITS 按服务覆盖默认速率，例如 {"bright_data": {"rate": 1, "burst": 3}}，rate 为 0 表示不限速
+#   block 大于 1 时一次取 block 个令牌在进程内逐个发放 (tiktok_cdn 默认 10，减少图片下载时锁定令牌桶的次数)
+# - 请求等待令牌的最长秒数，超过后抛出 RateLimitTimeout
+HTTP_RATE_LIMITS = {}
+HTTP_RATE_LIMIT_MAX_WAIT = int(os.environ.get("HTTP_RATE_LIMIT_MAX_WAIT", "60"))
 
 # N8N Webhook URL，用于触发产品优化工作流
 N8N_WEBHOOK_OPTIMIZE_PRODUCT_URL = os.environ.get("N8N_WEBHOOK_OPTIMIZE_PRODUCT_URL")
 
+# n8n AI 分析任务配置
+# - N8N_MAX_CONCURRENT_JOBS: 同时发送给 n8n 的任务上限，其余任务排队
+# - N8N_JOB_TIMEOUT_MINUTES: 超过该时间仍未收到回调的任务标记为失败
+N8N_MAX_CONCURRENT_JOBS = int(os.environ.get("N8N_MAX_CONCURRENT_JOBS", "3"))
+N8N_JOB_TIMEOUT_MINUTES = int(os.environ.get("N8N_JOB_TIMEOUT_MINUTES", "30"))
+
+# 产品 payload (导出 / n8n 分析) 缓存秒数，按 (产品, updated_at) 缓存，0 表示不缓存
+PRODUCT_PAYLOAD_CACHE_TIMEOUT = int(os.environ.get("PRODUCT_PAYLOAD_CACHE_TIMEOUT", "0"))
+
+# n8n 回调幂等键 (idempotency_key) 的保留天数，过期后由定时任务清理
+AI_CALLBACK_RECEIPT_RETENTION_DAYS = int(os.environ.get("AI_CALLBACK_RECEIPT_RETENTION_DAYS", "7"))
+
+# AI 内容超过该字节数时以 zlib 压缩存储 (0 表示不压缩)
+AI_CONTENT_COMPRESS_MIN_BYTES = int(os.environ.get("AI_CONTENT_COMPRESS_MIN_BYTES", "4096"))
+
 # ==========================================================
 # 日志配置
 # ==========================================================
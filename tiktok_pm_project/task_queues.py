@@ -0,0 +1,25 @@
+"""
+django-q 命名任务队列的路由。
+
+settings.TASK_QUEUES 定义命名队列 (poll / import / media / sync / ai)，
+每个队列由一个独立的 qcluster 进程运行 (Q_CLUSTER_NAME=<队列名>，配置见 Q_CLUSTER["ALT_CLUSTERS"])。
+调用 async_task / schedule 时指定队列；TASK_QUEUES_ENABLED 关闭时 (本地只运行一个 qcluster)
+所有任务仍进入默认队列。
+"""
+
+from django.conf import settings
+
+
+def queue_cluster(queue):
+    """队列对应的 cluster 名称；未启用命名队列或队列未定义时返回 None (默认队列)"""
+    if getattr(settings, "TASK_QUEUES_ENABLED", False) and queue in getattr(
+        settings, "TASK_QUEUES", {}
+    ):
+        return queue
+    return None
+
+
+def queue_options(queue):
+    """传给 async_task 的关键字参数：{"cluster": 队列名}，使用默认队列时为 {}"""
+    cluster = queue_cluster(queue)
+    return {"cluster": cluster} if cluster else {}
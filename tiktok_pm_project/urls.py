@@ -23,6 +23,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from tiktok_pm_project.metrics import metrics_view
+
 # =========================================================
 # Django Admin 界面自定义设置
 # =========================================================
@@ -40,6 +42,7 @@ urlpatterns = [
     path("admin/", admin.site.urls),  # <--- 保持默认，不要包装！
     path("api/", include("products.urls")),
     path("api-auth/", include("rest_framework.urls", namespace="rest_framework")),
+    path("metrics", metrics_view, name="metrics"),  # Prometheus 抓取端点
 ]
 
 # 🌟 关键：使用 MEDIA_URL 和 MEDIA_ROOT 服务动态文件 🌟